@@ -111,6 +111,13 @@ REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379')
 match = re.match(r'redis:\/\/([^:]+):(\d+)', REDIS_URL)
 redis_host, redis_port = match.groups() if match else ('127.0.0.1', 6379)
 
+# Cache compartilhado entre os workers (roster das salas, chat/roster.py).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    },
+}
 
 CHANNEL_LAYERS = {
     'default': {
@@ -121,6 +128,98 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Tempo (s) que uma conexão continua contando como presente sem heartbeat.
+# O cliente envia heartbeat a cada 30s, então 90s tolera dois heartbeats perdidos.
+PRESENCE_LEASE_TTL = config('PRESENCE_LEASE_TTL', default=90, cast=int)
+# Janela (ms) em que deltas de presença idênticos são agrupados em um só.
+PRESENCE_DELTA_COALESCE_MS = config('PRESENCE_DELTA_COALESCE_MS', default=2000, cast=int)
+# Profile.last_seen é gravado em lote a partir do Redis (chat/last_seen.py):
+# a thread de flush de cada processo grava a cada LAST_SEEN_FLUSH_INTERVAL; a
+# janela de durabilidade é o TTL da trava do flush no cluster.
+LAST_SEEN_FLUSH_INTERVAL = config('LAST_SEEN_FLUSH_INTERVAL', default=15, cast=int)
+LAST_SEEN_DURABILITY_WINDOW = config('LAST_SEEN_DURABILITY_WINDOW', default=60, cast=int)
+
+# Pipeline de ingestão de mensagens (chat/ingest.py): um bulk_create por lote.
+INGEST_MAX_BATCH = config('INGEST_MAX_BATCH', default=100, cast=int)
+INGEST_MAX_LATENCY_MS = config('INGEST_MAX_LATENCY_MS', default=5, cast=int)
+
+# Indicador de digitação (chat/typing_indicator.py): no máximo um typing_update
+# por sala a cada intervalo; um sinal sem renovação expira após TYPING_TTL (s).
+TYPING_BROADCAST_INTERVAL_MS = config('TYPING_BROADCAST_INTERVAL_MS', default=500, cast=int)
+TYPING_TTL = config('TYPING_TTL', default=6, cast=int)
+
+# Lobby (chat/lobby.py): um room_counts por intervalo, só com as salas alteradas.
+LOBBY_BROADCAST_INTERVAL_MS = config('LOBBY_BROADCAST_INTERVAL_MS', default=1000, cast=int)
+LOBBY_ROOMS_PER_PAGE = config('LOBBY_ROOMS_PER_PAGE', default=20, cast=int)
+
+# Histórico paginado por cursor (chat/history.py).
+HISTORY_PAGE_SIZE = config('HISTORY_PAGE_SIZE', default=50, cast=int)
+HISTORY_MAX_PAGE_SIZE = config('HISTORY_MAX_PAGE_SIZE', default=100, cast=int)
+
+# Purge de salas excluídas (chat/purge.py): tamanho do lote e validade da
+# trava de um job; um job parado há mais que isso é retomado por outro processo.
+PURGE_CHUNK_SIZE = config('PURGE_CHUNK_SIZE', default=1000, cast=int)
+PURGE_LEASE_SECONDS = config('PURGE_LEASE_SECONDS', default=60, cast=int)
+
+# Retenção do histórico (chat/archive.py): mensagens mais antigas que
+# HISTORY_RETENTION_DAYS (0 = sem limite; cada sala pode definir o seu) vão
+# para segmentos gzip em ARCHIVE_ROOT, de até ARCHIVE_SEGMENT_SIZE mensagens
+# em blocos de ARCHIVE_BLOCK_SIZE.
+HISTORY_RETENTION_DAYS = config('HISTORY_RETENTION_DAYS', default=0, cast=int)
+ARCHIVE_ROOT = config('ARCHIVE_ROOT', default=BASE_DIR / 'archive')
+ARCHIVE_SEGMENT_SIZE = config('ARCHIVE_SEGMENT_SIZE', default=5000, cast=int)
+ARCHIVE_BLOCK_SIZE = config('ARCHIVE_BLOCK_SIZE', default=200, cast=int)
+
+# Busca no histórico (chat/search.py).
+SEARCH_PAGE_SIZE = config('SEARCH_PAGE_SIZE', default=20, cast=int)
+SEARCH_MAX_PAGE_SIZE = config('SEARCH_MAX_PAGE_SIZE', default=50, cast=int)
+
+# Limites do ChatConsumer (chat/ratelimit.py). Frames maiores que
+# WS_MAX_FRAME_BYTES são descartados antes do parse. Limites de taxa por
+# classe de ação no formato '<rajada>/<segundos>', por conexão e por usuário.
+WS_MAX_FRAME_BYTES = config('WS_MAX_FRAME_BYTES', default=16384, cast=int)
+WS_MAX_MESSAGE_LENGTH = config('WS_MAX_MESSAGE_LENGTH', default=2000, cast=int)
+WS_RATE_LIMITS_CONNECTION = {
+    'message': config('WS_RATE_MESSAGE_CONNECTION', default='5/5'),
+    'typing': config('WS_RATE_TYPING_CONNECTION', default='10/5'),
+    'heartbeat': config('WS_RATE_HEARTBEAT_CONNECTION', default='3/30'),
+    'admin': config('WS_RATE_ADMIN_CONNECTION', default='10/10'),
+    'query': config('WS_RATE_QUERY_CONNECTION', default='10/5'),
+}
+WS_RATE_LIMITS_USER = {
+    'message': config('WS_RATE_MESSAGE_USER', default='10/5'),
+    'typing': config('WS_RATE_TYPING_USER', default='20/5'),
+    'heartbeat': config('WS_RATE_HEARTBEAT_USER', default='10/30'),
+    'admin': config('WS_RATE_ADMIN_USER', default='20/10'),
+    'query': config('WS_RATE_QUERY_USER', default='20/5'),
+}
+
+# Fila de saída por conexão (chat/outbound.py): tamanho máximo e atraso
+# máximo (s) antes de desconectar o cliente lento para ressincronizar.
+WS_SEND_QUEUE_MAX = config('WS_SEND_QUEUE_MAX', default=256, cast=int)
+WS_SEND_MAX_LAG_SECONDS = config('WS_SEND_MAX_LAG_SECONDS', default=10, cast=int)
+
+# Assinaturas (lobby + salas) simultâneas num mesmo socket /ws/multiplex/.
+WS_MULTIPLEX_MAX_STREAMS = config('WS_MULTIPLEX_MAX_STREAMS', default=20, cast=int)
+
+# Salas quentes (chat/hot_rooms.py): acima de HOT_ROOM_BATCH_RATE msg/s os
+# eventos vão em lotes a cada HOT_ROOM_BATCH_MS; acima de
+# HOT_ROOM_SLOW_MODE_RATE liga o modo lento por HOT_ROOM_SLOW_MODE_HOLD_SECONDS,
+# com SLOW_MODE_POSTS mensagens por usuário a cada SLOW_MODE_INTERVAL_SECONDS.
+HOT_ROOM_BATCH_RATE = config('HOT_ROOM_BATCH_RATE', default=10, cast=int)
+HOT_ROOM_BATCH_MS = config('HOT_ROOM_BATCH_MS', default=250, cast=int)
+HOT_ROOM_SLOW_MODE_RATE = config('HOT_ROOM_SLOW_MODE_RATE', default=30, cast=int)
+HOT_ROOM_SLOW_MODE_HOLD_SECONDS = config('HOT_ROOM_SLOW_MODE_HOLD_SECONDS', default=60, cast=int)
+SLOW_MODE_POSTS = config('SLOW_MODE_POSTS', default=1, cast=int)
+SLOW_MODE_INTERVAL_SECONDS = config('SLOW_MODE_INTERVAL_SECONDS', default=10, cast=int)
+
+# Salas com pelo menos LARGE_ROOM_THRESHOLD usuários online entram no fan-out
+# por worker (chat/fanout.py) e saem abaixo da metade. 0 desliga.
+LARGE_ROOM_THRESHOLD = config('LARGE_ROOM_THRESHOLD', default=300, cast=int)
+
+# Contadores em chat/metrics.py: intervalo mínimo entre gravações no Redis.
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=int)
+
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'index'
 LOGOUT_REDIRECT_URL = 'index'
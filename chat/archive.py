@@ -0,0 +1,198 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchiveSegment, ChatMessage
+from . import search
+
+# Arquivo frio do histórico. Mensagens de uma sala mais antigas que a
+# retenção saem do banco e vão para segmentos em ARCHIVE_ROOT/<sala>/: cada
+# segmento é escrito uma única vez, como uma sequência de membros gzip
+# independentes (blocos de ARCHIVE_BLOCK_SIZE linhas NDJSON). O índice
+# esparso em ArchiveSegment.blocks permite ler só o bloco necessário.
+# Tudo que está no arquivo é mais antigo que o que ficou no banco, e os ids
+# são preservados, então os cursores do histórico valem nos dois lados.
+#
+# Respostas cujo original foi arquivado perdem a citação no banco
+# (parent é SET_NULL); no arquivo a citação fica gravada junto da mensagem.
+
+
+def retention_days(room):
+    if room.retention_days is not None:
+        return room.retention_days
+    return settings.HISTORY_RETENTION_DAYS
+
+
+def _record(message):
+    parent = None
+    if message.parent:
+        parent = {'author': message.parent.author.username, 'content': message.parent.content}
+    return {
+        'id': message.id,
+        'author_id': message.author_id,
+        'username': message.author.username,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+        'parent': parent,
+        'deleted_for_everyone': message.is_deleted_for_everyone,
+    }
+
+
+def _full_path(relative_path):
+    return os.path.join(settings.ARCHIVE_ROOT, relative_path)
+
+
+def write_segment(room, messages):
+    relative_path = os.path.join(str(room.pk), f'{messages[0].id:012d}-{messages[-1].id:012d}.ndjson.gz')
+    full_path = _full_path(relative_path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+    blocks = []
+    temp_path = full_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        for start in range(0, len(messages), settings.ARCHIVE_BLOCK_SIZE):
+            chunk = messages[start:start + settings.ARCHIVE_BLOCK_SIZE]
+            lines = ''.join(json.dumps(_record(m), ensure_ascii=False) + '\n' for m in chunk)
+            data = gzip.compress(lines.encode('utf-8'))
+            blocks.append([chunk[0].id, f.tell(), len(data)])
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, full_path)
+
+    return ArchiveSegment(
+        room=room,
+        path=relative_path,
+        first_id=messages[0].id,
+        last_id=messages[-1].id,
+        first_timestamp=min(m.timestamp for m in messages),
+        last_timestamp=max(m.timestamp for m in messages),
+        message_count=len(messages),
+        blocks=blocks,
+    )
+
+
+# Um segmento por chamada: as mais antigas além da retenção, até
+# ARCHIVE_SEGMENT_SIZE. O arquivo é gravado antes; o registro do segmento e
+# a exclusão das linhas vão juntos numa transação. Se o processo cair no
+# meio, o arquivo órfão é sobrescrito na próxima execução.
+def compact_room(room, now=None):
+    days = retention_days(room)
+    if not days:
+        return 0
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    messages = list(
+        ChatMessage.objects.filter(room=room, timestamp__lt=cutoff)
+        .select_related('author', 'parent__author')
+        .order_by('timestamp', 'id')[:settings.ARCHIVE_SEGMENT_SIZE]
+    )
+    if not messages:
+        return 0
+    messages.sort(key=lambda m: m.id)
+
+    segment = write_segment(room, messages)
+    with transaction.atomic():
+        segment.save()
+        ChatMessage.objects.filter(id__in=[m.id for m in messages]).delete()
+        search.remove_messages(m.id for m in messages)
+    return len(messages)
+
+
+def delete_room_archive(room_id):
+    for relative_path in ArchiveSegment.objects.filter(room_id=room_id).values_list('path', flat=True):
+        try:
+            os.remove(_full_path(relative_path))
+        except FileNotFoundError:
+            pass
+    ArchiveSegment.objects.filter(room_id=room_id).delete()
+
+
+def _read_block(segment, block):
+    _, offset, length = block
+    with open(_full_path(segment.path), 'rb') as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length))
+    return [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+
+
+def contains(room, message_id):
+    return ArchiveSegment.objects.filter(room=room, first_id__lte=message_id, last_id__gte=message_id).exists()
+
+
+def has_archive(room):
+    return ArchiveSegment.objects.filter(room=room).exists()
+
+
+# Registros com id < before_id (ou os mais novos do arquivo, sem cursor),
+# até limit + 1, do mais novo para o mais antigo.
+def _scan_before(room, before_id, limit, visible):
+    segments = ArchiveSegment.objects.filter(room=room)
+    if before_id is not None:
+        segments = segments.filter(first_id__lt=before_id)
+    found = []
+    for segment in segments.order_by('-first_id').iterator():
+        for block in reversed(segment.blocks):
+            if before_id is not None and block[0] >= before_id:
+                continue
+            for record in reversed(_read_block(segment, block)):
+                if (before_id is None or record['id'] < before_id) and visible(record['id']):
+                    found.append(record)
+                    if len(found) > limit:
+                        return found
+    return found
+
+
+def _scan_after(room, after_id, limit, visible):
+    found = []
+    segments = ArchiveSegment.objects.filter(room=room, last_id__gt=after_id).order_by('first_id')
+    for segment in segments.iterator():
+        blocks = segment.blocks
+        for index, block in enumerate(blocks):
+            next_first = blocks[index + 1][0] if index + 1 < len(blocks) else None
+            if next_first is not None and next_first <= after_id:
+                continue
+            for record in _read_block(segment, block):
+                if record['id'] > after_id and visible(record['id']):
+                    found.append(record)
+                    if len(found) > limit:
+                        return found
+    return found
+
+
+def read_before(room, before_id, limit, visible):
+    found = _scan_before(room, before_id, limit, visible)
+    return _to_messages(found[:limit][::-1]), len(found) > limit
+
+
+def read_after(room, after_id, limit, visible):
+    found = _scan_after(room, after_id, limit, visible)
+    return _to_messages(found[:limit]), len(found) > limit
+
+
+# Objetos com os mesmos atributos que history.serialize usa de um ChatMessage.
+# Mensagens de usuários que não existem mais ficam de fora, como no banco.
+def _to_messages(records):
+    authors = User.objects.select_related('profile').in_bulk({r['author_id'] for r in records})
+    messages = []
+    for record in records:
+        author = authors.get(record['author_id'])
+        if author is None:
+            continue
+        parent = record['parent']
+        messages.append(SimpleNamespace(
+            id=record['id'],
+            author=author,
+            author_id=author.id,
+            content=record['content'],
+            timestamp=datetime.fromisoformat(record['timestamp']),
+            parent=SimpleNamespace(author=SimpleNamespace(username=parent['author']), content=parent['content']) if parent else None,
+            is_deleted_for_everyone=record['deleted_for_everyone'],
+        ))
+    return messages
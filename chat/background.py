@@ -0,0 +1,40 @@
+import asyncio
+import logging
+
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Tarefas de fundo (tickers, entrega local). O event loop guarda só uma
+# referência fraca às tarefas: sem o conjunto abaixo elas podem ser coletadas
+# no meio do trabalho, e exceções nunca apareceriam no log.
+
+_tasks = set()
+
+
+# lock: chave da trava do ticker no Redis. Se a tarefa morrer com erro, a
+# trava é liberada na hora para a próxima atualização assumir, sem esperar a
+# expiração.
+def spawn(coro, name, lock=None):
+    task = asyncio.create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(lambda task: _done(task, lock))
+    return task
+
+
+def _done(task, lock):
+    _tasks.discard(task)
+    if task.cancelled() or task.exception() is None:
+        return
+    logger.error(f"Tarefa {task.get_name()} falhou: {task.exception()!r}", exc_info=task.exception())
+    if lock is not None:
+        spawn(_release(lock), name=f'release:{lock}')
+
+
+async def _release(lock):
+    try:
+        await get_redis().delete(lock)
+    except RedisError as e:
+        logger.error(f"Erro ao liberar a trava {lock}: {e}")
@@ -1,46 +1,121 @@
+import asyncio
 import json
+import re
 import secrets
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, urlencode
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.layers import get_channel_layer
 from channels.db import database_sync_to_async
-from django.core.cache import cache
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import ChatMessage, Profile, ChatRoom, ChatRoomBan, ChatRoomMute
+from .models import ChatMessage, Profile, ChatRoom, ChatRoomBan, ChatRoomMute, RoomMembership, DirectConversation
+from . import presence, roster, membership, last_seen, frames, typing_indicator, lobby, history, room_state, search, unread, direct, ratelimit, metrics, outbound, hot_rooms, fanout, background
+from .ingest import get_ingest_queue
 from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
-class LobbyConsumer(AsyncWebsocketConsumer):
+class FramedConsumerMixin:
+    # Negocia o subprotocolo 'msgpack' no handshake; sem ele, tudo segue em JSON.
+    use_msgpack = False
+    # Com fila de saída (chat/outbound.py), os frames passam por ela.
+    outbound = None
+
+    async def accept_framed(self):
+        self.use_msgpack = frames.SUBPROTOCOL in self.scope.get('subprotocols', [])
+        await self.accept(subprotocol=frames.SUBPROTOCOL if self.use_msgpack else None)
+
+    async def send_event(self, payload):
+        payload = dict(payload)
+        event_type = payload.pop('type')
+        if self.use_msgpack:
+            await self.send_frame(event_type, bytes_data=frames.pack(event_type, payload))
+        else:
+            await self.send_frame(event_type, text_data=frames.encode(event_type, payload))
+
+    # Erro estruturado para o cliente: code estável, message para exibir.
+    async def send_error(self, code, message, **details):
+        await self.send_event({'type': 'error', 'code': code, 'message': message, **details})
+
+    # O frame já vem serializado por quem enviou (ver chat/frames.py).
+    async def forward_frame(self, event):
+        if self.use_msgpack:
+            await self.send_frame(event['type'], bytes_data=event['packed'])
+        else:
+            await self.send_frame(event['type'], text_data=event['frame'])
+
+    async def send_frame(self, event_type, text_data=None, bytes_data=None):
+        if self.outbound is None:
+            await self.send(text_data=text_data, bytes_data=bytes_data)
+        else:
+            await self.outbound.put(event_type, text_data, bytes_data)
+
+    # O que já estava na fila sai antes do close (ex.: aviso de expulsão).
+    async def close(self, *args, **kwargs):
+        if self.outbound is not None and not self.outbound.evicted:
+            await self.outbound.flush()
+            self.outbound.stop()
+        await super().close(*args, **kwargs)
+
+    # O limite é em bytes no fio: um caractere pode ocupar até 4 bytes em
+    # UTF-8, então o texto só é codificado quando pode passar do limite.
+    async def reject_oversized(self, text_data=None, bytes_data=None):
+        max_bytes = settings.WS_MAX_FRAME_BYTES
+        if text_data is not None:
+            too_large = len(text_data) > max_bytes // 4 and len(text_data.encode()) > max_bytes
+        else:
+            too_large = len(bytes_data or b'') > max_bytes
+        if too_large:
+            await metrics.incr('ws.frame_too_large')
+            await self.send_error('frame_too_large', 'Mensagem grande demais.', max_bytes=max_bytes)
+        return too_large
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return frames.unpack(bytes_data)
+        return json.loads(text_data)
+
+class LobbyConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
-        self.lobby_group_name = 'lobby'
+        self.lobby_group_name = lobby.GROUP_NAME
+        self.user = self.scope['user']
+        self.user_group_name = unread.user_group(self.user.id) if self.user.is_authenticated else None
         await self.channel_layer.group_add(
             self.lobby_group_name,
             self.channel_name
         )
-        await self.accept()
+        if self.user_group_name:
+            await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+        await self.accept_framed()
+        # Estado completo na conexão; depois só chegam as salas que mudaram.
+        await self.send_event({'type': 'room_counts', 'counts': await lobby.snapshot(), 'snapshot': True})
+        if self.user_group_name:
+            await self.send_event({'type': 'unread_snapshot', 'rooms': await self.load_read_cursors()})
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
             self.lobby_group_name,
             self.channel_name
         )
+        if self.user_group_name:
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
 
-    async def user_count_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_count_update',
-            'room_slug': event['room_slug'],
-            'user_count': event['user_count']
-        }))
+    # {slug: [sequência, lida]}; as sequências novas chegam em room_counts.
+    @database_sync_to_async
+    def load_read_cursors(self):
+        cursors = unread.cursors(self.user.id, membership.room_slugs(self.user))
+        return {slug: list(cursor) for slug, cursor in cursors.items()}
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    connected_users = {}
+    room_counts = FramedConsumerMixin.forward_frame
+    unread_update = FramedConsumerMixin.forward_frame
 
+class ChatConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_slug = self.scope['url_route']['kwargs']['room_slug']
         self.user = self.scope['user']
         self.left_explicitly = False
+        self.admitted = False
         self.room_group_name = f'chat_{self.room_slug}'
 
         if not self.user.is_authenticated:
@@ -48,12 +123,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        room = await self.get_room()
-        
+        # Snapshot da sala e das permissões desta conexão. Depois do connect ele
+        # só muda pelos eventos de grupo (admin_status_update, user_mute_update,
+        # mute_status_update, room_settings_update), sem consultar o banco.
+        room, self.is_admin, self.is_muted, self.banned_user = await self.load_access_snapshot()
+        self.room = room
+
         if room is None and not self.room_slug.startswith('dm-'):
             logger.warning(f"Sala {self.room_slug} não encontrada")
             await self.close(code=4004)
             return
+        if room is None and not await self.is_dm_participant():
+            logger.warning(f"Usuário {self.user.username} tentou entrar na conversa {self.room_slug} sem participar dela")
+            await self.close(code=4004)
+            return
             
         if room:
             if room.password:
@@ -79,79 +162,119 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         await self.close(code=4002)
                         return
 
-            self.banned_user = await self.is_user_banned(room, self.user)
             if self.banned_user:
                 logger.warning(f"Usuário {self.user.username} foi banido da sala {room.name}")
                 await self.close(code=4001)
                 return
 
-            current_users_count = len(self.connected_users.get(self.room_group_name, {}))
-            if hasattr(room, 'user_limit') and room.user_limit and current_users_count >= room.user_limit:
-                logger.warning(f"Limite de usuários atingido na sala {self.room_slug}")
-                await self.close(code=4003)
-                return
+        user_limit = room.user_limit if room else 0
+        self.admitted, user_count, first_connection = await presence.admit(self.room_slug, self.user.username, self.channel_name, user_limit)
+        if not self.admitted:
+            logger.warning(f"Limite de usuários atingido na sala {self.room_slug}")
+            await self.close(code=4003)
+            return
 
+        self.limiter = ratelimit.ConnectionLimiter(self.user.id)
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept_framed()
+        self.outbound = outbound.OutboundQueue(self)
+        await fanout.register(self.room_slug, self)
+        await fanout.update_mode(self.room_slug, user_count)
 
         if room:
-            is_admin = await self.is_admin_or_creator(room, self.user)
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 'type': 'room_state_update',
                 'is_muted': room.is_muted,
-                'is_admin': is_admin
-            }))
-
-        if self.room_group_name not in self.connected_users:
-            self.connected_users[self.room_group_name] = {}
-        self.connected_users[self.room_group_name][self.user.username] = self.channel_name
+                'is_admin': self.is_admin,
+                'slow_mode': await hot_rooms.slow_mode_state(self.room_slug),
+            })
 
+        if room:
+            await database_sync_to_async(membership.record_join)(room, self.user)
+        await self.mark_read()
         await self.update_last_seen()
         logger.info(f"Usuário {self.user.username} conectou à sala {self.room_slug}, last_seen atualizado")
 
-        if self.scope['session'].get('just_joined_room') == self.room_slug:
+        await self.send_roster_snapshot()
+
+        just_joined = self.scope['session'].get('just_joined_room') == self.room_slug
+        if just_joined:
             if not self.room_slug.startswith('dm-'):
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'system_message',
-                        'message': f'{self.user.username} entrou na sala.'
-                    }
-                )
+                await self.broadcast('system_message', {
+                    'message': f'{self.user.username} entrou na sala.',
+                })
             self.scope['session']['just_joined_room'] = None
 
-        await self.broadcast_user_list()
+        if just_joined or first_connection:
+            await self.broadcast_presence_delta('joined' if just_joined else 'online', self.user.username, with_profile=True)
+            await self.broadcast_user_count(user_count)
 
     async def disconnect(self, close_code):
-        if self.room_group_name in self.connected_users and self.user.username in self.connected_users[self.room_group_name]:
-            del self.connected_users[self.room_group_name][self.user.username]
+        if self.outbound is not None:
+            self.outbound.stop()
+        last_connection = False
+        if getattr(self, 'admitted', False):
+            await fanout.unregister(self.room_slug, self)
+            last_connection, user_count = await presence.release(self.room_slug, self.channel_name)
+            if last_connection:
+                await typing_indicator.update(self.room_slug, self.user.username, False)
+            await fanout.update_mode(self.room_slug, user_count)
 
         await self.update_last_seen()
         logger.info(f"Usuário {self.user.username} desconectou da sala {self.room_slug}, last_seen atualizado")
 
         if not self.left_explicitly and not self.room_slug.startswith('dm-') and not getattr(self, 'banned_user', False) and not getattr(self, 'kicked', False):
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'system_message',
-                    'message': f'{self.user.username} saiu da sala.'
-                }
-            )
+            await self.broadcast('system_message', {
+                'message': f'{self.user.username} saiu da sala.',
+            })
 
-        await self.broadcast_user_list()
+        if last_connection:
+            await self.broadcast_presence_delta('offline', self.user.username, last_seen=roster.format_last_seen(timezone.now()))
+            await self.broadcast_user_count(user_count)
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        if await self.reject_oversized(text_data, bytes_data):
+            return
+
         try:
-            text_data_json = json.loads(text_data)
+            text_data_json = self.decode_frame(text_data, bytes_data)
             message_type = text_data_json.get('type')
-        except json.JSONDecodeError:
-            logger.error(f"Erro ao decodificar JSON: {text_data}")
+        except (ValueError, AttributeError):
+            logger.error(f"Erro ao decodificar frame: {(text_data or bytes_data)[:200]!r}")
+            await metrics.incr('ws.invalid_frame')
             return
 
+        action_class = ratelimit.action_class(text_data_json)
+        if action_class is not None:
+            retry_after = await self.limiter.check(action_class)
+            if retry_after:
+                await metrics.incr(f'ws.rate_limited.{action_class}')
+                await self.send_error(
+                    'rate_limited', 'Você está enviando rápido demais. Aguarde um pouco.',
+                    action=action_class, retry_after=round(retry_after, 1),
+                )
+                return
+
         if message_type == 'leave_chat':
             await self.leave_chat(text_data_json)
             return
+        elif message_type == 'roster_sync':
+            await self.send_roster_snapshot()
+            return
+        elif message_type == 'fetch_history':
+            await self.send_history(text_data_json)
+            return
+        elif message_type == 'search':
+            await self.send_search_results(text_data_json)
+            return
+        elif message_type == 'mark_read':
+            try:
+                seq = int(text_data_json['seq']) if text_data_json.get('seq') is not None else None
+            except (TypeError, ValueError):
+                return
+            await self.mark_read(seq)
+            return
         elif message_type == 'admin_action':
             await self.handle_admin_action(text_data_json)
             return
@@ -164,46 +287,36 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             if scope == 'for_me' and message_id:
                 await self.delete_message_for_me(message_id)
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     'type': 'message_deleted_for_me',
                     'message_id': message_id
-                }))
+                })
             elif scope == 'for_everyone' and message_id:
                 deleted_by_author, error_message = await self.delete_message_for_everyone(message_id)
                 if deleted_by_author:
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'message_deleted_for_everyone',
-                            'message_id': message_id,
-                            'deleted_by_admin': False
-                        }
-                    )
+                    await self.broadcast('message_deleted_for_everyone', {
+                        'message_id': message_id,
+                        'deleted_by_admin': False,
+                    })
                 elif error_message:
-                    await self.send(text_data=json.dumps({
+                    await self.send_event({
                         'type': 'system_message',
                         'message': error_message
-                    }))
+                    })
             elif scope == 'admin_delete' and message_id:
-                room = await self.get_room()
-                is_admin = await self.is_admin_or_creator(room, self.user)
-                if is_admin:
+                if self.is_admin:
                     deleted, error_message = await self.delete_message_by_admin(message_id)
                     if deleted:
-                        await self.channel_layer.group_send(
-                            self.room_group_name,
-                            {
-                                'type': 'message_deleted_for_everyone',
-                                'message_id': message_id,
-                                'deleted_by_admin': True,
-                                'admin_username': self.user.username
-                            }
-                        )
+                        await self.broadcast('message_deleted_for_everyone', {
+                            'message_id': message_id,
+                            'deleted_by_admin': True,
+                            'admin_username': self.user.username,
+                        })
                     elif error_message:
-                        await self.send(text_data=json.dumps({
+                        await self.send_event({
                             'type': 'system_message',
                             'message': error_message
-                        }))
+                        })
             return
 
         username = self.user.username
@@ -212,30 +325,43 @@ class ChatConsumer(AsyncWebsocketConsumer):
         heartbeat = text_data_json.get('heartbeat')
 
         if heartbeat:
+            await self.renew_presence()
             await self.update_last_seen()
-            await self.send(text_data=json.dumps({'type': 'heartbeat','status': 'pong'}))
-            await self.broadcast_user_list()
+            await self.send_event({'type': 'heartbeat','status': 'pong'})
         elif message:
-            room = await self.get_room()
-            if room and room.is_muted and not await self.is_admin_or_creator(room, self.user):
-                await self.send(text_data=json.dumps({
+            if not isinstance(message, str) or len(message) > settings.WS_MAX_MESSAGE_LENGTH:
+                await metrics.incr('ws.message_too_long')
+                await self.send_error('message_too_long', 'Mensagem longa demais.', max_length=settings.WS_MAX_MESSAGE_LENGTH)
+                return
+
+            room = self.room
+            if room and room.is_muted and not self.is_admin:
+                await self.send_event({
                     'type': 'system_message',
                     'message': 'A sala está mutada. Apenas administradores podem enviar mensagens.'
-                }))
+                })
                 return
 
-            if room and await self.is_user_muted(room, self.user):
-                await self.send(text_data=json.dumps({
+            if room and self.is_muted:
+                await self.send_event({
                     'type': 'system_message',
                     'message': 'Você foi silenciado nesta sala e não pode enviar mensagens.'
-                }))
+                })
                 return
 
+            if room:
+                allowed, _, retry_after = await hot_rooms.allow_post(self.room_slug, self.user.id, exempt=self.is_admin)
+                if not allowed:
+                    await metrics.incr('ws.slow_mode')
+                    await self.send_error('slow_mode', 'Modo lento ativo. Aguarde para enviar outra mensagem.', retry_after=retry_after)
+                    return
+
             parent_id = text_data_json.get('reply_to')
-            room_name_to_save = room.name if room else self.room_slug
-            chat_message_obj = await self.save_message(self.user, room_name_to_save, message, parent_id)
+            chat_message_obj = await self.save_message(self.user, room, message, parent_id)
+            await typing_indicator.update(self.room_slug, username, False)
             
             avatar_url = await self.get_avatar_url(self.user)
+            await chat_message_obj.recorded
 
             parent_info = None
             if chat_message_obj.parent:
@@ -244,72 +370,88 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'content': chat_message_obj.parent.content,
                 }
             
-            await self.channel_layer.group_send(
-                self.room_group_name, {
-                    'type': 'chat_message',
-                    'id': chat_message_obj.id,
-                    'message': chat_message_obj.content,
-                    'username': username,
-                    'timestamp': timezone.localtime(chat_message_obj.timestamp).strftime('%H:%M'),
-                    'avatar_url': avatar_url,
-                    'parent': parent_info,
-                }
-            )
+            await self.broadcast('chat_message', {
+                'id': chat_message_obj.id,
+                'message': chat_message_obj.content,
+                'username': username,
+                'timestamp': timezone.localtime(chat_message_obj.timestamp).strftime('%H:%M'),
+                'avatar_url': avatar_url,
+                'parent': parent_info,
+                'seq': getattr(chat_message_obj, 'seq', None),
+            })
         elif is_typing is not None:
-            await self.channel_layer.group_send(
-                self.room_group_name, {
-                    'type': 'typing_signal',
-                    'username': username,
-                    'is_typing': is_typing
-                }
-            )
+            await typing_indicator.update(self.room_slug, username, bool(is_typing))
         
         elif text_data_json.get('type') == 'chat_settings':
-            room = await self.get_room()
-            is_admin = await self.is_admin_or_creator(room, self.user)
-            if not is_admin:
-                await self.send(text_data=json.dumps({
+            room = self.room
+            if not self.is_admin:
+                await self.send_event({
                     'type': 'system_message',
                     'message': 'Você não tem permissão para alterar as configurações da sala.'
-                }))
+                })
                 return
 
             new_room_name = text_data_json.get('room_name')
             user_limit = text_data_json.get('user_limit')
+            retention_days = text_data_json.get('retention_days')
 
-            updated_room, error = await self.update_chat_settings(room, new_room_name, user_limit)
+            updated_room, error = await self.update_chat_settings(room, new_room_name, user_limit, retention_days)
 
             if error:
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     'type': 'system_message',
                     'message': error
-                }))
+                })
             else:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'system_message',
-                        'message': f'As configurações da sala foram atualizadas por {self.user.username}.'
-                    }
-                )
+                await hot_rooms.send(self.room_slug, {
+                    'type': 'room_settings_update',
+                    'name': updated_room.name,
+                    'user_limit': updated_room.user_limit,
+                    'retention_days': updated_room.retention_days,
+                })
+                await self.broadcast('system_message', {
+                    'message': f'As configurações da sala foram atualizadas por {self.user.username}.',
+                })
+
+    # Também chamado pelo MultiplexConsumer, que recebe um heartbeat só para
+    # todas as salas do socket.
+    async def renew_presence(self):
+        username = self.user.username
+        renewed, gone_usernames = await presence.renew(self.room_slug, self.channel_name)
+        # Leases abandonados por workers que caíram viram "offline" para a sala.
+        for gone_username in gone_usernames:
+            if gone_username != username:
+                await self.broadcast_presence_delta('offline', gone_username, last_seen=roster.format_last_seen(timezone.now()))
+        if gone_usernames:
+            await self.broadcast_user_count(len(await presence.online_usernames(self.room_slug)))
+
+        if not renewed:
+            # O lease expirou (ex.: pausa longa): volta pelo mesmo caminho do
+            # connect, com o limite da sala e o delta 'online' para o roster.
+            admitted, user_count, first_connection = await presence.admit(
+                self.room_slug, username, self.channel_name, self.room.user_limit if self.room else 0,
+            )
+            if not admitted:
+                logger.warning(f"Limite de usuários atingido na sala {self.room_slug} ao renovar a presença de {username}")
+                await self.close(code=4003)
+                return
+            await fanout.update_mode(self.room_slug, user_count)
+            if first_connection:
+                await self.broadcast_presence_delta('online', username, with_profile=True)
+                await self.broadcast_user_count(user_count)
 
     async def leave_chat(self, event):
         self.left_explicitly = True
         if not self.room_slug.startswith('dm-'):
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'system_message',
-                    'message': f'{self.user.username} saiu da sala.'
-                }
-            )
-        await self.broadcast_user_list()
+            await self.broadcast('system_message', {
+                'message': f'{self.user.username} saiu da sala.',
+            })
+        await self.broadcast_presence_delta('left', self.user.username)
 
     async def handle_admin_action(self, data):
-        room = await self.get_room()
-        is_admin = await self.is_admin_or_creator(room, self.user)
-        if not is_admin:
-            await self.send(text_data=json.dumps({'type': 'system_message', 'message': 'Você não tem permissão de administrador.'}))
+        room = self.room
+        if not self.is_admin:
+            await self.send_event({'type': 'system_message', 'message': 'Você não tem permissão de administrador.'})
             return
 
         action = data.get('action')
@@ -317,133 +459,227 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         if action == 'kick' and target_username:
             await self.kick_user(room, target_username)
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'system_message', 'message': f'{target_username} foi expulso da sala.'})
-            await self.broadcast_user_list()
+            await self.broadcast('system_message', {'message': f'{target_username} foi expulso da sala.'})
+            await self.broadcast_presence_delta('left', target_username)
+            await self.broadcast_user_count(len(await presence.online_usernames(self.room_slug)))
         elif action == 'promote' and target_username:
             await self.promote_user(room, target_username)
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'system_message', 'message': f'{target_username} foi promovido a administrador.'})
-            await self.broadcast_user_list()
+            await self.broadcast('system_message', {'message': f'{target_username} foi promovido a administrador.'})
+            await self.broadcast_presence_delta('promoted', target_username)
         elif action == 'demote' and target_username:
             await self.demote_user(room, target_username)
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'system_message', 'message': f'{target_username} foi rebaixado para membro.'})
-            await self.broadcast_user_list()
+            await self.broadcast('system_message', {'message': f'{target_username} foi rebaixado para membro.'})
+            await self.broadcast_presence_delta('demoted', target_username)
         elif action == 'mute_user' and target_username:
             try:
                 target_user = await database_sync_to_async(User.objects.get)(username=target_username)
                 mute_instance, created = await database_sync_to_async(ChatRoomMute.objects.get_or_create)(room=room, muted_user=target_user)
+                if not created:
+                    await database_sync_to_async(mute_instance.delete)()
+                await hot_rooms.send(
+                    self.room_slug,
+                    {'type': 'user_mute_update', 'target_username': target_username, 'is_muted': created}
+                )
                 message = f'{target_username} foi {"silenciado" if created else "desmutado"}.'
-                await self.channel_layer.group_send(self.room_group_name, {'type': 'system_message', 'message': message})
-                await self.broadcast_user_list()
+                await self.broadcast('system_message', {'message': message})
+                await self.broadcast_presence_delta('muted' if created else 'unmuted', target_username)
             except User.DoesNotExist:
-                await self.send(text_data=json.dumps({'type': 'system_message', 'message': f'Usuário {target_username} não encontrado.'}))
-        elif action == 'toggle_mute':
+                await self.send_event({'type': 'system_message', 'message': f'Usuário {target_username} não encontrado.'})
+        elif action == 'toggle_mute' and room:
             room.is_muted = not room.is_muted
-            await database_sync_to_async(room.save)()
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'mute_status_update',
-                    'is_muted': room.is_muted,
-                    'message': f'A sala foi {"mutada" if room.is_muted else "desmutada"} por um administrador.'
-                }
-            )
-
-    async def chat_message(self, event): await self.send(text_data=json.dumps(event))
-    async def system_message(self, event): await self.send(text_data=json.dumps(event))
-    async def user_list_update(self, event): await self.send(text_data=json.dumps(event))
-    async def typing_signal(self, event): await self.send(text_data=json.dumps(event))
-    async def heartbeat(self, event): await self.send(text_data=json.dumps(event))
-    async def user_status_update(self, event): await self.send(text_data=json.dumps(event))
-    async def message_deleted_for_me(self, event): await self.send(text_data=json.dumps(event))
-    async def message_deleted_for_everyone(self, event): await self.send(text_data=json.dumps(event))
-    async def room_state_update(self, event): await self.send(text_data=json.dumps(event))
-    async def mute_status_update(self, event): await self.send(text_data=json.dumps(event))
+            await database_sync_to_async(room.save)(update_fields=['is_muted'])
+            await self.broadcast('mute_status_update', {
+                'is_muted': room.is_muted,
+                'message': f'A sala foi {"mutada" if room.is_muted else "desmutada"} por um administrador.',
+            }, is_muted=room.is_muted)
+        elif action == 'slow_mode' and room and data.get('mode') in ('on', 'off', 'auto'):
+            state = await hot_rooms.set_override(self.room_slug, data['mode'])
+            await self.broadcast('slow_mode_update', state)
+            message = {
+                'on': 'O modo lento foi ativado por um administrador.',
+                'off': 'O modo lento foi desativado por um administrador.',
+                'auto': 'O modo lento voltou a ser automático.',
+            }[data['mode']]
+            await self.broadcast('system_message', {'message': message})
+
+    async def broadcast(self, event_type, payload, **internal):
+        # Em salas quentes os eventos vão em lote (ver chat/hot_rooms.py).
+        slow_change = await hot_rooms.broadcast(self.room_slug, event_type, payload, **internal)
+        if slow_change:
+            await self.broadcast('slow_mode_update', await hot_rooms.slow_mode_state(self.room_slug))
+            await self.broadcast('system_message', {
+                'message': 'Muitas mensagens: modo lento ativado.' if slow_change > 0 else 'O modo lento foi desativado.',
+            })
+
+    chat_message = FramedConsumerMixin.forward_frame
+    batch = FramedConsumerMixin.forward_frame
+    slow_mode_update = FramedConsumerMixin.forward_frame
+    system_message = FramedConsumerMixin.forward_frame
+    presence_delta = FramedConsumerMixin.forward_frame
+    message_deleted_for_everyone = FramedConsumerMixin.forward_frame
+
+    async def typing_update(self, event):
+        # Quem está digitando não recebe o próprio nome de volta; só nesse caso
+        # o frame é serializado de novo.
+        users = event['typing_users']
+        if self.user.username in users:
+            await self.send_event({'type': 'typing_update', 'users': [u for u in users if u != self.user.username]})
+        else:
+            await self.forward_frame(event)
+
+    async def mute_status_update(self, event):
+        if self.room:
+            self.room.is_muted = event['is_muted']
+        await self.forward_frame(event)
 
     async def admin_status_update(self, event):
         target_username = event.get('target_username')
         if self.user.username == target_username:
-            await self.send(text_data=json.dumps({'type': 'admin_status_update', 'is_admin': event.get('is_admin')}))
+            self.is_admin = event.get('is_admin') or (self.room is not None and self.room.creator_id == self.user.id)
+            await self.send_event({'type': 'admin_status_update', 'is_admin': self.is_admin})
+
+    async def user_mute_update(self, event):
+        if self.user.username == event.get('target_username'):
+            self.is_muted = event['is_muted']
+
+    async def room_settings_update(self, event):
+        if self.room:
+            self.room.name = event['name']
+            self.room.user_limit = event['user_limit']
+            self.room.retention_days = event['retention_days']
+
+    async def room_deleted(self, event):
+        await self.send_event({'type': 'system_message', 'message': 'Esta sala foi excluída.'})
+        self.kicked = True
+        await self.close(code=4004)
 
     async def force_disconnect(self, event):
-        await self.send(text_data=json.dumps({'type': 'system_message', 'message': 'Você foi expulso da sala.'}))
+        await self.send_event({'type': 'system_message', 'message': 'Você foi expulso da sala.'})
         self.kicked = True
         await self.close(code=4001)
 
-    async def broadcast_user_list(self):
-        user_count = len(self.connected_users.get(self.room_group_name, {}))
-        await database_sync_to_async(cache.set)(f'chat_{self.room_slug}', user_count, timeout=None)
-
-        await self.channel_layer.group_send(
-            'lobby',
-            {
-                'type': 'user_count_update',
-                'room_slug': self.room_slug,
-                'user_count': user_count
-            }
-        )
+    async def send_roster_snapshot(self):
+        # A versão é lida antes de montar o roster: deltas com versão maior
+        # que a do snapshot ainda serão aplicados pelo cliente (são idempotentes).
+        version = await presence.roster_version(self.room_slug)
+        connected_usernames = await presence.online_usernames(self.room_slug)
+        profiles = await self.get_profiles_in_room(connected_usernames, self.room)
+        await self.send_event({'type': 'user_list_update', 'version': version, 'users': profiles})
+
+    async def send_history(self, data):
+        before, after = data.get('before'), data.get('after')
+        messages, has_more = await self.load_history(before, after, data.get('limit'))
+        await self.send_event({
+            'type': 'history',
+            'messages': messages,
+            'has_more': has_more,
+            'before': before,
+            'after': after,
+        })
+
+    async def send_search_results(self, data):
+        query = data.get('query', '')
+        results, next_cursor = await self.run_search(query, data.get('cursor'), data.get('limit'), data.get('everywhere'))
+        await self.send_event({
+            'type': 'search_results',
+            'query': query,
+            'results': results,
+            'next_cursor': next_cursor,
+        })
+
+    # Sem seq, marca a sala inteira como lida. O lobby do usuário é avisado.
+    async def mark_read(self, seq=None):
+        if self.room:
+            cursor = await unread.mark_read(self.user.id, self.room_slug, seq)
+            if cursor is None:
+                return
+            update = {'slug': self.room_slug, 'read': cursor[0], 'seq': cursor[1]}
+        else:
+            if not await self.mark_conversation_read():
+                return
+            update = {'slug': self.room_slug, 'unread': 0}
+        await self.channel_layer.group_send(unread.user_group(self.user.id), frames.group_event('unread_update', update))
 
-        connected_usernames = list(self.connected_users.get(self.room_group_name, {}).keys())
-        room = await self.get_room()
-        profiles = await self.get_profiles_in_room(connected_usernames, room)
-        await self.channel_layer.group_send(self.room_group_name, {'type': 'user_list_update', 'users': profiles})
+    async def broadcast_presence_delta(self, op, username, with_profile=False, **fields):
+        version = await presence.next_roster_version(self.room_slug, op, username)
+        if version is None:
+            return
+        delta = {'version': version, 'op': op, 'username': username, **fields}
+        if with_profile:
+            delta['user'] = await self.get_profile_entry(username, self.room)
+        await self.broadcast('presence_delta', delta)
+
+    async def broadcast_user_count(self, user_count):
+        # DMs não aparecem no lobby nem no ranking de salas ativas.
+        if not self.room_slug.startswith('dm-'):
+            await lobby.set_count(self.room_slug, user_count)
+
+    @database_sync_to_async
+    def get_profile_entry(self, username, room):
+        return roster.build_entry(room, username)
 
     @database_sync_to_async
     def get_profiles_in_room(self, connected_usernames, room):
-        user_list = []
-        usernames = set(connected_usernames)
-        
-        if room: # Public Room
-            past_users = ChatMessage.objects.filter(room_name=room.name).values_list('author__username', flat=True).distinct()
-            usernames.update(past_users)
-            muted_users = set(ChatRoomMute.objects.filter(room=room).values_list('muted_user__username', flat=True))
-        elif self.room_slug.startswith('dm-'): # DM Room
-            participant_string = self.room_slug[3:]
-            participants = participant_string.split('-')
-            usernames.update(participants)
-            muted_users = set()
-
-        for username in usernames:
-            try:
-                user = User.objects.select_related('profile').get(username=username)
-                last_seen = user.profile.last_seen
-                is_online = (timezone.now() - last_seen).total_seconds() < 60 if last_seen else False
-                
-                user_list.append({
-                    'username': user.username,
-                    'avatar_url': user.profile.avatar.url,
-                    'is_online': is_online, 
-                    'last_seen': last_seen.strftime('%d/%m às %H:%M') if last_seen else 'Nunca',
-                    'is_creator': room and room.creator == user,
-                    'is_admin': room and user in room.admins.all(),
-                    'is_muted': room and username in muted_users
-                })
-            except (User.DoesNotExist, Profile.DoesNotExist):
-                continue
-        return user_list
+        return roster.build_roster(room, self.room_slug, connected_usernames)
 
     @database_sync_to_async
-    def get_room(self):
+    def load_access_snapshot(self):
         if self.room_slug.startswith('dm-'):
-            return None
-        try:
-            return ChatRoom.objects.get(slug=self.room_slug)
-        except ChatRoom.DoesNotExist:
-            return None
+            return None, False, False, False
+        room = ChatRoom.objects.filter(slug=self.room_slug).first()
+        if room is None:
+            return None, False, False, False
+        is_admin = room.creator_id == self.user.id or room.admins.filter(id=self.user.id).exists()
+        is_muted = ChatRoomMute.objects.filter(room=room, muted_user=self.user).exists()
+        is_banned = ChatRoomBan.objects.filter(room=room, banned_user=self.user).exists()
+        return room, is_admin, is_muted, is_banned
+
+    @database_sync_to_async
+    def is_dm_participant(self):
+        conversation = direct.resolve(self.room_slug, self.user)
+        return conversation is not None and self.user.id in (conversation.user_a_id, conversation.user_b_id)
+
+    @database_sync_to_async
+    def load_history(self, before, after, limit):
+        conversation = None
+        if self.room is None:
+            conversation = DirectConversation.objects.filter(slug=self.room_slug).first()
+            if conversation is None or self.user.id not in (conversation.user_a_id, conversation.user_b_id):
+                return [], False
+        page, has_more = history.fetch_page(
+            self.user, room=self.room, conversation=conversation, before=before, after=after, limit=limit,
+        )
+        return [history.serialize(message) for message in page], has_more
+
+    @database_sync_to_async
+    def mark_conversation_read(self):
+        conversation = DirectConversation.objects.filter(slug=self.room_slug).first()
+        if conversation is None or self.user.id not in (conversation.user_a_id, conversation.user_b_id):
+            return False
+        direct.mark_read(conversation, self.user)
+        return True
+
+    # Por padrão só na sala/DM atual; 'everywhere' busca em tudo que o usuário vê.
+    @database_sync_to_async
+    def run_search(self, query, cursor, limit, everywhere):
+        room = conversation = None
+        if not everywhere:
+            room = self.room
+            if room is None:
+                conversation = DirectConversation.objects.filter(slug=self.room_slug).first()
+                if conversation is None:
+                    return [], None
+        results, next_cursor = search.search(self.user, query, cursor=cursor, limit=limit, room=room, conversation=conversation)
+        return [search.serialize(message, self.user) for message in results], next_cursor
 
     @database_sync_to_async
     def update_last_seen(self):
-        try: Profile.objects.filter(user=self.user).update(last_seen=timezone.now())
+        try: last_seen.touch(self.user.id)
         except Exception as e: logger.error(f"Erro ao atualizar last_seen para {self.user.username}: {str(e)}")
 
-    @database_sync_to_async
-    def save_message(self, user, room_name, message, parent_id=None):
-        parent_message = None
-        if parent_id:
-            try:
-                parent_message = ChatMessage.objects.select_related('author').get(id=parent_id)
-            except ChatMessage.DoesNotExist:
-                pass
-        return ChatMessage.objects.create(author=user, room_name=room_name, content=message, parent=parent_message)
+    async def save_message(self, user, room, message, parent_id=None):
+        room_name = room.name if room else self.room_slug
+        return await get_ingest_queue().submit(user, room, room_name, message, parent_id)
 
     @database_sync_to_async
     def get_avatar_url(self, user):
@@ -452,25 +688,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except (Profile.DoesNotExist, AttributeError):
             return 'https://res.cloudinary.com/dtrfgop8f/image/upload/v1756166420/vdu6rwcppbq8zvzddkdw.jpg'
 
-    @database_sync_to_async
-    def is_user_banned(self, room, user):
-        return room and ChatRoomBan.objects.filter(room=room, banned_user=user).exists()
-
-    @database_sync_to_async
-    def is_user_muted(self, room, user):
-        return room and ChatRoomMute.objects.filter(room=room, muted_user=user).exists()
-
     async def kick_user(self, room, target_username):
         if room is None: return
         try:
             target_user = await database_sync_to_async(User.objects.get)(username=target_username)
             await database_sync_to_async(ChatRoomBan.objects.get_or_create)(room=room, banned_user=target_user)
-            
-            target_channel_name = self.connected_users.get(self.room_group_name, {}).get(target_username)
-            if target_channel_name:
-                if self.room_group_name in self.connected_users and target_username in self.connected_users[self.room_group_name]:
-                    del self.connected_users[self.room_group_name][target_username]
-                
+            await database_sync_to_async(membership.set_role)(room, target_user, RoomMembership.ROLE_BANNED)
+
+            for target_channel_name in await presence.channels_for(self.room_slug, target_username):
+                await presence.release(self.room_slug, target_channel_name)
                 await self.channel_layer.send(target_channel_name, {'type': 'force_disconnect'})
         except User.DoesNotExist: pass
 
@@ -480,12 +706,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             new_admin = User.objects.get(username=target_username)
             room.admins.add(new_admin)
+            membership.set_role(room, new_admin, RoomMembership.ROLE_ADMIN)
         except User.DoesNotExist: pass
 
     async def promote_user(self, room, target_username):
         await self._promote_user_db(room, target_username)
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await hot_rooms.send(
+            self.room_slug,
             {'type': 'admin_status_update', 'target_username': target_username, 'is_admin': True}
         )
 
@@ -495,12 +722,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             admin_to_demote = User.objects.get(username=target_username)
             room.admins.remove(admin_to_demote)
+            membership.set_role(room, admin_to_demote, RoomMembership.ROLE_MEMBER)
         except User.DoesNotExist: pass
 
     async def demote_user(self, room, target_username):
         await self._demote_user_db(room, target_username)
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await hot_rooms.send(
+            self.room_slug,
             {'type': 'admin_status_update', 'target_username': target_username, 'is_admin': False}
         )
 
@@ -510,16 +738,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
         room.is_muted = state
         room.save()
 
-    @database_sync_to_async
-    def is_admin_or_creator(self, room, user):
-        if room is None: return False
-        return room.creator == user or user in room.admins.all()
-
     @database_sync_to_async
     def delete_message_for_me(self, message_id):
         try:
             message = ChatMessage.objects.get(id=message_id)
-            message.deleted_by.add(self.user)
+            room_state.hide(self.user, message)
         except ChatMessage.DoesNotExist:
             logger.warning(f"Tentativa de apagar mensagem inexistente com ID {message_id}")
 
@@ -530,6 +753,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if self.user == message.author:
                 message.is_deleted_for_everyone = True
                 message.save()
+                search.remove_messages([message.id])
                 return True, None
             return False, "Você só pode apagar suas próprias mensagens."
         except ChatMessage.DoesNotExist:
@@ -543,23 +767,201 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message.is_deleted_for_everyone = True
             message.deleted_by_admin = self.user
             message.save()
+            search.remove_messages([message.id])
             return True, None
         except ChatMessage.DoesNotExist:
             logger.warning(f"Tentativa de apagar mensagem inexistente com ID {message_id}")
             return False, "Mensagem não encontrada."
 
     @database_sync_to_async
-    def update_chat_settings(self, room, new_name, user_limit):
+    def update_chat_settings(self, room, new_name, user_limit, retention_days=None):
+        # Recarrega a sala e grava só os campos enviados: o snapshot da conexão
+        # pode estar desatualizado e sobrescreveria o que outro admin mudou.
+        room = ChatRoom.objects.filter(pk=room.pk).first() if room else None
         if not room:
             return None, "Sala não encontrada."
 
+        fields = []
         if new_name:
             room.name = new_name
+            fields.append('name')
         if user_limit is not None:
             try:
                 room.user_limit = int(user_limit)
             except (ValueError, TypeError):
                 return None, "Limite de usuários inválido."
-        
-        room.save()
-        return room, None
\ No newline at end of file
+            fields.append('user_limit')
+        if retention_days is not None:
+            # Vazio volta ao padrão do servidor (HISTORY_RETENTION_DAYS).
+            try:
+                room.retention_days = int(retention_days) if retention_days != '' else None
+            except (ValueError, TypeError):
+                return None, "Retenção do histórico inválida."
+            if room.retention_days is not None and room.retention_days < 0:
+                return None, "Retenção do histórico inválida."
+            fields.append('retention_days')
+
+        if fields:
+            room.save(update_fields=fields)
+        return room, None
+
+class _Subscription:
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.queue = asyncio.Queue()
+        self.task = None
+
+
+class MultiplexConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
+    # Um socket por cliente para o lobby e todas as salas abertas. Cada
+    # assinatura ('lobby' ou 'room:<slug>') roda um LobbyConsumer/ChatConsumer
+    # completo, com canal próprio, alimentado por uma fila em vez do servidor
+    # ASGI; o que ele envia sai por aqui marcado com o stream (ver
+    # frames.stream_frame). Frames do cliente:
+    #   {'type': 'subscribe', 'stream': ..., 'token': ...}
+    #   {'type': 'unsubscribe', 'stream': ...}
+    #   {'type': 'heartbeat'}   um por socket; renova a presença em todas as salas
+    #   {'stream': ..., 'payload': {...}}   frame normal da sala ou do lobby
+    # O fechamento de uma assinatura (expulsão, sala cheia...) chega como
+    # {'type': 'unsubscribed', 'stream': ..., 'code': ...}.
+    # Visitantes sem login só podem assinar o lobby.
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.streams = {}
+        self.limiter = ratelimit.ConnectionLimiter(self.user.id) if self.user.is_authenticated else None
+        await self.accept_framed()
+        if self.user.is_authenticated:
+            await self.update_last_seen()
+
+    async def disconnect(self, close_code):
+        for stream in list(self.streams):
+            await self.unsubscribe(stream, close_code)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if await self.reject_oversized(text_data, bytes_data):
+            return
+
+        try:
+            frame = self.decode_frame(text_data, bytes_data)
+            message_type, stream = frame.get('type'), frame.get('stream')
+        except (ValueError, AttributeError):
+            logger.error(f"Erro ao decodificar frame: {(text_data or bytes_data)[:200]!r}")
+            await metrics.incr('ws.invalid_frame')
+            return
+
+        if message_type == 'heartbeat':
+            await self.heartbeat()
+        elif message_type in ('subscribe', 'unsubscribe'):
+            retry_after = await self.limiter.check('query') if self.limiter else 0
+            if retry_after:
+                await metrics.incr('ws.rate_limited.query')
+                await self.send_error(
+                    'rate_limited', 'Você está enviando rápido demais. Aguarde um pouco.',
+                    action='query', retry_after=round(retry_after, 1),
+                )
+            elif message_type == 'subscribe':
+                await self.subscribe(stream, frame.get('token'))
+            else:
+                await self.unsubscribe(stream)
+        elif stream in self.streams:
+            # O consumer da assinatura valida e limita o frame como faria no
+            # socket próprio. No MessagePack o payload pode trazer bytes, que
+            # não viram JSON: o erro fica nesse stream, sem derrubar o socket.
+            payload = frame.get('payload')
+            try:
+                if not isinstance(payload, dict):
+                    raise ValueError(f'payload do tipo {type(payload).__name__}')
+                text = json.dumps(payload)
+            except (TypeError, ValueError) as e:
+                await metrics.incr('ws.invalid_frame')
+                await self.send_error('invalid_payload', 'Frame inválido para esta assinatura.', stream=stream)
+                logger.warning(f"Payload inválido no stream {stream} de {self.user.username}: {e}")
+                return
+            await self.streams[stream].queue.put({'type': 'websocket.receive', 'text': text})
+        else:
+            await self.send_error('unknown_stream', 'Assinatura inexistente.', stream=stream)
+
+    async def subscribe(self, stream, token=None):
+        if stream in self.streams:
+            return
+        if len(self.streams) >= settings.WS_MULTIPLEX_MAX_STREAMS:
+            await self.send_error('too_many_streams', 'Salas abertas demais nesta conexão.', max_streams=settings.WS_MULTIPLEX_MAX_STREAMS)
+            return
+
+        scope = dict(self.scope, subprotocols=[frames.SUBPROTOCOL] if self.use_msgpack else [])
+        slug = stream[len('room:'):] if isinstance(stream, str) and stream.startswith('room:') else None
+        if slug and not self.user.is_authenticated:
+            await self.send_error('login_required', 'Entre na sua conta para abrir salas.', stream=stream)
+            return
+        if stream == 'lobby':
+            consumer = LobbyConsumer()
+            scope.update(path='/ws/lobby/', query_string=b'')
+        elif slug and re.fullmatch(r'[\w.-]+', slug, re.ASCII):
+            consumer = ChatConsumer()
+            scope.update(
+                path=f'/ws/chat/{slug}/',
+                url_route={'args': (), 'kwargs': {'room_slug': slug}},
+                query_string=urlencode({'token': token}).encode() if token else b'',
+            )
+        else:
+            await self.send_error('unknown_stream', 'Assinatura inexistente.', stream=stream)
+            return
+
+        subscription = _Subscription(consumer)
+        await subscription.queue.put({'type': 'websocket.connect'})
+        subscription.task = asyncio.create_task(consumer(scope, subscription.queue.get, self.stream_sender(stream)))
+        subscription.task.add_done_callback(lambda task: self.subscription_done(stream, task))
+        self.streams[stream] = subscription
+
+    async def unsubscribe(self, stream, code=1000):
+        subscription = self.streams.pop(stream, None)
+        if subscription is None:
+            return
+        await subscription.queue.put({'type': 'websocket.disconnect', 'code': code})
+        try:
+            await subscription.task
+        except Exception:
+            pass  # já registrado em subscription_done
+
+    def stream_sender(self, stream):
+        async def send(message):
+            if message['type'] == 'websocket.accept':
+                await self.send_event({'type': 'subscribed', 'stream': stream})
+            elif message['type'] == 'websocket.send':
+                if stream in self.streams:
+                    text_data, bytes_data = frames.stream_frame(stream, message.get('text'), message.get('bytes'))
+                    await self.send(text_data=text_data, bytes_data=bytes_data)
+            elif message['type'] == 'websocket.close':
+                subscription = self.streams.pop(stream, None)
+                if subscription is not None:
+                    await self.send_event({'type': 'unsubscribed', 'stream': stream, 'code': message.get('code') or 1000})
+                    await subscription.queue.put({'type': 'websocket.disconnect', 'code': message.get('code') or 1000})
+        return send
+
+    def subscription_done(self, stream, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Erro na assinatura {stream} de {self.user.username}: {task.exception()!r}")
+        subscription = self.streams.get(stream)
+        if subscription is not None and subscription.task is task:
+            del self.streams[stream]
+            background.spawn(self.send_event({'type': 'unsubscribed', 'stream': stream, 'code': 1011}), name=f'unsubscribed:{stream}')
+
+    # Presença e last_seen uma vez por socket, não por sala.
+    async def heartbeat(self):
+        if self.limiter is None:
+            return
+        retry_after = await self.limiter.check('heartbeat')
+        if retry_after:
+            await metrics.incr('ws.rate_limited.heartbeat')
+            return
+        for subscription in list(self.streams.values()):
+            if getattr(subscription.consumer, 'admitted', False):
+                await subscription.consumer.renew_presence()
+        await self.update_last_seen()
+        await self.send_event({'type': 'heartbeat', 'status': 'pong'})
+
+    @database_sync_to_async
+    def update_last_seen(self):
+        try: last_seen.touch(self.user.id)
+        except Exception as e: logger.error(f"Erro ao atualizar last_seen para {self.user.username}: {str(e)}")
@@ -0,0 +1,88 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db.models import F, Q
+
+from .models import DirectConversation
+
+# Índice de conversas privadas. A linha é criada ao abrir a DM e atualizada
+# pelo pipeline de ingestão a cada lote de mensagens: última mensagem e
+# contador de não lidas de cada participante.
+
+
+def conversation_slug(user, other):
+    return f"dm-{'-'.join(sorted([user.username, other.username]))}"
+
+
+def get_or_create_conversation(user, other):
+    user_a, user_b = sorted([user, other], key=lambda u: u.id)
+    conversation, _ = DirectConversation.objects.get_or_create(
+        user_a=user_a, user_b=user_b,
+        defaults={'slug': conversation_slug(user_a, user_b)},
+    )
+    return conversation
+
+
+def participants_from_slug(slug):
+    # Nomes de usuário podem ter hífen: testa cada divisão possível do slug.
+    names = slug[3:].split('-')
+    candidates = [('-'.join(names[:i]), '-'.join(names[i:])) for i in range(1, len(names))]
+    usernames = {name for pair in candidates for name in pair}
+    users = {u.username: u for u in User.objects.filter(username__in=usernames)}
+    for first, second in candidates:
+        if first in users and second in users and first != second:
+            return users[first], users[second]
+    return None
+
+
+# Leitura primeiro; a linha só é criada (links antigos de DMs que ainda não
+# têm linha no índice) se quem pede é um dos dois participantes do slug.
+def resolve(slug, user):
+    conversation = DirectConversation.objects.select_related('user_a__profile', 'user_b__profile').filter(slug=slug).first()
+    if conversation is None:
+        participants = participants_from_slug(slug)
+        if participants is None or user.id not in (participant.id for participant in participants):
+            return None
+        conversation = get_or_create_conversation(*participants)
+    return conversation
+
+
+def conversations_for(user):
+    return (
+        DirectConversation.objects
+        .filter(Q(user_a=user) | Q(user_b=user), last_message_at__isnull=False)
+        .select_related('user_a__profile', 'user_b__profile')
+        .order_by('-last_message_at')
+    )
+
+
+def mark_read(conversation, user):
+    field = 'unread_a' if user.id == conversation.user_a_id else 'unread_b'
+    DirectConversation.objects.filter(pk=conversation.pk).update(**{field: 0})
+
+
+# authors_by_slug: slug -> ids dos autores das mensagens do lote.
+def conversations_by_slug(authors_by_slug):
+    conversations = DirectConversation.objects.in_bulk(list(authors_by_slug), field_name='slug')
+    for slug in set(authors_by_slug) - set(conversations):
+        participants = participants_from_slug(slug)
+        if participants is not None and authors_by_slug[slug] & {participant.id for participant in participants}:
+            conversations[slug] = get_or_create_conversation(*participants)
+    return conversations
+
+
+# Chamado dentro da transação do lote de ingestão, com as mensagens já
+# ligadas à conversa: um UPDATE por conversa.
+def record_messages(messages):
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation].append(message)
+
+    for conversation, conversation_messages in by_conversation.items():
+        last = max(conversation_messages, key=lambda m: m.id)
+        DirectConversation.objects.filter(pk=conversation.pk).update(
+            last_message=last,
+            last_message_at=last.timestamp,
+            unread_a=F('unread_a') + sum(1 for m in conversation_messages if m.author_id == conversation.user_b_id),
+            unread_b=F('unread_b') + sum(1 for m in conversation_messages if m.author_id == conversation.user_a_id),
+        )
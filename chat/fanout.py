@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+import weakref
+
+from channels.consumer import get_handler_name
+from channels.layers import get_channel_layer
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from . import background, metrics
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+# Fan-out hierárquico para salas grandes. O group_send do channels_redis
+# trabalha, no worker que envia, proporcionalmente ao tamanho do grupo; numa
+# sala com milhares de conexões um único remetente trava o próprio event loop.
+#
+# Cada worker (event loop) tem um canal próprio e entra no grupo
+# chat_<slug>.workers de toda sala em que tem conexões locais. Com a sala em
+# modo grande (fanout:<slug>:large no Redis), o evento vai uma vez por worker
+# para esse grupo e cada worker entrega às suas conexões chamando o handler
+# direto (sem passar de novo pelo channel layer). As conexões continuam no
+# grupo chat_<slug>: fora do modo grande nada muda, e a troca de modo não
+# duplica nem perde eventos (cada envio usa só um dos dois caminhos).
+#
+# O modo liga quando a sala chega a LARGE_ROOM_THRESHOLD usuários online e
+# desliga abaixo da metade, para não oscilar perto do limite.
+
+DELIVER = 'fanout.deliver'
+# Por quanto tempo cada worker confia no modo lido do Redis.
+MODE_CACHE_SECONDS = 2
+
+_workers = weakref.WeakKeyDictionary()
+_modes = {}
+
+
+def workers_group(slug):
+    return f'chat_{slug}.workers'
+
+
+def _mode_key(slug):
+    return f'fanout:{slug}:large'
+
+
+class _Worker:
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.channel = None
+        self.rooms = {}
+        self.joined = set()
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    async def sync_group(self, slug):
+        # Serializado e reavaliado sob a trava: register/unregister concorrentes
+        # convergem para o estado atual. group_add é repetido a cada conexão
+        # para renovar a expiração do grupo no channels_redis.
+        async with self.lock:
+            if self.rooms.get(slug):
+                if self.channel is None:
+                    self.channel = await self.channel_layer.new_channel('fanout')
+                self.ensure_running()
+                await self.channel_layer.group_add(workers_group(slug), self.channel)
+                self.joined.add(slug)
+            elif slug in self.joined:
+                self.joined.discard(slug)
+                await self.channel_layer.group_discard(workers_group(slug), self.channel)
+
+    # Recria a tarefa de entrega se ela tiver morrido; chamado também a cada
+    # envio de sala por este worker.
+    def ensure_running(self):
+        if self.channel is not None and (self.task is None or self.task.done()):
+            self.task = background.spawn(self.run(), name=f'fanout:{self.channel}')
+
+    # Um erro num evento não pode parar a entrega de todas as salas grandes
+    # do worker: registra e segue (CancelledError não é Exception e passa).
+    async def run(self):
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.channel)
+            except Exception:
+                logger.exception(f"Erro ao receber no canal de fan-out {self.channel}")
+                await asyncio.sleep(1)
+                continue
+            try:
+                await deliver(self.rooms.get(message['slug'], ()), message['event'])
+            except Exception:
+                logger.exception(f"Erro ao entregar evento de fan-out da sala {message.get('slug')}")
+
+
+# Entrega local: o handler do consumer só enfileira o frame (ver
+# chat/outbound.py), então a volta pelas conexões do worker é barata.
+async def deliver(consumers, event):
+    handler_name = get_handler_name(event)
+    for consumer in list(consumers):
+        handler = getattr(consumer, handler_name, None)
+        if handler is None:
+            continue
+        try:
+            await handler(event)
+        except Exception:
+            logger.exception(f"Erro ao entregar {event['type']} localmente")
+
+
+def _worker():
+    loop = asyncio.get_running_loop()
+    worker = _workers.get(loop)
+    if worker is None:
+        worker = _Worker(get_channel_layer())
+        _workers[loop] = worker
+    return worker
+
+
+async def register(slug, consumer):
+    worker = _worker()
+    worker.rooms.setdefault(slug, set()).add(consumer)
+    await worker.sync_group(slug)
+
+
+async def unregister(slug, consumer):
+    worker = _worker()
+    consumers = worker.rooms.get(slug)
+    if consumers is None:
+        return
+    consumers.discard(consumer)
+    if not consumers:
+        del worker.rooms[slug]
+    await worker.sync_group(slug)
+
+
+# Chamado a cada entrada/saída com o total de usuários online da sala.
+async def update_mode(slug, user_count):
+    threshold = settings.LARGE_ROOM_THRESHOLD
+    if not threshold:
+        return
+    try:
+        if user_count >= threshold:
+            if await get_redis().set(_mode_key(slug), '1', nx=True):
+                logger.info(f"Sala {slug} entrou no modo de sala grande ({user_count} usuários)")
+                await metrics.incr('fanout.large_on')
+            large = True
+        elif user_count < threshold // 2:
+            if await get_redis().delete(_mode_key(slug)):
+                logger.info(f"Sala {slug} saiu do modo de sala grande ({user_count} usuários)")
+                await metrics.incr('fanout.large_off')
+            large = False
+        else:
+            return
+    except RedisError as e:
+        logger.error(f"Erro ao atualizar o modo de fan-out da sala {slug}: {e}")
+        return
+    _modes[slug] = (large, time.monotonic() + MODE_CACHE_SECONDS)
+
+
+async def is_large(slug):
+    large, expires_at = _modes.get(slug, (False, 0))
+    if time.monotonic() < expires_at:
+        return large
+    try:
+        large = bool(await get_redis().exists(_mode_key(slug)))
+    except RedisError as e:
+        logger.error(f"Erro ao ler o modo de fan-out da sala {slug}: {e}")
+    _modes[slug] = (large, time.monotonic() + MODE_CACHE_SECONDS)
+    return large
+
+
+# Substitui channel_layer.group_send(f'chat_{slug}', event) para eventos de sala.
+async def group_send(slug, event):
+    _worker().ensure_running()
+    channel_layer = get_channel_layer()
+    if await is_large(slug):
+        await channel_layer.group_send(workers_group(slug), {'type': DELIVER, 'slug': slug, 'event': event})
+    else:
+        await channel_layer.group_send(f'chat_{slug}', event)
+
+
+def forget_room(slug):
+    _modes.pop(slug, None)
+    try:
+        get_sync_redis().delete(_mode_key(slug))
+    except RedisError as e:
+        logger.error(f"Erro ao remover o modo de fan-out da sala {slug}: {e}")
@@ -0,0 +1,81 @@
+import json
+
+import msgpack
+
+# Eventos de sala são serializados uma única vez, por quem envia. O evento do
+# channel layer carrega o frame pronto em 'frame' (JSON) e em 'packed'
+# (MessagePack), e cada consumer só repassa o formato negociado com o seu
+# cliente, sem serializar por destinatário. Campos extras (internos) ficam
+# fora do frame e nunca chegam ao cliente.
+
+SUBPROTOCOL = 'msgpack'
+
+# Eventos de alto volume usam chaves curtas no MessagePack:
+# tipo -> (código enviado em 'T', {campo: chave curta}).
+# Deve ficar igual a COMPACT_EVENTS em static/js/chat.js.
+COMPACT_EVENTS = {
+    'chat_message': ('m', {
+        'id': 'i', 'message': 'm', 'username': 'u', 'timestamp': 't',
+        'avatar_url': 'a', 'parent': 'p', 'seq': 's',
+    }),
+    'typing_update': ('y', {'users': 'u'}),
+    'presence_delta': ('d', {
+        'version': 'v', 'op': 'o', 'username': 'u', 'user': 'U', 'last_seen': 'l',
+    }),
+}
+
+
+def encode(event_type, payload):
+    return json.dumps({'type': event_type, **payload})
+
+
+def _compact(event_type, payload):
+    compact = COMPACT_EVENTS.get(event_type)
+    if compact is None:
+        return {'type': event_type, **payload}
+    code, keys = compact
+    return {'T': code, **{keys.get(key, key): value for key, value in payload.items()}}
+
+
+def pack(event_type, payload):
+    return msgpack.packb(_compact(event_type, payload), use_bin_type=True)
+
+
+def group_event(event_type, payload, **internal):
+    return {
+        'type': event_type,
+        'frame': encode(event_type, payload),
+        'packed': pack(event_type, payload),
+        **internal,
+    }
+
+
+# Vários eventos num frame só (salas quentes, ver chat/hot_rooms.py), a partir
+# dos frames JSON já serializados: o JSON é só concatenado; o MessagePack é
+# refeito com as chaves curtas de cada evento.
+def batch_event(encoded_frames):
+    events = []
+    for encoded in encoded_frames:
+        event = json.loads(encoded)
+        events.append(_compact(event.pop('type'), event))
+    return {
+        'type': 'batch',
+        'frame': '{"type": "batch", "events": [' + ', '.join(encoded_frames) + ']}',
+        'packed': msgpack.packb({'type': 'batch', 'events': events}, use_bin_type=True),
+    }
+
+
+# Frame de uma assinatura do socket multiplexado (MultiplexConsumer): o frame
+# do stream vai dentro de 'payload' sem ser desserializado. No MessagePack o
+# payload segue em bytes e o cliente o decodifica à parte.
+def stream_frame(stream, text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        return None, msgpack.packb({'stream': stream, 'payload': bytes_data}, use_bin_type=True)
+    return '{"stream": ' + json.dumps(stream) + ', "payload": ' + text_data + '}', None
+
+
+def unpack(bytes_data):
+    try:
+        return msgpack.unpackb(bytes_data, raw=False)
+    except msgpack.UnpackException as e:
+        raise ValueError(str(e)) from e
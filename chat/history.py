@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ChatMessage
+from . import archive, room_state
+
+# Histórico paginado por cursor (keyset). O cursor é o id de uma mensagem:
+# 'before' traz as mais antigas que ela, 'after' as mais novas. A busca usa
+# (timestamp, id) do cursor contra o índice (sala, timestamp, id), sem OFFSET.
+# Sem cursor, vem a página mais recente. Mensagens sempre em ordem cronológica.
+# Em salas com arquivo frio (chat/archive.py), a página que passa do começo
+# do banco continua no arquivo, e um cursor arquivado é lido de lá.
+
+
+def clamp_limit(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return settings.HISTORY_PAGE_SIZE
+    return max(1, min(limit, settings.HISTORY_MAX_PAGE_SIZE))
+
+
+def _parse_cursor(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_page(user, room=None, conversation=None, before=None, after=None, limit=None):
+    limit = clamp_limit(limit)
+    before, after = _parse_cursor(before), _parse_cursor(after)
+
+    if room is not None:
+        messages = ChatMessage.objects.filter(room=room)
+    elif conversation is not None:
+        messages = ChatMessage.objects.filter(conversation=conversation)
+    else:
+        return [], False
+    state = room_state.get_state(user, room, conversation)
+    messages = room_state.apply(messages, user, room, conversation, state=state).select_related('author__profile', 'parent__author')
+
+    cursor_id = after if after is not None else before
+    if cursor_id is not None:
+        cursor = ChatMessage.objects.filter(pk=cursor_id).values_list('timestamp', flat=True).first()
+        if cursor is None:
+            if room is not None and archive.contains(room, cursor_id):
+                return _archived_page(room, messages, state, before, after, limit)
+            return [], False
+        # Escrito como faixa em timestamp (que o índice resolve) mais o
+        # desempate por id; um OR entre as duas condições vira varredura.
+        if after is not None:
+            messages = messages.filter(timestamp__gte=cursor).exclude(timestamp=cursor, id__lte=cursor_id)
+        else:
+            messages = messages.filter(timestamp__lte=cursor).exclude(timestamp=cursor, id__gte=cursor_id)
+
+    if after is not None:
+        page = list(messages.order_by('timestamp', 'id')[:limit + 1])
+        has_more = len(page) > limit
+        return page[:limit], has_more
+
+    page = list(messages.order_by('-timestamp', '-id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit][::-1]
+    if not has_more and room is not None and archive.has_archive(room):
+        oldest = page[0].id if page else before
+        older, has_more = archive.read_before(room, oldest, limit - len(page), room_state.visible(state))
+        page = older + page
+    return page, has_more
+
+
+def _archived_page(room, hot_messages, state, before, after, limit):
+    visible = room_state.visible(state)
+    if before is not None:
+        return archive.read_before(room, before, limit, visible)
+
+    page, has_more = archive.read_after(room, after, limit, visible)
+    if not has_more:
+        # O arquivo acabou: o resto da página vem do começo do banco.
+        hot = list(hot_messages.order_by('timestamp', 'id')[:limit - len(page) + 1])
+        has_more = len(hot) > limit - len(page)
+        page += hot[:limit - len(page)]
+    return page, has_more
+
+
+# Mesmo formato do frame chat_message, para o cliente renderizar igual.
+def serialize(message):
+    parent_info = None
+    if message.parent:
+        parent_info = {
+            'author': message.parent.author.username,
+            'content': message.parent.content,
+        }
+    return {
+        'id': message.id,
+        'message': message.content,
+        'username': message.author.username,
+        'timestamp': timezone.localtime(message.timestamp).strftime('%H:%M'),
+        'avatar_url': message.author.profile.avatar.url,
+        'parent': parent_info,
+    }
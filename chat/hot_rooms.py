@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from . import background, fanout, frames
+from .redis_client import LuaScript, get_redis
+
+logger = logging.getLogger(__name__)
+
+# Salas quentes, detectadas pela taxa de mensagens (janelas de 1 s no Redis,
+# a anterior ponderada pelo que falta da atual):
+#   hot:<slug>:n:<segundo>  contador de mensagens da janela
+#   hot:<slug>:pending      LIST  frames JSON esperando o próximo lote
+#   hot:<slug>:tick         trava do ticker de lotes (um worker por vez)
+#   hot:<slug>:slow         modo lento automático (expira sozinho)
+#   hot:<slug>:announced    modo lento automático já anunciado à sala
+#   hot:<slug>:override     'on' / 'off' definido por um admin
+#   hot:<slug>:posts:<id>   mensagens do usuário no intervalo do modo lento
+#
+# Acima de HOT_ROOM_BATCH_RATE msg/s, os eventos de BATCHED deixam de ir um a
+# um para o grupo: entram na fila e o ticker envia um único 'batch' a cada
+# HOT_ROOM_BATCH_MS, mantendo a ordem. Enquanto houver eventos a cada
+# intervalo o lote continua; num intervalo vazio o ticker para. Acima de
+# HOT_ROOM_SLOW_MODE_RATE liga o modo lento automático, que limita cada
+# usuário (admins fora) a SLOW_MODE_POSTS mensagens por SLOW_MODE_INTERVAL_SECONDS.
+
+# Só eventos repassados como estão (forward_frame) podem ir em lote. Os demais
+# eventos da sala saem por send(), que antes despacha o lote pendente: um
+# evento fora do lote nunca chega antes das mensagens que vieram antes dele.
+BATCHED = {'chat_message', 'system_message', 'message_deleted_for_everyone', 'presence_delta'}
+OVERRIDES = ('on', 'off')
+
+_ROUTE = LuaScript("""
+local current, previous, pending, lock, slow, announced, override = unpack(KEYS)
+local counts, fraction = ARGV[1] == '1', tonumber(ARGV[2])
+local batch_rate, slow_rate = tonumber(ARGV[3]), tonumber(ARGV[4])
+local frame, lock_ms, hold_ms = ARGV[5], tonumber(ARGV[6]), tonumber(ARGV[7])
+local rate = 0
+if counts then
+    local n = redis.call('INCR', current)
+    redis.call('PEXPIRE', current, 3000)
+    rate = n + tonumber(redis.call('GET', previous) or '0') * (1 - fraction)
+end
+local slow_change = 0
+if counts and rate >= slow_rate then
+    redis.call('SET', slow, '1', 'PX', hold_ms)
+    if redis.call('SET', announced, '1', 'NX') and not redis.call('GET', override) then
+        slow_change = 1
+    end
+elseif redis.call('EXISTS', announced) == 1 and redis.call('EXISTS', slow) == 0 then
+    redis.call('DEL', announced)
+    if not redis.call('GET', override) then
+        slow_change = -1
+    end
+end
+local batched, started = 0, 0
+if (counts and rate >= batch_rate) or redis.call('EXISTS', lock) == 1 then
+    redis.call('RPUSH', pending, frame)
+    batched = 1
+    if redis.call('SET', lock, '1', 'NX', 'PX', lock_ms) then
+        started = 1
+    end
+end
+return {batched, started, slow_change}
+""")
+
+_DRAIN = LuaScript("""
+local pending, lock = KEYS[1], KEYS[2]
+local items = redis.call('LRANGE', pending, 0, -1)
+if #items == 0 then
+    redis.call('DEL', lock)
+    return {}
+end
+redis.call('DEL', pending)
+redis.call('PEXPIRE', lock, tonumber(ARGV[1]))
+return items
+""")
+
+_FLUSH = LuaScript("""
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+if #items > 0 then
+    redis.call('DEL', KEYS[1])
+end
+return items
+""")
+
+_ALLOW_POST = LuaScript("""
+local slow, override, posts = KEYS[1], KEYS[2], KEYS[3]
+local limit, interval_ms, exempt = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3] == '1'
+local mode = redis.call('GET', override)
+local active = mode == 'on' or (mode ~= 'off' and redis.call('EXISTS', slow) == 1)
+if not active or exempt then
+    return {1, active and 1 or 0, 0}
+end
+local n = redis.call('INCR', posts)
+if n == 1 then
+    redis.call('PEXPIRE', posts, interval_ms)
+end
+if n > limit then
+    return {0, 1, redis.call('PTTL', posts)}
+end
+return {1, 1, 0}
+""")
+
+_STATE = LuaScript("""
+local mode = redis.call('GET', KEYS[2])
+local auto = redis.call('EXISTS', KEYS[1])
+return {mode or 'auto', auto}
+""")
+
+
+def _key(slug, name):
+    return f'hot:{slug}:{name}'
+
+
+def _lock_ms():
+    return max(settings.HOT_ROOM_BATCH_MS * 4, 2000)
+
+
+# Envia (em lote, se a sala estiver quente) e devolve a mudança do modo lento
+# automático: 1 ligou, -1 desligou, 0 nada.
+async def broadcast(slug, event_type, payload, **internal):
+    if event_type not in BATCHED:
+        await send(slug, frames.group_event(event_type, payload, **internal))
+        return 0
+
+    now = time.time()
+    second = int(now)
+    try:
+        batched, started, slow_change = await _ROUTE(
+            keys=(
+                _key(slug, f'n:{second}'), _key(slug, f'n:{second - 1}'), _key(slug, 'pending'),
+                _key(slug, 'tick'), _key(slug, 'slow'), _key(slug, 'announced'), _key(slug, 'override'),
+            ),
+            args=(
+                1 if event_type == 'chat_message' else 0, now - second,
+                settings.HOT_ROOM_BATCH_RATE, settings.HOT_ROOM_SLOW_MODE_RATE,
+                frames.encode(event_type, payload), _lock_ms(), settings.HOT_ROOM_SLOW_MODE_HOLD_SECONDS * 1000,
+            ),
+        )
+    except RedisError as e:
+        logger.error(f"Erro ao verificar a taxa da sala {slug}: {e}")
+        batched = started = slow_change = 0
+
+    if started:
+        background.spawn(_run_ticker(slug), name=f'hot:{slug}', lock=_key(slug, 'tick'))
+    if not batched:
+        await fanout.group_send(slug, frames.group_event(event_type, payload, **internal))
+    return slow_change
+
+
+async def _run_ticker(slug):
+    interval = settings.HOT_ROOM_BATCH_MS / 1000
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            encoded = await _DRAIN(keys=(_key(slug, 'pending'), _key(slug, 'tick')), args=(_lock_ms(),))
+        except RedisError as e:
+            logger.error(f"Erro no ticker de lotes da sala {slug}: {e}")
+            return
+        if not encoded:
+            return
+        await fanout.group_send(slug, frames.batch_event(encoded))
+
+
+# Substitui fanout.group_send para eventos de sala que não vão em lote.
+async def send(slug, event):
+    try:
+        encoded = await _FLUSH(keys=(_key(slug, 'pending'),))
+    except RedisError as e:
+        logger.error(f"Erro ao despachar o lote pendente da sala {slug}: {e}")
+        encoded = None
+    if encoded:
+        await fanout.group_send(slug, frames.batch_event(encoded))
+    await fanout.group_send(slug, event)
+
+
+# (permitido, modo lento ativo, segundos até poder enviar de novo)
+async def allow_post(slug, user_id, exempt=False):
+    try:
+        allowed, active, retry_ms = await _ALLOW_POST(
+            keys=(_key(slug, 'slow'), _key(slug, 'override'), _key(slug, f'posts:{user_id}')),
+            args=(settings.SLOW_MODE_POSTS, settings.SLOW_MODE_INTERVAL_SECONDS * 1000, 1 if exempt else 0),
+        )
+    except RedisError as e:
+        logger.error(f"Erro ao verificar o modo lento da sala {slug}: {e}")
+        return True, False, 0
+    return bool(allowed), bool(active), max(retry_ms, 0) / 1000
+
+
+async def slow_mode_state(slug):
+    try:
+        mode, auto = await _STATE(keys=(_key(slug, 'slow'), _key(slug, 'override')))
+    except RedisError as e:
+        logger.error(f"Erro ao ler o modo lento da sala {slug}: {e}")
+        mode, auto = 'auto', 0
+    return {
+        'mode': mode,
+        'active': mode == 'on' or (mode == 'auto' and bool(auto)),
+        'posts': settings.SLOW_MODE_POSTS,
+        'interval': settings.SLOW_MODE_INTERVAL_SECONDS,
+    }
+
+
+# mode: 'on' / 'off' fixam o modo lento; 'auto' volta à detecção por taxa.
+async def set_override(slug, mode):
+    client = get_redis()
+    if mode in OVERRIDES:
+        await client.set(_key(slug, 'override'), mode)
+    else:
+        await client.delete(_key(slug, 'override'))
+    return await slow_mode_state(slug)
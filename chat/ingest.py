@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import weakref
+from collections import namedtuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import ChatMessage
+from . import membership, direct, search, unread, lobby
+
+logger = logging.getLogger(__name__)
+
+# Fila de ingestão por worker: mensagens enviadas dentro de
+# INGEST_MAX_LATENCY_MS (ou até INGEST_MAX_BATCH) são gravadas juntas com um
+# único bulk_create, numa só transação e num só salto de thread. Cada
+# consumer aguarda o próprio future e recebe o ChatMessage com o id real.
+
+PendingMessage = namedtuple('PendingMessage', 'author room room_name content parent_id')
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@transaction.atomic
+def write_batch(pending):
+    parent_ids = {_parse_id(p.parent_id) for p in pending} - {None}
+    parents = ChatMessage.objects.select_related('author').in_bulk(parent_ids) if parent_ids else {}
+    dm_authors = {}
+    for p in pending:
+        if p.room is None and p.room_name.startswith('dm-'):
+            dm_authors.setdefault(p.room_name, set()).add(p.author.pk)
+    conversations = direct.conversations_by_slug(dm_authors) if dm_authors else {}
+
+    messages = [
+        ChatMessage(
+            author=p.author,
+            room_name=p.room_name,
+            room=p.room,
+            conversation=conversations.get(p.room_name) if p.room is None else None,
+            content=p.content,
+            parent=parents.get(_parse_id(p.parent_id)),
+        )
+        for p in pending
+    ]
+    if connection.features.can_return_rows_from_bulk_insert:
+        ChatMessage.objects.bulk_create(messages)
+    else:
+        # Sem RETURNING em inserts em lote não teríamos os ids: grava um a um,
+        # ainda dentro da mesma transação.
+        for message in messages:
+            message.save(force_insert=True)
+
+    authors_by_room = {}
+    for p in pending:
+        if p.room is not None:
+            authors_by_room.setdefault(p.room.pk, (p.room, set()))[1].add(p.author.pk)
+    for room, author_ids in authors_by_room.values():
+        membership.record_activity_many(room, author_ids)
+
+    dm_messages = [m for m in messages if m.conversation is not None]
+    if dm_messages:
+        direct.record_messages(dm_messages)
+    search.index_messages(messages)
+    return messages
+
+
+class MessageIngestQueue:
+    def __init__(self, max_batch=None, max_latency_ms=None):
+        self.max_batch = max_batch or settings.INGEST_MAX_BATCH
+        self.max_latency = (max_latency_ms if max_latency_ms is not None else settings.INGEST_MAX_LATENCY_MS) / 1000
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    async def submit(self, author, room, room_name, content, parent_id=None):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((PendingMessage(author, room, room_name, content, parent_id), future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_latency
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                messages = await database_sync_to_async(write_batch)([pending for pending, _ in batch])
+            except Exception as e:
+                logger.error(f"Erro ao gravar lote de {len(batch)} mensagens: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Os remetentes são liberados logo após a gravação; falhas nos
+            # passos seguintes (Redis, channel layer) só são registradas. A
+            # sequência de não lidas (message.seq) fica pronta em message.recorded.
+            recorded = asyncio.get_running_loop().create_future()
+            for (_, future), message in zip(batch, messages):
+                message.recorded = recorded
+                if not future.done():
+                    future.set_result(message)
+            try:
+                slugs = await unread.record_batch(messages)
+            except Exception as e:
+                logger.error(f"Erro ao registrar não lidas de {len(messages)} mensagens: {e}")
+                slugs = []
+            finally:
+                recorded.set_result(None)
+            try:
+                for slug in slugs:
+                    await lobby.touch(slug)
+                await unread.notify_direct(messages)
+            except Exception as e:
+                logger.error(f"Erro ao avisar lobby e DMs sobre {len(messages)} mensagens: {e}")
+
+
+_queues = weakref.WeakKeyDictionary()
+
+
+def get_ingest_queue():
+    loop = asyncio.get_running_loop()
+    queue = _queues.get(loop)
+    if queue is None:
+        queue = _queues[loop] = MessageIngestQueue()
+    return queue
@@ -0,0 +1,149 @@
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, When, Value, DateTimeField
+from redis.exceptions import RedisError
+
+from .models import Profile
+from .redis_client import get_sync_redis, LuaScript
+
+logger = logging.getLogger(__name__)
+
+# Buffer write-behind de Profile.last_seen. Heartbeats, connects e disconnects
+# só gravam no Redis:
+#   lastseen:times  HASH  user_id -> epoch do último sinal de vida
+#   lastseen:dirty  ZSET  user_id -> epoch da primeira escrita ainda não gravada no banco
+# O banco recebe um único UPDATE em lote a cada LAST_SEEN_FLUSH_INTERVAL, pela
+# thread de flush de cada processo (ou manage.py flush_last_seen); o touch do
+# heartbeat nunca grava no banco.
+
+TIMES_KEY = 'lastseen:times'
+DIRTY_KEY = 'lastseen:dirty'
+LOCK_KEY = 'lastseen:flush-lock'
+FLUSH_CHUNK = 500
+
+_POP_DIRTY = LuaScript("""
+local users = redis.call('ZRANGE', KEYS[2], 0, tonumber(ARGV[1]) - 1)
+if #users == 0 then
+    return {}
+end
+local times = redis.call('HMGET', KEYS[1], unpack(users))
+redis.call('ZREM', KEYS[2], unpack(users))
+local result = {}
+for i, user_id in ipairs(users) do
+    if times[i] then
+        table.insert(result, user_id)
+        table.insert(result, times[i])
+    end
+end
+return result
+""")
+
+# Só solta a trava se ela ainda for deste flush: se ele passou do TTL, outro
+# worker pode já estar com ela.
+_RELEASE_LOCK = LuaScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+
+def touch(user_id, when=None):
+    when = when or time.time()
+    try:
+        client = get_sync_redis()
+        pipe = client.pipeline()
+        pipe.hset(TIMES_KEY, user_id, when)
+        pipe.zadd(DIRTY_KEY, {user_id: when}, nx=True)
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Erro ao registrar last_seen de {user_id} no Redis: {e}")
+        Profile.objects.filter(user_id=user_id).update(last_seen=_to_datetime(when))
+        return
+
+    _ensure_flusher()
+
+
+def get_many(user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    try:
+        values = get_sync_redis().hmget(TIMES_KEY, user_ids)
+    except RedisError as e:
+        logger.error(f"Erro ao ler last_seen do Redis: {e}")
+        return {}
+    return {
+        user_id: _to_datetime(float(value))
+        for user_id, value in zip(user_ids, values) if value is not None
+    }
+
+
+def flush():
+    client = get_sync_redis()
+    # Um flush por vez no cluster; quem perder a disputa deixa para o próximo.
+    lock_ms = settings.LAST_SEEN_DURABILITY_WINDOW * 1000
+    token = secrets.token_hex(8)
+    if not client.set(LOCK_KEY, token, nx=True, px=lock_ms):
+        return 0
+
+    flushed = 0
+    try:
+        while True:
+            pairs = _POP_DIRTY.run_sync(keys=(TIMES_KEY, DIRTY_KEY), args=(FLUSH_CHUNK,))
+            if not pairs:
+                break
+            pending = {int(pairs[i]): float(pairs[i + 1]) for i in range(0, len(pairs), 2)}
+            try:
+                _write(pending)
+            except Exception:
+                client.zadd(DIRTY_KEY, {user_id: when for user_id, when in pending.items()}, nx=True)
+                raise
+            flushed += len(pending)
+    finally:
+        _RELEASE_LOCK.run_sync(keys=(LOCK_KEY,), args=(token,))
+    return flushed
+
+
+def _write(pending):
+    Profile.objects.filter(user_id__in=pending).update(
+        last_seen=Case(
+            *[When(user_id=user_id, then=Value(_to_datetime(when))) for user_id, when in pending.items()],
+            output_field=DateTimeField(),
+        )
+    )
+
+
+def _to_datetime(epoch):
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.LAST_SEEN_FLUSH_INTERVAL)
+        close_old_connections()
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Erro no flush periódico de last_seen: {e}")
+        finally:
+            close_old_connections()
+
+
+def _ensure_flusher():
+    global _flusher_started
+    if _flusher_started:
+        return
+    with _flusher_lock:
+        if not _flusher_started:
+            threading.Thread(target=_flush_loop, name='last-seen-flusher', daemon=True).start()
+            _flusher_started = True
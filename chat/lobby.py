@@ -0,0 +1,204 @@
+import asyncio
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.paginator import Paginator
+from redis.exceptions import RedisError
+
+from . import background, frames, unread
+from .models import ChatRoom
+from .redis_client import get_redis, get_sync_redis, LuaScript
+
+logger = logging.getLogger(__name__)
+
+# Contagem de usuários por sala para o lobby, compartilhada entre workers:
+#   lobby:counts  ZSET  slug -> usuários conectados
+#   lobby:dirty   SET   salas cuja contagem mudou desde o último envio
+#   lobby:tick    STRING trava do ticker (um worker por vez)
+# As salas só marcam a mudança; o worker com a trava envia ao grupo 'lobby'
+# um único room_counts a cada LOBBY_BROADCAST_INTERVAL_MS, só com as salas
+# alteradas, e para quando não há mais nada pendente.
+# O mesmo ZSET é o ranking de salas ativas usado na listagem do lobby.
+# Salas que receberam mensagens também são marcadas, e o room_counts leva a
+# sequência delas (chat/unread.py) para o lobby atualizar as não lidas.
+
+COUNTS_KEY = 'lobby:counts'
+DIRTY_KEY = 'lobby:dirty'
+LOCK_KEY = 'lobby:tick'
+GROUP_NAME = 'lobby'
+
+_SET_COUNT = LuaScript("""
+local counts, dirty, lock = KEYS[1], KEYS[2], KEYS[3]
+local slug, count, lock_ms = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+if count > 0 then
+    redis.call('ZADD', counts, count, slug)
+else
+    redis.call('ZREM', counts, slug)
+end
+redis.call('SADD', dirty, slug)
+if redis.call('SET', lock, '1', 'NX', 'PX', lock_ms) then
+    return 1
+end
+return 0
+""")
+
+_TOUCH = LuaScript("""
+local dirty, lock = KEYS[1], KEYS[2]
+redis.call('SADD', dirty, ARGV[1])
+if redis.call('SET', lock, '1', 'NX', 'PX', tonumber(ARGV[2])) then
+    return 1
+end
+return 0
+""")
+
+_DRAIN = LuaScript("""
+local counts, dirty, lock, seqs = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local lock_ms = tonumber(ARGV[1])
+local slugs = redis.call('SMEMBERS', dirty)
+if #slugs == 0 then
+    redis.call('DEL', lock)
+    return {}
+end
+redis.call('DEL', dirty)
+redis.call('PEXPIRE', lock, lock_ms)
+local result = {}
+for _, slug in ipairs(slugs) do
+    table.insert(result, slug)
+    table.insert(result, redis.call('ZSCORE', counts, slug) or '0')
+    table.insert(result, redis.call('HGET', seqs, slug) or '0')
+end
+return result
+""")
+
+
+def _lock_ms():
+    return max(settings.LOBBY_BROADCAST_INTERVAL_MS * 4, 2000)
+
+
+async def set_count(slug, count):
+    try:
+        started = await _SET_COUNT(keys=(COUNTS_KEY, DIRTY_KEY, LOCK_KEY), args=(slug, count, _lock_ms()))
+    except RedisError as e:
+        logger.error(f"Erro ao atualizar contagem do lobby para a sala {slug}: {e}")
+        return
+    if started:
+        background.spawn(_run_ticker(), name='lobby', lock=LOCK_KEY)
+
+
+async def touch(slug):
+    try:
+        started = await _TOUCH(keys=(DIRTY_KEY, LOCK_KEY), args=(slug, _lock_ms()))
+    except RedisError as e:
+        logger.error(f"Erro ao marcar atividade da sala {slug} no lobby: {e}")
+        return
+    if started:
+        background.spawn(_run_ticker(), name='lobby', lock=LOCK_KEY)
+
+
+async def snapshot():
+    pairs = await get_redis().zrange(COUNTS_KEY, 0, -1, withscores=True)
+    return {slug: int(count) for slug, count in pairs}
+
+
+def get_counts(slugs):
+    slugs = list(slugs)
+    if not slugs:
+        return {}
+    try:
+        scores = get_sync_redis().zmscore(COUNTS_KEY, slugs)
+    except RedisError as e:
+        logger.error(f"Erro ao ler contagens do lobby: {e}")
+        return {}
+    return {slug: int(score or 0) for slug, score in zip(slugs, scores)}
+
+
+def forget_room(slug):
+    try:
+        pipe = get_sync_redis().pipeline()
+        pipe.zrem(COUNTS_KEY, slug)
+        pipe.srem(DIRTY_KEY, slug)
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Erro ao remover a sala {slug} do lobby: {e}")
+
+
+# Listagem paginada do lobby. 'active' pagina direto pelo ranking no Redis
+# (ZREVRANGE da página, O(tamanho da página)); salas vazias vêm depois, das
+# mais novas para as mais antigas.
+SORTS = ('active', 'recent', 'name')
+_ORDERINGS = {'recent': ('-created_at', '-id'), 'name': ('name', 'id')}
+
+
+class _ActiveRooms:
+    def __init__(self):
+        self.client = get_sync_redis()
+
+    def count(self):
+        return ChatRoom.objects.count()
+
+    def __getitem__(self, page_slice):
+        start, stop = page_slice.start, page_slice.stop
+        if stop <= start:
+            return []
+        ranked = self.client.zrevrange(COUNTS_KEY, start, stop - 1, withscores=True)
+        by_slug = ChatRoom.objects.in_bulk([slug for slug, _ in ranked], field_name='slug')
+        rooms = []
+        for slug, count in ranked:
+            room = by_slug.get(slug)
+            if room is not None:
+                room.user_count = int(count)
+                rooms.append(room)
+        stale = [slug for slug, _ in ranked if slug not in by_slug]
+        if stale:
+            self.client.zrem(COUNTS_KEY, *stale)
+        if len(ranked) == stop - start:
+            return rooms
+
+        # Passou do fim do ranking: completa com as salas sem ninguém.
+        active_slugs = self.client.zrange(COUNTS_KEY, 0, -1)
+        active_total = ChatRoom.objects.filter(slug__in=active_slugs).count()
+        offset = max(start - active_total, 0)
+        idle = ChatRoom.objects.exclude(slug__in=active_slugs).order_by(*_ORDERINGS['recent'])
+        for room in idle[offset:offset + (stop - start) - len(rooms)]:
+            room.user_count = 0
+            rooms.append(room)
+        return rooms
+
+
+def list_rooms(sort, page_number, per_page=None):
+    per_page = per_page or settings.LOBBY_ROOMS_PER_PAGE
+    if sort not in SORTS:
+        sort = 'active'
+    if sort == 'active':
+        try:
+            return sort, Paginator(_ActiveRooms(), per_page).get_page(page_number)
+        except RedisError as e:
+            logger.error(f"Erro ao ler o ranking de salas ativas: {e}")
+            sort = 'recent'
+
+    page = Paginator(ChatRoom.objects.order_by(*_ORDERINGS[sort]), per_page).get_page(page_number)
+    counts = get_counts(room.slug for room in page.object_list)
+    for room in page.object_list:
+        room.user_count = counts.get(room.slug, 0)
+    return sort, page
+
+
+async def _run_ticker():
+    channel_layer = get_channel_layer()
+    interval = settings.LOBBY_BROADCAST_INTERVAL_MS / 1000
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            rows = await _DRAIN(keys=(COUNTS_KEY, DIRTY_KEY, LOCK_KEY, unread.SEQ_KEY), args=(_lock_ms(),))
+        except RedisError as e:
+            logger.error(f"Erro no ticker do lobby: {e}")
+            return
+        if not rows:
+            return
+        counts, seqs = {}, {}
+        for i in range(0, len(rows), 3):
+            counts[rows[i]] = int(float(rows[i + 1]))
+            if int(rows[i + 2]):
+                seqs[rows[i]] = int(rows[i + 2])
+        await channel_layer.group_send(GROUP_NAME, frames.group_event('room_counts', {'counts': counts, 'seqs': seqs}))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from chat import direct
+from chat.models import ChatMessage, DirectConversation
+
+
+class Command(BaseCommand):
+    help = (
+        'Cria DirectConversation para as DMs existentes a partir do histórico '
+        'de mensagens e liga as mensagens a elas. Contadores de não lidas '
+        'começam zerados.'
+    )
+
+    def handle(self, *args, **options):
+        rows = (
+            ChatMessage.objects.filter(room_name__startswith='dm-')
+            .values('room_name')
+            .annotate(last_id=Max('id'), last_at=Max('timestamp'))
+        )
+        created = skipped = 0
+        for row in rows:
+            participants = direct.participants_from_slug(row['room_name'])
+            if participants is None:
+                skipped += 1
+                self.stdout.write(self.style.WARNING(f"Participantes não encontrados para {row['room_name']}."))
+                continue
+            conversation = direct.get_or_create_conversation(*participants)
+            DirectConversation.objects.filter(pk=conversation.pk).update(
+                last_message_id=row['last_id'],
+                last_message_at=row['last_at'],
+            )
+            ChatMessage.objects.filter(room_name=row['room_name'], conversation__isnull=True).update(
+                conversation=conversation,
+            )
+            created += 1
+        self.stdout.write(self.style.SUCCESS(f'{created} conversas indexadas, {skipped} ignoradas.'))
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import ChatMessage, ChatRoom, ChatRoomBan, RoomMembership
+
+
+class Command(BaseCommand):
+    help = 'Preenche RoomMembership a partir do histórico de mensagens, em lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--start-id', type=int, default=0,
+                            help='Retoma a partir deste ID de mensagem (exclusivo).')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = options['start_id']
+
+        processed = 0
+        while True:
+            rows = list(
+                ChatMessage.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'room_id', 'author_id', 'timestamp')[:chunk_size]
+            )
+            if not rows:
+                break
+
+            activity = {}
+            for _, room_id, author_id, timestamp in rows:
+                if room_id is None:
+                    continue
+                first, last = activity.get((room_id, author_id), (timestamp, timestamp))
+                activity[(room_id, author_id)] = (min(first, timestamp), max(last, timestamp))
+
+            self._merge_chunk(activity)
+            last_id = rows[-1][0]
+            processed += len(rows)
+            self.stdout.write(f'{processed} mensagens processadas (último id {last_id}).')
+
+        self._apply_roles()
+        self.stdout.write(self.style.SUCCESS('Backfill de membros concluído.'))
+
+    @transaction.atomic
+    def _merge_chunk(self, activity):
+        if not activity:
+            return
+        room_ids = {room_id for room_id, _ in activity}
+        user_ids = {user_id for _, user_id in activity}
+        existing = {
+            (m.room_id, m.user_id): m
+            for m in RoomMembership.objects.filter(room_id__in=room_ids, user_id__in=user_ids)
+        }
+
+        to_create, to_update = [], []
+        for (room_id, user_id), (first, last) in activity.items():
+            membership = existing.get((room_id, user_id))
+            if membership is None:
+                to_create.append(RoomMembership(room_id=room_id, user_id=user_id, joined_at=first, last_active_at=last))
+            elif first < membership.joined_at or last > membership.last_active_at:
+                membership.joined_at = min(first, membership.joined_at)
+                membership.last_active_at = max(last, membership.last_active_at)
+                to_update.append(membership)
+
+        RoomMembership.objects.bulk_create(to_create, ignore_conflicts=True)
+        RoomMembership.objects.bulk_update(to_update, ['joined_at', 'last_active_at'])
+
+    @transaction.atomic
+    def _apply_roles(self):
+        for room_id, creator_id, created_at in ChatRoom.objects.values_list('id', 'creator_id', 'created_at'):
+            RoomMembership.objects.update_or_create(
+                room_id=room_id, user_id=creator_id,
+                defaults={'role': RoomMembership.ROLE_CREATOR},
+                create_defaults={'role': RoomMembership.ROLE_CREATOR, 'joined_at': created_at, 'last_active_at': created_at},
+            )
+
+        for role, pairs in (
+            (RoomMembership.ROLE_ADMIN, ChatRoom.admins.through.objects.values_list('chatroom_id', 'user_id')),
+            (RoomMembership.ROLE_BANNED, ChatRoomBan.objects.values_list('room_id', 'banned_user_id')),
+        ):
+            for room_id, user_id in pairs:
+                RoomMembership.objects.filter(room_id=room_id, user_id=user_id).exclude(
+                    role=RoomMembership.ROLE_CREATOR
+                ).update(role=role)
+                RoomMembership.objects.get_or_create(room_id=room_id, user_id=user_id, defaults={'role': role})
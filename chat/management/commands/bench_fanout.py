@@ -0,0 +1,58 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import frames
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o custo de CPU por fan-out de um chat_message: json.dumps por '
+        'destinatário (caminho antigo) contra frame serializado uma vez.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,500,1000,5000',
+                            help='Tamanhos de sala separados por vírgula.')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        payload = {
+            'id': 123456,
+            'message': 'Olá pessoal, alguém viu o jogo ontem? ' * 3,
+            'username': 'usuario_exemplo',
+            'timestamp': '12:34',
+            'avatar_url': 'https://res.cloudinary.com/exemplo/image/upload/v1/avatars/usuario.jpg',
+            'parent': {'author': 'outra_pessoa', 'content': 'Mensagem original'},
+        }
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        repeat = options['repeat']
+
+        self.stdout.write(f'{"membros":>8} {"por destinatário":>18} {"serializa 1x":>14} {"ganho":>7}')
+        for size in sizes:
+            per_recipient = self._measure(repeat, lambda: self._per_recipient(payload, size))
+            once = self._measure(repeat, lambda: self._serialize_once(payload, size))
+            self.stdout.write(
+                f'{size:>8} {per_recipient * 1e6:>15.1f} µs {once * 1e6:>11.1f} µs {per_recipient / once:>6.1f}x'
+            )
+
+    def _measure(self, repeat, fn):
+        start = time.process_time()
+        for _ in range(repeat):
+            fn()
+        return (time.process_time() - start) / repeat
+
+    def _per_recipient(self, payload, size):
+        event = {'type': 'chat_message', **payload}
+        sent = []
+        for _ in range(size):
+            sent.append(json.dumps(event))
+        return sent
+
+    def _serialize_once(self, payload, size):
+        event = frames.group_event('chat_message', payload)
+        sent = []
+        for _ in range(size):
+            sent.append(event['frame'])
+        return sent
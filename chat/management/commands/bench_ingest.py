@@ -0,0 +1,61 @@
+import asyncio
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from chat.ingest import MessageIngestQueue
+from chat.models import ChatMessage, ChatRoom
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a gravação de mensagens uma a uma (ChatMessage.objects.create) '
+        'com o pipeline de ingestão em lote. Cria uma sala e um usuário temporários '
+        'e apaga tudo ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--senders', type=int, default=50, help='Consumers enviando ao mesmo tempo.')
+        parser.add_argument('--batch', type=int, default=None)
+        parser.add_argument('--latency-ms', type=int, default=None)
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create(username=f'bench-{tag}')
+        room = ChatRoom.objects.create(name=f'bench-{tag}', slug=f'bench-{tag}', creator=user)
+        try:
+            for label, runner in (
+                ('create() por mensagem', self._run_single),
+                ('pipeline bulk_create', self._run_pipeline),
+            ):
+                elapsed = asyncio.run(runner(user, room, options))
+                rate = options['messages'] / elapsed
+                self.stdout.write(f'{label:<24} {elapsed:8.3f}s  {rate:10.1f} msg/s')
+        finally:
+            ChatMessage.objects.filter(room=room).delete()
+            room.delete()
+            user.delete()
+
+    async def _drive(self, options, send):
+        semaphore = asyncio.Semaphore(options['senders'])
+
+        async def one(i):
+            async with semaphore:
+                message = await send(f'mensagem {i}')
+                assert message.pk is not None
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(options['messages'])))
+        return time.perf_counter() - start
+
+    async def _run_single(self, user, room, options):
+        create = database_sync_to_async(ChatMessage.objects.create)
+        return await self._drive(options, lambda content: create(author=user, room=room, room_name=room.name, content=content))
+
+    async def _run_pipeline(self, user, room, options):
+        queue = MessageIngestQueue(max_batch=options['batch'], max_latency_ms=options['latency_ms'])
+        return await self._drive(options, lambda content: queue.submit(user, room, room.name, content))
@@ -0,0 +1,82 @@
+import asyncio
+import time
+import uuid
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+from chat import fanout, frames
+
+
+class _FakeConsumer:
+    def __init__(self):
+        self.sent = 0
+
+    async def chat_message(self, event):
+        self.sent += 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a latência de quem envia um chat_message numa sala grande: '
+        'group_send para todas as conexões contra o fan-out por worker '
+        '(chat/fanout.py). Usa o channel layer configurado; os grupos de teste '
+        'são removidos ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,5000,10000',
+                            help='Conexões na sala, separadas por vírgula.')
+        parser.add_argument('--workers', type=int, default=8, help='Workers com conexões na sala.')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        asyncio.run(self._run(sizes, options['workers'], options['repeat']))
+
+    async def _run(self, sizes, workers, repeat):
+        channel_layer = get_channel_layer()
+        event = frames.group_event('chat_message', {
+            'id': 123456,
+            'message': 'Olá pessoal, alguém viu o jogo ontem?',
+            'username': 'usuario_exemplo',
+            'timestamp': '12:34',
+            'avatar_url': None,
+            'parent': None,
+        })
+
+        self.stdout.write(
+            f'{"conexões":>9} {"group_send":>12} {"por worker":>12} {"entrega local":>15}'
+        )
+        for size in sizes:
+            group = f'bench_{uuid.uuid4().hex[:8]}'
+            direct = await self._measure_group(
+                channel_layer, group, [await channel_layer.new_channel() for _ in range(size)], event, repeat,
+            )
+            hierarchical = await self._measure_group(
+                channel_layer, f'{group}.workers',
+                [await channel_layer.new_channel('fanout') for _ in range(workers)],
+                {'type': fanout.DELIVER, 'slug': group, 'event': event}, repeat,
+            )
+            # O que cada worker faz ao receber: chamar o handler das suas conexões.
+            local = [_FakeConsumer() for _ in range(size // workers)]
+            delivery = await self._measure(repeat, lambda: fanout.deliver(local, event))
+
+            self.stdout.write(
+                f'{size:>9} {direct * 1000:>9.2f} ms {hierarchical * 1000:>9.2f} ms {delivery * 1000:>12.2f} ms'
+            )
+
+    async def _measure_group(self, channel_layer, group, channels, event, repeat):
+        try:
+            for channel in channels:
+                await channel_layer.group_add(group, channel)
+            return await self._measure(repeat, lambda: channel_layer.group_send(group, event))
+        finally:
+            for channel in channels:
+                await channel_layer.group_discard(group, channel)
+
+    async def _measure(self, repeat, send):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await send()
+        return (time.perf_counter() - start) / repeat
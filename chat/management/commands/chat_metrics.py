@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from chat import metrics
+
+
+class Command(BaseCommand):
+    help = 'Mostra os contadores (somados entre os workers) e gauges de chat/metrics.py.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zera os contadores depois de mostrar.')
+
+    def handle(self, *args, **options):
+        counters, gauges = metrics.counters(), metrics.gauges()
+        if not counters and not gauges:
+            self.stdout.write('Nenhum contador registrado.')
+        for name in sorted(counters):
+            self.stdout.write(f'{name}: {counters[name]}')
+        for name in sorted(gauges):
+            self.stdout.write(f'{name} (máximo): {gauges[name]}')
+        if options['reset']:
+            metrics.reset()
+            self.stdout.write(self.style.SUCCESS('Contadores zerados.'))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import archive
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = (
+        'Move para o arquivo frio as mensagens mais antigas que a retenção de cada sala, '
+        'um segmento por vez.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', help='Slug de uma sala específica.')
+        parser.add_argument('--max-segments', type=int, default=None, help='Para depois de gravar esse número de segmentos.')
+        parser.add_argument('--pause', type=float, default=0, help='Segundos de pausa entre segmentos.')
+
+    def handle(self, *args, **options):
+        rooms = ChatRoom.objects.order_by('id')
+        if options['room']:
+            rooms = rooms.filter(slug=options['room'])
+
+        segments = 0
+        for room in rooms:
+            if not archive.retention_days(room):
+                continue
+            archived = 0
+            while options['max_segments'] is None or segments < options['max_segments']:
+                count = archive.compact_room(room)
+                if not count:
+                    break
+                segments += 1
+                archived += count
+                if options['pause']:
+                    time.sleep(options['pause'])
+            if archived:
+                self.stdout.write(f'{room.name}: {archived} mensagens arquivadas')
+            if options['max_segments'] is not None and segments >= options['max_segments']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'{segments} segmentos gravados.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chat import last_seen
+
+
+class Command(BaseCommand):
+    help = 'Grava no banco os last_seen pendentes no buffer do Redis.'
+
+    def handle(self, *args, **options):
+        flushed = last_seen.flush()
+        self.stdout.write(self.style.SUCCESS(f'{flushed} perfis atualizados.'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import purge
+
+
+class Command(BaseCommand):
+    help = (
+        'Apaga em lotes o histórico das salas excluídas (RoomPurgeJob pendentes), '
+        'retomando jobs interrompidos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Continua rodando e verifica novos jobs periodicamente.')
+        parser.add_argument('--interval', type=int, default=30, help='Segundos entre verificações com --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            for job in purge.pending_jobs():
+                self.stdout.write(f'Purge da sala {job.room_name} (job {job.pk})...')
+                try:
+                    ran = purge.run_job(job, chunk_size=options['chunk_size'], progress=self._progress)
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Falhou: {e}'))
+                    continue
+                if ran:
+                    self.stdout.write(self.style.SUCCESS(f'Sala {job.room_name} apagada.'))
+                else:
+                    self.stdout.write(self.style.WARNING('Job em andamento em outro processo; pulando.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def _progress(self, job):
+        self.stdout.write(f'  {job.deleted_messages}/{job.total_messages} mensagens apagadas')
@@ -0,0 +1,60 @@
+from django.utils import timezone
+
+from .models import RoomMembership
+
+# Mantém RoomMembership atualizado de forma incremental: entradas e mensagens
+# só mexem em last_active_at; o papel muda apenas via set_role.
+
+
+def record_activity(room, user):
+    if room is None:
+        return
+    now = timezone.now()
+    updated = RoomMembership.objects.filter(room=room, user=user).update(last_active_at=now)
+    if not updated:
+        RoomMembership.objects.get_or_create(
+            room=room, user=user,
+            defaults={'joined_at': now, 'last_active_at': now},
+        )
+
+
+# Entrar na sala é o mesmo que registrar atividade.
+record_join = record_activity
+
+
+def set_role(room, user, role):
+    if room is None:
+        return
+    membership, created = RoomMembership.objects.get_or_create(
+        room=room, user=user, defaults={'role': role},
+    )
+    # O criador mantém o papel mesmo se promovido/rebaixado/banido.
+    if created or membership.role in (role, RoomMembership.ROLE_CREATOR):
+        return
+    membership.role = role
+    membership.save(update_fields=['role'])
+
+
+# Versão em lote usada pelo pipeline de ingestão: 1 UPDATE por sala e
+# criação apenas para quem ainda não é membro.
+def record_activity_many(room, user_ids):
+    if room is None or not user_ids:
+        return
+    now = timezone.now()
+    user_ids = set(user_ids)
+    RoomMembership.objects.filter(room=room, user_id__in=user_ids).update(last_active_at=now)
+    existing = set(RoomMembership.objects.filter(room=room, user_id__in=user_ids).values_list('user_id', flat=True))
+    for user_id in user_ids - existing:
+        RoomMembership.objects.get_or_create(
+            room=room, user_id=user_id,
+            defaults={'joined_at': now, 'last_active_at': now},
+        )
+
+
+# Slugs das salas (não excluídas) de que o usuário participa, opcionalmente
+# restritos a uma lista de salas.
+def room_slugs(user, rooms=None):
+    memberships = RoomMembership.objects.filter(user=user, room__deleted_at__isnull=True).exclude(role=RoomMembership.ROLE_BANNED)
+    if rooms is not None:
+        memberships = memberships.filter(room_id__in=[room.id for room in rooms])
+    return list(memberships.values_list('room__slug', flat=True))
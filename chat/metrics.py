@@ -0,0 +1,77 @@
+import logging
+import os
+import socket
+import time
+from collections import Counter
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+# Contadores operacionais (limites de taxa, fila de saída...). Cada
+# processo soma em memória e descarrega no Redis ('metrics:counters', HASH)
+# no máximo a cada METRICS_FLUSH_SECONDS, para um cliente abusivo não virar
+# uma escrita no Redis por frame. Leitura: manage.py chat_metrics.
+
+COUNTERS_KEY = 'metrics:counters'
+# Máximo de cada gauge na última janela, um campo por processo.
+GAUGES_KEY = 'metrics:gauges'
+
+_pending = Counter()
+_peaks = {}
+_last_flush = 0.0
+_process = f'{socket.gethostname()}:{os.getpid()}'
+
+
+async def incr(name, amount=1):
+    _pending[name] += amount
+    await _maybe_flush()
+
+
+async def peak(name, value):
+    if value > _peaks.get(name, 0):
+        _peaks[name] = value
+    await _maybe_flush()
+
+
+async def _maybe_flush():
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush < settings.METRICS_FLUSH_SECONDS:
+        return
+    _last_flush = now
+    pending, peaks = dict(_pending), dict(_peaks)
+    _pending.clear()
+    _peaks.clear()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for key, value in pending.items():
+            pipe.hincrby(COUNTERS_KEY, key, value)
+        for key, value in peaks.items():
+            pipe.hset(GAUGES_KEY, f'{key}@{_process}', value)
+        await pipe.execute()
+    except RedisError as e:
+        logger.error(f"Erro ao gravar métricas: {e}")
+
+
+def counters():
+    try:
+        return {name: int(value) for name, value in get_sync_redis().hgetall(COUNTERS_KEY).items()}
+    except RedisError as e:
+        logger.error(f"Erro ao ler métricas: {e}")
+        return {}
+
+
+def gauges():
+    try:
+        return {name: int(value) for name, value in get_sync_redis().hgetall(GAUGES_KEY).items()}
+    except RedisError as e:
+        logger.error(f"Erro ao ler métricas: {e}")
+        return {}
+
+
+def reset():
+    get_sync_redis().delete(COUNTERS_KEY, GAUGES_KEY)
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_alter_chatroom_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('member', 'Membro'), ('admin', 'Administrador'), ('creator', 'Criador'), ('banned', 'Banido')], default='member', max_length=10)),
+                ('joined_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_active_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'role'], name='chat_roomme_room_id_37d57f_idx')],
+                'unique_together': {('room', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 2000
+
+
+# Preenche room / conversation das mensagens antigas em lotes por faixa de id,
+# cada lote na sua própria transação, para não travar a tabela inteira.
+# Nomes de sala não são únicos: com mais de uma sala de mesmo nome, a
+# mensagem vai para a sala mais recente criada antes dela.
+def backfill(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    DirectConversation = apps.get_model('chat', 'DirectConversation')
+
+    rooms_by_name = defaultdict(list)
+    for room_id, name, created_at in ChatRoom.objects.order_by('created_at').values_list('id', 'name', 'created_at'):
+        rooms_by_name[name].append((created_at, room_id))
+    conversations = dict(DirectConversation.objects.values_list('slug', 'id'))
+
+    def room_for(name, timestamp):
+        candidates = rooms_by_name.get(name)
+        if not candidates:
+            return None
+        chosen = candidates[0][1]
+        for created_at, room_id in candidates:
+            if created_at <= timestamp:
+                chosen = room_id
+        return chosen
+
+    last_id = 0
+    max_id = ChatMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    while last_id < max_id:
+        upper = last_id + BATCH_SIZE
+        rows = ChatMessage.objects.filter(
+            id__gt=last_id, id__lte=upper, room__isnull=True, conversation__isnull=True,
+        ).values_list('id', 'room_name', 'timestamp')
+
+        by_room, by_conversation = defaultdict(list), defaultdict(list)
+        for message_id, room_name, timestamp in rows:
+            if room_name.startswith('dm-'):
+                if room_name in conversations:
+                    by_conversation[conversations[room_name]].append(message_id)
+            else:
+                room_id = room_for(room_name, timestamp)
+                if room_id is not None:
+                    by_room[room_id].append(message_id)
+
+        with transaction.atomic():
+            for room_id, ids in by_room.items():
+                ChatMessage.objects.filter(id__in=ids).update(room_id=room_id)
+            for conversation_id, ids in by_conversation.items():
+                ChatMessage.objects.filter(id__in=ids).update(conversation_id=conversation_id)
+        last_id = upper
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('chat', '0021_chatmessage_room_conversation'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:57
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+# Converte ChatMessage.deleted_by em UserRoomState: o maior prefixo contínuo
+# de mensagens ocultas de cada sala vira cleared_up_to (o "limpar conversa"
+# antigo ocultava a sala inteira); o resto fica em hidden_ids.
+def migrate_deleted_by(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    UserRoomState = apps.get_model('chat', 'UserRoomState')
+    through = ChatMessage.deleted_by.through
+
+    hidden = defaultdict(list)
+    rows = through.objects.values_list(
+        'user_id', 'chatmessage_id', 'chatmessage__room_id', 'chatmessage__conversation_id',
+    ).iterator(chunk_size=5000)
+    for user_id, message_id, room_id, conversation_id in rows:
+        if room_id is not None:
+            hidden[(user_id, 'room', room_id)].append(message_id)
+        elif conversation_id is not None:
+            hidden[(user_id, 'conversation', conversation_id)].append(message_id)
+
+    states = []
+    for (user_id, kind, target_id), message_ids in hidden.items():
+        message_ids.sort()
+        history = ChatMessage.objects.filter(**{f'{kind}_id': target_id}).order_by('id').values_list('id', flat=True)
+        cleared_up_to = 0
+        for position, message_id in enumerate(history.iterator(chunk_size=5000)):
+            if position >= len(message_ids) or message_ids[position] != message_id:
+                break
+            cleared_up_to = message_id
+        states.append(UserRoomState(
+            user_id=user_id,
+            cleared_up_to=cleared_up_to,
+            hidden_ids=[message_id for message_id in message_ids if message_id > cleared_up_to],
+            **{f'{kind}_id': target_id},
+        ))
+    UserRoomState.objects.bulk_create(states, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0022_backfill_chatmessage_room'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRoomState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cleared_up_to', models.BigIntegerField(default=0)),
+                ('hidden_ids', models.JSONField(blank=True, default=list)),
+                ('conversation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='user_states', to='chat.directconversation')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='user_states', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_states', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='userroomstate',
+            constraint=models.UniqueConstraint(condition=models.Q(('room__isnull', False)), fields=('user', 'room'), name='unique_user_room_state'),
+        ),
+        migrations.AddConstraint(
+            model_name='userroomstate',
+            constraint=models.UniqueConstraint(condition=models.Q(('conversation__isnull', False)), fields=('user', 'conversation'), name='unique_user_conversation_state'),
+        ),
+        migrations.RunPython(migrate_deleted_by, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0023_userroomstate'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chatmessage',
+            name='deleted_by',
+        ),
+    ]
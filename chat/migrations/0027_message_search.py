@@ -0,0 +1,49 @@
+from django.db import migrations
+
+# Tabela do índice de busca (ver chat/search.py). Não é um model: no SQLite é
+# uma tabela virtual FTS5; no Postgres, tsvector com índice GIN. Em outros
+# bancos a busca fica desativada e nada é criado.
+PG_CONFIG = 'portuguese'
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE chat_messagesearch USING fts5("
+            "content, room_id UNINDEXED, conversation_id UNINDEXED, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO chat_messagesearch (rowid, room_id, conversation_id, content) "
+            "SELECT id, room_id, conversation_id, content FROM chat_chatmessage "
+            "WHERE NOT is_deleted_for_everyone AND (room_id IS NOT NULL OR conversation_id IS NOT NULL)"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE chat_messagesearch ("
+            "message_id bigint PRIMARY KEY, room_id bigint NULL, conversation_id bigint NULL, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "INSERT INTO chat_messagesearch (message_id, room_id, conversation_id, document) "
+            f"SELECT id, room_id, conversation_id, to_tsvector('{PG_CONFIG}', content) FROM chat_chatmessage "
+            "WHERE NOT is_deleted_for_everyone AND (room_id IS NOT NULL OR conversation_id IS NOT NULL)"
+        )
+        schema_editor.execute("CREATE INDEX chat_messagesearch_document ON chat_messagesearch USING GIN (document)")
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS chat_messagesearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0026_history_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -7,14 +7,24 @@ from cloudinary.models import CloudinaryField
 
 class ChatMessage(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_messages')
+    # room_name guarda o nome da sala no momento do envio (ou o slug da DM);
+    # consultas usam room / conversation, que não mudam com renomeações. Os
+    # índices compostos abaixo cobrem também as buscas só pela FK.
     room_name = models.CharField(max_length=255)
+    room = models.ForeignKey('ChatRoom', on_delete=models.CASCADE, null=True, blank=True, related_name='messages', db_index=False)
+    conversation = models.ForeignKey('DirectConversation', on_delete=models.CASCADE, null=True, blank=True, related_name='messages', db_index=False)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='replies')
-    deleted_by = models.ManyToManyField(User, related_name='deleted_messages', blank=True)
     is_deleted_for_everyone = models.BooleanField(default=False)
     deleted_by_admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='admin_deleted_messages')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'timestamp', 'id']),
+            models.Index(fields=['conversation', 'timestamp', 'id']),
+        ]
+
     def __str__(self):
         return f'Message from {self.author.username} in {self.room_name}'
 
@@ -32,6 +42,12 @@ class Profile(models.Model):
     def __str__(self):
         return f'Perfil de {self.user.username}'
 
+# Salas excluídas ficam marcadas (deleted_at) até o purge em segundo plano
+# terminar de apagar o histórico; ChatRoom.objects já não as enxerga.
+class ActiveRoomManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 class ChatRoom(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(max_length=100, unique=True)
@@ -41,6 +57,13 @@ class ChatRoom(models.Model):
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_rooms')
     admins = models.ManyToManyField(User, related_name='admin_of_rooms', blank=True)
     is_muted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Dias de histórico no banco; o que for mais antigo vai para o arquivo
+    # (chat/archive.py). Vazio usa HISTORY_RETENTION_DAYS.
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+
+    objects = ActiveRoomManager()
+    all_objects = models.Manager()
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -72,4 +95,124 @@ class ChatRoomMute(models.Model):
     muted_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('room', 'muted_user')
\ No newline at end of file
+        unique_together = ('room', 'muted_user')
+
+class RoomMembership(models.Model):
+    ROLE_MEMBER = 'member'
+    ROLE_ADMIN = 'admin'
+    ROLE_CREATOR = 'creator'
+    ROLE_BANNED = 'banned'
+    ROLE_CHOICES = [
+        (ROLE_MEMBER, 'Membro'),
+        (ROLE_ADMIN, 'Administrador'),
+        (ROLE_CREATOR, 'Criador'),
+        (ROLE_BANNED, 'Banido'),
+    ]
+
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='room_memberships')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=ROLE_MEMBER)
+    joined_at = models.DateTimeField(default=timezone.now)
+    last_active_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('room', 'user')
+        indexes = [models.Index(fields=['room', 'role'])]
+
+    def __str__(self):
+        return f'{self.user.username} em {self.room.name} ({self.role})'
+
+# Uma linha por par de participantes de DM (user_a tem o menor id). O slug é
+# o mesmo da URL da conversa ('dm-<usuário>-<usuário>').
+class DirectConversation(models.Model):
+    slug = models.CharField(max_length=255, unique=True)
+    user_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(ChatMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    unread_a = models.PositiveIntegerField(default=0)
+    unread_b = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user_a', 'user_b')
+        indexes = [
+            models.Index(fields=['user_a', '-last_message_at']),
+            models.Index(fields=['user_b', '-last_message_at']),
+        ]
+
+    def other_user(self, user):
+        return self.user_b if user.id == self.user_a_id else self.user_a
+
+    def unread_for(self, user):
+        return self.unread_a if user.id == self.user_a_id else self.unread_b
+
+    def __str__(self):
+        return self.slug
+
+# Limpeza do histórico de um usuário numa sala ou DM: mensagens com id
+# até cleared_up_to foram limpas por ele; hidden_ids são as apagadas "só para
+# mim" depois disso.
+class UserRoomState(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='room_states')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, null=True, blank=True, related_name='user_states')
+    conversation = models.ForeignKey(DirectConversation, on_delete=models.CASCADE, null=True, blank=True, related_name='user_states')
+    cleared_up_to = models.BigIntegerField(default=0)
+    hidden_ids = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room'], condition=models.Q(room__isnull=False), name='unique_user_room_state'),
+            models.UniqueConstraint(fields=['user', 'conversation'], condition=models.Q(conversation__isnull=False), name='unique_user_conversation_state'),
+        ]
+
+    def __str__(self):
+        return f'Estado de {self.user.username} em {self.room or self.conversation}'
+
+class RoomPurgeJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_RUNNING, 'Em andamento'),
+        (STATUS_DONE, 'Concluído'),
+        (STATUS_FAILED, 'Falhou'),
+    ]
+
+    room = models.ForeignKey(ChatRoom, on_delete=models.SET_NULL, null=True, blank=True, related_name='purge_jobs')
+    room_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total_messages = models.PositiveIntegerField(default=0)
+    deleted_messages = models.PositiveIntegerField(default=0)
+    # Quem está processando o job renova a trava a cada lote; se o processo
+    # cair, outro retoma depois que ela expira.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Purge de {self.room_name} ({self.status})'
+
+# Segmento do arquivo frio de uma sala: um arquivo gzip com vários membros
+# (blocos) de NDJSON, em ordem de id. blocks é o índice esparso:
+# [primeiro id, offset, tamanho] de cada bloco.
+class ArchiveSegment(models.Model):
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archive_segments')
+    path = models.CharField(max_length=255)
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    blocks = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['room', 'last_id'])]
+
+    def __str__(self):
+        return f'{self.room.name}: {self.first_id}-{self.last_id}'
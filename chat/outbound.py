@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+
+from . import background, metrics
+
+logger = logging.getLogger(__name__)
+
+# Fila de saída limitada por conexão. Os handlers só enfileiram; uma task por
+# conexão envia ao cliente, então um cliente lento não segura o consumo do
+# inbox no channel layer (que, cheio, descarta mensagens sem avisar).
+#
+# Faixas, da mais prioritária para a menos:
+#   CONTROL   moderação, sistema, respostas a pedidos do cliente (padrão)
+#   CHAT      mensagens e exclusões, que precisam manter a ordem entre si
+#   EPHEMERAL digitação e presença: descartáveis; typing_update é coalescido
+#             (só o último estado importa) e um presence_delta perdido faz
+#             o cliente pedir roster_sync pela lacuna de versão.
+# Fila cheia sem nada descartável, ou item mais antigo esperando mais que
+# WS_SEND_MAX_LAG_SECONDS: a conexão é fechada com RESYNC_CLOSE_CODE e o
+# cliente recarrega o estado. O mesmo vale se o envio ao cliente falhar.
+
+CONTROL, CHAT, EPHEMERAL = range(3)
+
+LANES = {
+    'chat_message': CHAT,
+    'batch': CHAT,
+    'message_deleted_for_everyone': CHAT,
+    'message_deleted_for_me': CHAT,
+    'typing_update': EPHEMERAL,
+    'presence_delta': EPHEMERAL,
+}
+COALESCED = {'typing_update'}
+
+RESYNC_CLOSE_CODE = 4008
+
+
+class OutboundQueue:
+    def __init__(self, consumer, max_size=None, max_lag=None):
+        self.consumer = consumer
+        self.max_size = max_size or settings.WS_SEND_QUEUE_MAX
+        self.max_lag = max_lag if max_lag is not None else settings.WS_SEND_MAX_LAG_SECONDS
+        self.lanes = (deque(), deque(), deque())
+        self.evicted = False
+        self.ready = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.task = background.spawn(self._run(), name='outbound')
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    async def put(self, event_type, text_data=None, bytes_data=None):
+        if self.evicted:
+            return
+        lane = LANES.get(event_type, CONTROL)
+        if event_type in COALESCED and self._discard(self.lanes[lane], event_type):
+            await metrics.incr(f'ws.send.coalesced.{event_type}')
+
+        if len(self) >= self.max_size:
+            if lane == EPHEMERAL:
+                await metrics.incr(f'ws.send.dropped.{event_type}')
+                return
+            if not self.lanes[EPHEMERAL]:
+                await self.evict('queue_full')
+                return
+            dropped = self.lanes[EPHEMERAL].popleft()
+            await metrics.incr(f'ws.send.dropped.{dropped[1]}')
+
+        now = time.monotonic()
+        oldest = min((queue[0][0] for queue in self.lanes if queue), default=now)
+        if now - oldest > self.max_lag:
+            await self.evict('lag')
+            return
+
+        self.lanes[lane].append((now, event_type, text_data, bytes_data))
+        self.idle.clear()
+        self.ready.set()
+        await metrics.peak('ws.send.queue_depth', len(self))
+
+    def _discard(self, queue, event_type):
+        for index, item in enumerate(queue):
+            if item[1] == event_type:
+                del queue[index]
+                return True
+        return False
+
+    def _pop(self):
+        for queue in self.lanes:
+            if queue:
+                return queue.popleft()
+        return None
+
+    async def _run(self):
+        while True:
+            await self.ready.wait()
+            item = self._pop()
+            if item is None:
+                self.ready.clear()
+                self.idle.set()
+                continue
+            try:
+                await self.consumer.send(text_data=item[2], bytes_data=item[3])
+            except Exception as e:
+                logger.error(f"Erro ao enviar {item[1]} ao cliente: {e!r}")
+                await self.evict('send_failed')
+                return
+
+    # Espera o que já foi enfileirado sair (ex.: aviso antes de um close).
+    async def flush(self, timeout=1.0):
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop(self):
+        # A própria task de envio pode parar a fila (envio falhou).
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        for queue in self.lanes:
+            queue.clear()
+
+    async def evict(self, reason):
+        self.evicted = True
+        self.stop()
+        await metrics.incr(f'ws.send.evicted.{reason}')
+        await self.consumer.close(code=RESYNC_CLOSE_CODE)
@@ -0,0 +1,179 @@
+import time
+
+from django.conf import settings
+
+from .redis_client import get_redis, LuaScript
+
+# Registro de presença compartilhado entre todos os workers.
+# Para cada sala guardamos:
+#   presence:<slug>:leases  ZSET  channel_name -> expiração do lease (ms)
+#   presence:<slug>:owners  HASH  channel_name -> username
+#   presence:<slug>:users   HASH  username -> número de conexões abertas
+#   presence:<slug>:version STRING versão do roster, incrementada a cada delta
+# Leases não renovados pelo heartbeat (ex.: worker que caiu) são removidos
+# no início de cada script, antes de qualquer contagem.
+
+_PURGE = """
+local leases, owners, users = KEYS[1], KEYS[2], KEYS[3]
+local function purge(now)
+    local gone = {}
+    local expired = redis.call('ZRANGEBYSCORE', leases, '-inf', now)
+    for _, channel in ipairs(expired) do
+        local username = redis.call('HGET', owners, channel)
+        redis.call('HDEL', owners, channel)
+        if username and redis.call('HINCRBY', users, username, -1) <= 0 then
+            redis.call('HDEL', users, username)
+            table.insert(gone, username)
+        end
+    end
+    if #expired > 0 then
+        redis.call('ZREMRANGEBYSCORE', leases, '-inf', now)
+    end
+    return gone
+end
+local function touch_keys(ttl)
+    redis.call('PEXPIRE', leases, ttl)
+    redis.call('PEXPIRE', owners, ttl)
+    redis.call('PEXPIRE', users, ttl)
+end
+"""
+
+_ADMIT = LuaScript(_PURGE + """
+local channel, username = ARGV[1], ARGV[2]
+local now, lease_ms, limit = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+purge(now)
+local refs = tonumber(redis.call('HGET', users, username) or '0')
+local total = redis.call('HLEN', users)
+if refs == 0 and limit > 0 and total >= limit then
+    return {0, total, 0}
+end
+redis.call('ZADD', leases, now + lease_ms, channel)
+if redis.call('HSETNX', owners, channel, username) == 1 then
+    refs = redis.call('HINCRBY', users, username, 1)
+end
+touch_keys(lease_ms * 2)
+return {1, redis.call('HLEN', users), refs}
+""")
+
+_RELEASE = LuaScript(_PURGE + """
+local channel = ARGV[1]
+redis.call('ZREM', leases, channel)
+local username = redis.call('HGET', owners, channel)
+if not username then
+    return {0, redis.call('HLEN', users)}
+end
+redis.call('HDEL', owners, channel)
+local last = 0
+if redis.call('HINCRBY', users, username, -1) <= 0 then
+    redis.call('HDEL', users, username)
+    last = 1
+end
+return {last, redis.call('HLEN', users)}
+""")
+
+# A versão do roster também é renovada: numa sala sem deltas por mais que
+# ROSTER_VERSION_TTL ela expiraria e voltaria a 1 com clientes ainda conectados.
+_RENEW = LuaScript(_PURGE + """
+local channel = ARGV[1]
+local now, lease_ms, version_ttl = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local gone = purge(now)
+if not redis.call('ZSCORE', leases, channel) then
+    return {0, gone}
+end
+redis.call('ZADD', leases, now + lease_ms, channel)
+touch_keys(lease_ms * 2)
+redis.call('EXPIRE', KEYS[4], version_ttl)
+return {1, gone}
+""")
+
+_MEMBERS = LuaScript(_PURGE + """
+purge(tonumber(ARGV[1]))
+return redis.call('HKEYS', users)
+""")
+
+
+# Deltas idênticos (mesma operação, mesmo usuário) dentro da janela são
+# descartados; publicar a operação oposta libera a janela da original, para
+# que online -> offline -> online não perca o último evento.
+_NEXT_VERSION = LuaScript("""
+local version_key, dedupe_key, opposite_key = KEYS[1], KEYS[2], KEYS[3]
+local window_ms, version_ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+if window_ms > 0 and not redis.call('SET', dedupe_key, '1', 'NX', 'PX', window_ms) then
+    return 0
+end
+redis.call('DEL', opposite_key)
+local version = redis.call('INCR', version_key)
+redis.call('EXPIRE', version_key, version_ttl)
+return version
+""")
+
+_OPPOSITE_OPS = {
+    'online': 'offline', 'offline': 'online',
+    'joined': 'left', 'left': 'joined',
+    'promoted': 'demoted', 'demoted': 'promoted',
+    'muted': 'unmuted', 'unmuted': 'muted',
+}
+
+ROSTER_VERSION_TTL = 24 * 60 * 60
+
+
+def _keys(room_slug):
+    base = f'presence:{room_slug}'
+    return (f'{base}:leases', f'{base}:owners', f'{base}:users')
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _lease_ms():
+    return settings.PRESENCE_LEASE_TTL * 1000
+
+
+# Registra a conexão, recusando atomicamente se a sala já está no limite.
+# Retorna (admitido, total_de_usuarios, primeira_conexao_do_usuario).
+async def admit(room_slug, username, channel_name, user_limit=0):
+    admitted, total, refs = await _ADMIT(
+        keys=_keys(room_slug),
+        args=(channel_name, username, _now_ms(), _lease_ms(), user_limit or 0),
+    )
+    return bool(admitted), int(total), int(refs) == 1
+
+
+# Retorna (era_a_ultima_conexao_do_usuario, total).
+async def release(room_slug, channel_name):
+    last, total = await _RELEASE(keys=_keys(room_slug), args=(channel_name,))
+    return bool(last), int(total)
+
+
+# Retorna (renovado, usuarios_cujo_ultimo_lease_expirou).
+async def renew(room_slug, channel_name):
+    renewed, gone = await _RENEW(
+        keys=_keys(room_slug) + (f'presence:{room_slug}:version',),
+        args=(channel_name, _now_ms(), _lease_ms(), ROSTER_VERSION_TTL),
+    )
+    return bool(renewed), gone
+
+
+async def online_usernames(room_slug):
+    return await _MEMBERS(keys=_keys(room_slug), args=(_now_ms(),))
+
+
+async def channels_for(room_slug, username):
+    owners = await get_redis().hgetall(_keys(room_slug)[1])
+    return [channel for channel, owner in owners.items() if owner == username]
+
+
+async def roster_version(room_slug):
+    return int(await get_redis().get(f'presence:{room_slug}:version') or 0)
+
+
+# Retorna a versão do delta, ou None se ele foi absorvido por um idêntico recente.
+async def next_roster_version(room_slug, op, username):
+    base = f'presence:{room_slug}'
+    opposite = _OPPOSITE_OPS.get(op, op)
+    version = await _NEXT_VERSION(
+        keys=(f'{base}:version', f'{base}:delta:{op}:{username}', f'{base}:delta:{opposite}:{username}'),
+        args=(settings.PRESENCE_DELTA_COALESCE_MS, ROSTER_VERSION_TTL),
+    )
+    return int(version) or None
@@ -0,0 +1,118 @@
+import logging
+import threading
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChatMessage, ChatRoom, RoomMembership, RoomPurgeJob, UserRoomState
+from . import archive, fanout, lobby, search, unread
+
+logger = logging.getLogger(__name__)
+
+# Exclusão de sala em duas etapas. Na requisição, a sala só é marcada como
+# excluída (deleted_at), o slug é liberado, os clientes conectados são
+# desconectados e um RoomPurgeJob é criado. O histórico é apagado depois, em
+# lotes de PURGE_CHUNK_SIZE, por uma thread iniciada na exclusão ou pelo
+# comando purge_deleted_rooms. Cada lote grava o progresso na mesma transação
+# da exclusão, então um purge interrompido continua de onde parou.
+
+
+def soft_delete_room(room):
+    old_slug = room.slug
+    with transaction.atomic():
+        room.deleted_at = timezone.now()
+        # Libera o slug para uma nova sala com o mesmo nome.
+        room.slug = f'deleted-{room.pk}-{old_slug}'[:100]
+        room.save(update_fields=['deleted_at', 'slug'])
+        job = RoomPurgeJob.objects.create(
+            room=room,
+            room_name=room.name,
+            total_messages=ChatMessage.objects.filter(room=room).count(),
+        )
+        transaction.on_commit(lambda: _after_delete(old_slug, job.pk))
+    return job
+
+
+def _after_delete(slug, job_id):
+    lobby.forget_room(slug)
+    unread.forget_room(slug)
+    try:
+        async_to_sync(fanout.group_send)(slug, {'type': 'room_deleted'})
+    except Exception as e:
+        logger.error(f"Erro ao avisar clientes da sala excluída {slug}: {e}")
+    # Só depois do aviso: ele ainda precisa saber se a sala está no modo grande.
+    fanout.forget_room(slug)
+    threading.Thread(target=_run_in_thread, args=(job_id,), name=f'room-purge-{job_id}', daemon=True).start()
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_job(RoomPurgeJob.objects.get(pk=job_id))
+    except Exception as e:
+        logger.error(f"Erro no purge da sala (job {job_id}): {e}")
+    finally:
+        close_old_connections()
+
+
+def _claim(job):
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.PURGE_LEASE_SECONDS)
+    claimed = RoomPurgeJob.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        pk=job.pk,
+        status__in=[RoomPurgeJob.STATUS_PENDING, RoomPurgeJob.STATUS_RUNNING, RoomPurgeJob.STATUS_FAILED],
+    ).update(locked_until=lease, status=RoomPurgeJob.STATUS_RUNNING)
+    return claimed == 1
+
+
+@transaction.atomic
+def _purge_chunk(job, queryset, chunk_size, counts_messages=False):
+    ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk_size])
+    if not ids:
+        return 0
+    queryset.model.objects.filter(id__in=ids).delete()
+    if counts_messages:
+        search.remove_messages(ids)
+    job.locked_until = timezone.now() + timedelta(seconds=settings.PURGE_LEASE_SECONDS)
+    if counts_messages:
+        job.deleted_messages += len(ids)
+    job.save(update_fields=['deleted_messages', 'locked_until', 'updated_at'])
+    return len(ids)
+
+
+def run_job(job, chunk_size=None, progress=None):
+    chunk_size = chunk_size or settings.PURGE_CHUNK_SIZE
+    if not _claim(job):
+        return False
+    job.refresh_from_db()
+
+    try:
+        if job.room_id is not None:
+            while _purge_chunk(job, ChatMessage.objects.filter(room_id=job.room_id), chunk_size, counts_messages=True):
+                if progress:
+                    progress(job)
+            for related in (RoomMembership, UserRoomState):
+                while _purge_chunk(job, related.objects.filter(room_id=job.room_id), chunk_size):
+                    pass
+            archive.delete_room_archive(job.room_id)
+            ChatRoom.all_objects.filter(pk=job.room_id).delete()
+    except Exception as e:
+        RoomPurgeJob.objects.filter(pk=job.pk).update(
+            status=RoomPurgeJob.STATUS_FAILED, last_error=str(e), locked_until=None,
+        )
+        raise
+
+    RoomPurgeJob.objects.filter(pk=job.pk).update(
+        status=RoomPurgeJob.STATUS_DONE, finished_at=timezone.now(), locked_until=None, last_error='',
+    )
+    logger.info(f"Purge da sala {job.room_name} concluído: {job.deleted_messages} mensagens apagadas")
+    return True
+
+
+def pending_jobs():
+    return RoomPurgeJob.objects.exclude(status=RoomPurgeJob.STATUS_DONE).order_by('id')
@@ -0,0 +1,103 @@
+import logging
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from .redis_client import LuaScript
+
+logger = logging.getLogger(__name__)
+
+# Token bucket por classe de ação, em dois níveis: um por conexão, em
+# memória, e um por usuário no Redis ('ratelimit:<classe>:<usuário>'),
+# valendo para todas as conexões dele em qualquer worker. O da conexão é
+# consultado primeiro, então um cliente em loop é barrado sem ir ao Redis.
+# Limites em WS_RATE_LIMITS_CONNECTION / WS_RATE_LIMITS_USER, no formato
+# '<rajada>/<segundos>'. Se o Redis falhar, só o limite da conexão vale.
+
+# O relógio é o do próprio Redis, igual para todos os workers. Devolve em
+# quantos milissegundos a ação pode ser tentada de novo (0 = liberada).
+_TAKE = LuaScript("""
+local key = KEYS[1]
+local capacity, per_ms = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * per_ms)
+local retry = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry = math.ceil((1 - tokens) / per_ms)
+end
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', key, math.ceil(capacity / per_ms) + 1000)
+return retry
+""")
+
+
+def parse_limit(spec):
+    burst, seconds = str(spec).split('/')
+    return int(burst), float(seconds)
+
+
+def action_class(frame):
+    message_type = frame.get('type')
+    if message_type == 'leave_chat':
+        return None
+    if message_type in ('admin_action', 'chat_settings') or frame.get('scope') == 'admin_delete':
+        return 'admin'
+    if message_type in ('fetch_history', 'search', 'roster_sync', 'mark_read'):
+        return 'query'
+    if frame.get('heartbeat'):
+        return 'heartbeat'
+    if frame.get('is_typing') is not None and not frame.get('message'):
+        return 'typing'
+    return 'message'
+
+
+class _Bucket:
+    def __init__(self, burst, seconds):
+        self.capacity = burst
+        self.rate = burst / seconds
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ConnectionLimiter:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.buckets = {
+            action: _Bucket(*parse_limit(spec))
+            for action, spec in settings.WS_RATE_LIMITS_CONNECTION.items()
+        }
+
+    # Segundos até poder tentar de novo; 0 se a ação pode seguir.
+    async def check(self, action):
+        bucket = self.buckets.get(action)
+        if bucket is not None:
+            retry_after = bucket.take()
+            if retry_after:
+                return retry_after
+
+        spec = settings.WS_RATE_LIMITS_USER.get(action)
+        if spec is None:
+            return 0
+        burst, seconds = parse_limit(spec)
+        try:
+            retry_ms = await _TAKE(keys=(f'ratelimit:{action}:{self.user_id}',), args=(burst, burst / (seconds * 1000)))
+        except RedisError as e:
+            logger.error(f"Erro no limite de taxa do usuário {self.user_id}: {e}")
+            return 0
+        return retry_ms / 1000
@@ -0,0 +1,48 @@
+import asyncio
+import weakref
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+_sync_client = None
+
+# Um cliente assíncrono por event loop: conexões do redis.asyncio ficam presas
+# ao loop em que foram criadas (async_to_sync cria loops novos a cada chamada).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        _async_clients[loop] = client
+    return client
+
+
+# Cliente síncrono (thread-safe) para views e código em database_sync_to_async.
+def get_sync_redis():
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _sync_client
+
+
+class LuaScript:
+    def __init__(self, source):
+        self.source = source
+        self._script = None
+        self._sync_script = None
+
+    async def __call__(self, keys=(), args=()):
+        client = get_redis()
+        if self._script is None:
+            self._script = client.register_script(self.source)
+        return await self._script(keys=list(keys), args=list(args), client=client)
+
+    def run_sync(self, keys=(), args=()):
+        client = get_sync_redis()
+        if self._sync_script is None:
+            self._sync_script = client.register_script(self.source)
+        return self._sync_script(keys=list(keys), args=list(args), client=client)
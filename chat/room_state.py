@@ -0,0 +1,67 @@
+from django.db import transaction
+
+from .models import ArchiveSegment, ChatMessage, UserRoomState
+
+# Limpeza do histórico por usuário (ver UserRoomState). "Limpar conversa"
+# só move o watermark para a última mensagem atual; "apagar para mim" guarda
+# o id em hidden_ids. As leituras aplicam os dois com id > watermark e um
+# NOT IN sobre a lista (pequena) de ocultas.
+
+
+def _target(room=None, conversation=None):
+    return {'room': room} if room is not None else {'conversation': conversation}
+
+
+def get_state(user, room=None, conversation=None):
+    state = UserRoomState.objects.filter(user=user, **_target(room, conversation)).values_list(
+        'cleared_up_to', 'hidden_ids'
+    ).first()
+    return state or (0, [])
+
+
+def apply(messages, user, room=None, conversation=None, state=None):
+    cleared_up_to, hidden_ids = state or get_state(user, room, conversation)
+    if cleared_up_to:
+        messages = messages.filter(id__gt=cleared_up_to)
+    if hidden_ids:
+        messages = messages.exclude(id__in=hidden_ids)
+    return messages
+
+
+# Mesma regra de apply, para mensagens que não estão no banco (arquivo frio).
+def visible(state):
+    cleared_up_to, hidden_ids = state
+    hidden_ids = set(hidden_ids)
+    return lambda message_id: message_id > cleared_up_to and message_id not in hidden_ids
+
+
+def clear(user, room=None, conversation=None):
+    target = _target(room, conversation)
+    last_id = (
+        ChatMessage.objects.filter(**target)
+        .order_by('-timestamp', '-id')
+        .values_list('id', flat=True)
+        .first()
+    )
+    if last_id is None and room is not None:
+        # Tudo já foi para o arquivo frio.
+        last_id = ArchiveSegment.objects.filter(room=room).order_by('-last_id').values_list('last_id', flat=True).first()
+    if last_id is None:
+        return
+    with transaction.atomic():
+        state, _ = UserRoomState.objects.select_for_update().get_or_create(user=user, **target)
+        state.cleared_up_to = max(state.cleared_up_to, last_id)
+        state.hidden_ids = [message_id for message_id in state.hidden_ids if message_id > state.cleared_up_to]
+        state.save(update_fields=['cleared_up_to', 'hidden_ids'])
+
+
+def hide(user, message):
+    if message.room_id is None and message.conversation_id is None:
+        return
+    target = {'room_id': message.room_id} if message.room_id else {'conversation_id': message.conversation_id}
+    with transaction.atomic():
+        state, _ = UserRoomState.objects.select_for_update().get_or_create(user=user, **target)
+        if message.id <= state.cleared_up_to or message.id in state.hidden_ids:
+            return
+        state.hidden_ids.append(message.id)
+        state.save(update_fields=['hidden_ids'])
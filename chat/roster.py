@@ -0,0 +1,110 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChatRoomMute, DirectConversation, RoomMembership
+from . import last_seen
+
+# Parte estável do roster (quem participa da sala, avatares e papéis) fica em
+# cache por sala; o status online é calculado a cada leitura a partir do
+# registro de presença. O cache é invalidado pelos sinais em chat/signals.py.
+ROSTER_CACHE_TIMEOUT = 60
+ONLINE_WINDOW_SECONDS = 60
+
+
+def roster_cache_key(room_slug):
+    return f'roster:{room_slug}'
+
+
+def format_last_seen(last_seen):
+    return last_seen.strftime('%d/%m às %H:%M') if last_seen else 'Nunca'
+
+
+def _dm_participants(room_slug):
+    return room_slug[3:].split('-')
+
+
+def _member_users(room, room_slug):
+    if room:
+        members = RoomMembership.objects.filter(room=room).exclude(role=RoomMembership.ROLE_BANNED)
+        return User.objects.filter(id__in=members.values('user_id'))
+    return User.objects.filter(username__in=_dm_participants(room_slug))
+
+
+# Sempre 1 query para os usuários/perfis e, em salas públicas, mais 2 para
+# admins e silenciados, independente do número de membros.
+def _entries_for(users, room):
+    users = list(users.select_related('profile'))
+    if room and users:
+        admin_ids = set(room.admins.values_list('id', flat=True))
+        muted_ids = set(ChatRoomMute.objects.filter(room=room).values_list('muted_user_id', flat=True))
+    else:
+        admin_ids = muted_ids = set()
+
+    entries = []
+    for user in users:
+        profile = getattr(user, 'profile', None)
+        if profile is None:
+            continue
+        entries.append({
+            'user_id': user.id,
+            'username': user.username,
+            'avatar_url': profile.avatar.url,
+            'last_seen_at': profile.last_seen,
+            'is_creator': bool(room) and room.creator_id == user.id,
+            'is_admin': bool(room) and user.id in admin_ids,
+            'is_muted': bool(room) and user.id in muted_ids,
+        })
+    return entries
+
+
+# O last_seen do buffer write-behind prevalece quando é mais novo que o do banco.
+def _finalize(entries, online_usernames):
+    now = timezone.now()
+    buffered = last_seen.get_many([entry['user_id'] for entry in entries])
+    roster = []
+    for entry in entries:
+        entry = dict(entry)
+        user_id = entry.pop('user_id')
+        seen_at = max(filter(None, (entry.pop('last_seen_at'), buffered.get(user_id))), default=None)
+        recently_seen = bool(seen_at) and (now - seen_at).total_seconds() < ONLINE_WINDOW_SECONDS
+        entry['is_online'] = entry['username'] in online_usernames or recently_seen
+        entry['last_seen'] = format_last_seen(seen_at)
+        roster.append(entry)
+    return roster
+
+
+def build_roster(room, room_slug, online_usernames):
+    online_usernames = set(online_usernames)
+    key = roster_cache_key(room_slug)
+    entries = cache.get(key)
+    if entries is None:
+        entries = _entries_for(_member_users(room, room_slug), room)
+        cache.set(key, entries, ROSTER_CACHE_TIMEOUT)
+
+    # Quem está conectado mas ainda não faz parte do roster em cache.
+    missing = online_usernames - {entry['username'] for entry in entries}
+    if missing:
+        entries = entries + _entries_for(User.objects.filter(username__in=missing), room)
+    return _finalize(entries, online_usernames)
+
+
+def build_entry(room, username, is_online=True):
+    entries = _entries_for(User.objects.filter(username=username), room)
+    if not entries:
+        return None
+    return _finalize(entries, {username} if is_online else set())[0]
+
+
+def invalidate_roster(room_slug):
+    cache.delete(roster_cache_key(room_slug))
+
+
+def invalidate_user_rosters(user):
+    slugs = set(RoomMembership.objects.filter(user=user).values_list('room__slug', flat=True))
+    slugs.update(
+        DirectConversation.objects.filter(Q(user_a=user) | Q(user_b=user)).values_list('slug', flat=True)
+    )
+    if slugs:
+        cache.delete_many([roster_cache_key(slug) for slug in slugs])
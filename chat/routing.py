@@ -4,4 +4,5 @@ from . import consumers
 websocket_urlpatterns = [
     path('ws/chat/<str:room_slug>/', consumers.ChatConsumer.as_asgi()),
     path('ws/lobby/', consumers.LobbyConsumer.as_asgi()),
+    path('ws/multiplex/', consumers.MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
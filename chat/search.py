@@ -0,0 +1,192 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import ChatMessage, ChatRoomBan, DirectConversation, RoomMembership, UserRoomState
+from . import history
+
+# Busca textual no histórico. O índice fica numa tabela à parte
+# (chat_messagesearch, criada na migração 0027): FTS5 no SQLite e tsvector com
+# índice GIN no Postgres. Ela é mantida pelo código que escreve as mensagens
+# (ingestão, exclusões, arquivo), não por triggers. Linhas de mensagens
+# apagadas em cascata ficam órfãs, mas a busca só devolve ids que ainda
+# existem em ChatMessage.
+#
+# Resultados por relevância e paginados por cursor (score, id), sem OFFSET.
+
+TABLE = 'chat_messagesearch'
+# Fixo: o índice do Postgres foi construído com essa configuração.
+PG_CONFIG = 'portuguese'
+
+_WORD = re.compile(r'\w+')
+
+
+def _vendor():
+    return connection.vendor if connection.vendor in ('sqlite', 'postgresql') else None
+
+
+def clamp_limit(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return settings.SEARCH_PAGE_SIZE
+    return max(1, min(limit, settings.SEARCH_MAX_PAGE_SIZE))
+
+
+def index_messages(messages):
+    rows = [
+        (m.id, m.room_id, m.conversation_id, m.content)
+        for m in messages
+        if not m.is_deleted_for_everyone and (m.room_id or m.conversation_id)
+    ]
+    vendor = _vendor()
+    if not rows or vendor is None:
+        return
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, room_id, conversation_id, content) VALUES (%s, %s, %s, %s)', rows,
+            )
+        else:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (message_id, room_id, conversation_id, document) '
+                f"VALUES (%s, %s, %s, to_tsvector('{PG_CONFIG}', %s)) ON CONFLICT (message_id) DO NOTHING",
+                rows,
+            )
+
+
+def remove_messages(message_ids):
+    message_ids = list(message_ids)
+    vendor = _vendor()
+    if not message_ids or vendor is None:
+        return
+    id_column = 'rowid' if vendor == 'sqlite' else 'message_id'
+    with connection.cursor() as cursor:
+        placeholders = ', '.join(['%s'] * len(message_ids))
+        cursor.execute(f'DELETE FROM {TABLE} WHERE {id_column} IN ({placeholders})', message_ids)
+
+
+def _match_expression(vendor, query):
+    words = _WORD.findall(query.lower())
+    if not words:
+        return None
+    # A última palavra vale como prefixo, para buscar enquanto digita.
+    if vendor == 'sqlite':
+        return ' '.join(f'"{w}"' for w in words[:-1]) + f' "{words[-1]}"*'
+    return ' & '.join(words[:-1] + [f'{words[-1]}:*'])
+
+
+def _parse_cursor(value):
+    try:
+        score, message_id = str(value).split(':')
+        return float(score), int(message_id)
+    except (TypeError, ValueError):
+        return None
+
+
+# Salas em que o usuário é membro (e não está banido) e DMs de que participa.
+def visible_scope(user):
+    banned = ChatRoomBan.objects.filter(banned_user=user).values('room_id')
+    room_ids = list(
+        RoomMembership.objects.filter(user=user, room__deleted_at__isnull=True)
+        .exclude(role=RoomMembership.ROLE_BANNED)
+        .exclude(room_id__in=banned)
+        .values_list('room_id', flat=True)
+    )
+    conversation_ids = list(
+        DirectConversation.objects.filter(Q(user_a=user) | Q(user_b=user)).values_list('id', flat=True)
+    )
+    return room_ids, conversation_ids
+
+
+def _in_list(column, ids, params):
+    params.extend(ids)
+    return f"{column} IN ({', '.join(['%s'] * len(ids))})"
+
+
+def search(user, query, cursor=None, limit=None, room=None, conversation=None):
+    limit = clamp_limit(limit)
+    vendor = _vendor()
+    match = _match_expression(vendor, query or '') if vendor else None
+    if match is None:
+        return [], None
+
+    room_ids, conversation_ids = visible_scope(user)
+    if room is not None:
+        room_ids, conversation_ids = [room.id] if room.id in room_ids else [], []
+    elif conversation is not None:
+        room_ids, conversation_ids = [], [conversation.id] if conversation.id in conversation_ids else []
+    if not room_ids and not conversation_ids:
+        return [], None
+
+    if vendor == 'sqlite':
+        # bm25: quanto menor, mais relevante.
+        params = [match]
+        inner = (
+            f'SELECT s.rowid AS id, s.room_id, s.conversation_id, bm25({TABLE}) AS score '
+            f'FROM {TABLE} s WHERE {TABLE} MATCH %s'
+        )
+    else:
+        params = [match]
+        inner = (
+            f'SELECT s.message_id AS id, s.room_id, s.conversation_id, '
+            f"(-ts_rank(s.document, q))::float8 AS score "
+            f"FROM {TABLE} s, to_tsquery('{PG_CONFIG}', %s) q WHERE s.document @@ q"
+        )
+
+    scope = []
+    if room_ids:
+        scope.append(_in_list('room_id', room_ids, params))
+    if conversation_ids:
+        scope.append(_in_list('conversation_id', conversation_ids, params))
+    conditions = [f"({' OR '.join(scope)})"]
+
+    # Limpeza do histórico por usuário (ver chat/room_state.py).
+    states = UserRoomState.objects.filter(user=user).filter(
+        Q(room_id__in=room_ids) | Q(conversation_id__in=conversation_ids)
+    ).values_list('room_id', 'conversation_id', 'cleared_up_to', 'hidden_ids')
+    hidden_ids = []
+    for state_room_id, state_conversation_id, cleared_up_to, state_hidden_ids in states:
+        hidden_ids.extend(state_hidden_ids)
+        if cleared_up_to:
+            column = 'room_id' if state_room_id else 'conversation_id'
+            conditions.append(f'NOT ({column} = %s AND id <= %s)')
+            params.extend([state_room_id or state_conversation_id, cleared_up_to])
+    if hidden_ids:
+        conditions.append('NOT ' + _in_list('id', hidden_ids, params))
+
+    position = _parse_cursor(cursor) if cursor else None
+    if position is not None:
+        conditions.append('(score > %s OR (score = %s AND id > %s))')
+        params.extend([position[0], position[0], position[1]])
+
+    sql = f"SELECT id, score FROM ({inner}) ranked WHERE {' AND '.join(conditions)} ORDER BY score, id LIMIT %s"
+    params.append(limit + 1)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        ranked = db_cursor.fetchall()
+
+    has_more = len(ranked) > limit
+    ranked = ranked[:limit]
+    messages = ChatMessage.objects.select_related(
+        'author__profile', 'parent__author', 'room', 'conversation__user_a', 'conversation__user_b',
+    ).filter(is_deleted_for_everyone=False).in_bulk([message_id for message_id, _ in ranked])
+    results = [messages[message_id] for message_id, _ in ranked if message_id in messages]
+
+    next_cursor = None
+    if has_more and ranked:
+        message_id, score = ranked[-1]
+        next_cursor = f'{score!r}:{message_id}'
+    return results, next_cursor
+
+
+def serialize(message, user):
+    entry = history.serialize(message)
+    if message.room_id:
+        entry['room'] = {'slug': message.room.slug, 'name': message.room.name}
+    else:
+        other = message.conversation.other_user(user)
+        entry['room'] = {'slug': message.conversation.slug, 'name': other.username}
+    return entry
@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Profile
+from .models import Profile, ChatRoom, ChatRoomBan, ChatRoomMute, RoomMembership
+from .membership import set_role
+from .roster import invalidate_roster, invalidate_user_rosters
 from django.core.mail import send_mail
 
 @receiver(post_save, sender=User)
@@ -17,5 +19,47 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
 
         if instance.email: # Só envia se o email for fornecido
             send_mail(subject, message, from_email, recipient_list, fail_silently=False)
-    
-    instance.profile.save()
\ No newline at end of file
+
+# --- Invalidação do roster em cache (chat/roster.py) ---
+
+@receiver(post_save, sender=User)
+def invalidate_username_rosters(sender, instance, created, update_fields=None, **kwargs):
+    # Do User o roster só usa o username; o login grava só last_login.
+    if created or (update_fields and 'username' not in update_fields):
+        return
+    invalidate_user_rosters(instance)
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_rosters(sender, instance, created, update_fields=None, **kwargs):
+    # Atualizações só de last_seen não mudam a parte do roster que fica em cache.
+    if created or (update_fields and set(update_fields) <= {'last_seen'}):
+        return
+    invalidate_user_rosters(instance.user)
+
+@receiver(post_save, sender=ChatRoom)
+def invalidate_room_roster(sender, instance, created, **kwargs):
+    if created:
+        set_role(instance, instance.creator, RoomMembership.ROLE_CREATOR)
+    invalidate_roster(instance.slug)
+
+@receiver(post_save, sender=RoomMembership)
+@receiver(post_delete, sender=RoomMembership)
+def invalidate_membership_roster(sender, instance, **kwargs):
+    invalidate_roster(instance.room.slug)
+
+@receiver(m2m_changed, sender=ChatRoom.admins.through)
+def invalidate_admins_roster(sender, instance, action, reverse, pk_set=None, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_roster(instance.slug)
+    elif pk_set:
+        for slug in ChatRoom.objects.filter(pk__in=pk_set).values_list('slug', flat=True):
+            invalidate_roster(slug)
+
+@receiver(post_save, sender=ChatRoomMute)
+@receiver(post_delete, sender=ChatRoomMute)
+@receiver(post_save, sender=ChatRoomBan)
+@receiver(post_delete, sender=ChatRoomBan)
+def invalidate_moderation_roster(sender, instance, **kwargs):
+    invalidate_roster(instance.room.slug)
@@ -1,3 +1,768 @@
-from django.test import TestCase
+import asyncio
+import json
+import shutil
+import tempfile
+import weakref
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import fakeredis.aioredis
+import msgpack
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.core.cache import cache
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+
+from .models import ChatMessage, ChatRoom, ChatRoomMute, DirectConversation, Profile, UserRoomState
+from . import archive, history, roster, membership, direct, last_seen, room_state, search, ingest, ratelimit, outbound, hot_rooms, fanout, frames, purge, presence, unread, redis_client
+from .consumers import ChatConsumer, MultiplexConsumer, _Subscription
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+# Redis em memória (fakeredis, com Lua) no lugar do servidor, novo a cada teste.
+class FakeRedisMixin:
+    def setUp(self):
+        super().setUp()
+        server = fakeredis.FakeServer()
+        patches = (
+            mock.patch.object(redis_client, '_async_clients', weakref.WeakKeyDictionary()),
+            mock.patch.object(redis_client, '_sync_client', fakeredis.FakeRedis(server=server, decode_responses=True)),
+            mock.patch.object(
+                redis_client.aioredis, 'from_url',
+                lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=server, **kwargs),
+            ),
+        )
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RosterBuilderTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.creator = User.objects.create(username='criador')
+        self.room = ChatRoom.objects.create(name='Sala', creator=self.creator)
+
+    def add_members(self, count, offset=0):
+        users = []
+        for i in range(offset, offset + count):
+            user = User.objects.create(username=f'membro{i}')
+            ChatMessage.objects.create(author=user, room=self.room, room_name=self.room.name, content='oi')
+            membership.record_activity(self.room, user)
+            users.append(user)
+        return users
+
+    def build(self, online=()):
+        cache.clear()
+        return roster.build_roster(self.room, self.room.slug, online)
+
+    def test_query_count_does_not_grow_with_members(self):
+        self.add_members(3)
+        with self.assertNumQueries(3):
+            self.build()
+
+        users = self.add_members(40, offset=3)
+        self.room.admins.add(users[0])
+        ChatRoomMute.objects.create(room=self.room, muted_user=users[1])
+        with self.assertNumQueries(3):
+            result = self.build()
+        self.assertEqual(len(result), 44)
+
+    def test_cached_roster_costs_no_queries(self):
+        self.add_members(5)
+        self.build()
+        with self.assertNumQueries(0):
+            result = roster.build_roster(self.room, self.room.slug, ['membro0'])
+        self.assertTrue(next(e for e in result if e['username'] == 'membro0')['is_online'])
+
+    def test_flags_and_invalidation(self):
+        users = self.add_members(2)
+        self.build()
+        self.room.admins.add(users[0])
+        ChatRoomMute.objects.create(room=self.room, muted_user=users[1])
+
+        result = {e['username']: e for e in roster.build_roster(self.room, self.room.slug, [])}
+        self.assertTrue(result['membro0']['is_admin'])
+        self.assertFalse(result['membro0']['is_muted'])
+        self.assertTrue(result['membro1']['is_muted'])
+
+    def test_online_user_outside_cached_roster_is_included(self):
+        self.add_members(2)
+        self.build()
+        User.objects.create(username='visitante')
+        result = roster.build_roster(self.room, self.room.slug, ['visitante'])
+        self.assertIn('visitante', {e['username'] for e in result})
+
+
+    def test_last_seen_buffered_in_redis_wins_over_database(self):
+        away, back = self.add_members(2)
+        long_ago = timezone.now() - timedelta(days=2)
+        Profile.objects.filter(user__in=[away, back]).update(last_seen=long_ago)
+        recent = timezone.now() - timedelta(seconds=10)
+        redis_client.get_sync_redis().hset(last_seen.TIMES_KEY, back.id, recent.timestamp())
+
+        result = {e['username']: e for e in self.build()}
+        self.assertFalse(result['membro0']['is_online'])
+        self.assertEqual(result['membro0']['last_seen'], roster.format_last_seen(long_ago))
+        self.assertTrue(result['membro1']['is_online'])
+        self.assertEqual(result['membro1']['last_seen'], roster.format_last_seen(recent))
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LastSeenBufferTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='ana')
+        patcher = mock.patch.object(last_seen, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_touch_only_buffers_and_flush_writes_the_batch(self):
+        seen_at = timezone.now() - timedelta(minutes=5)
+        with self.assertNumQueries(0):
+            last_seen.touch(self.user.id, seen_at.timestamp())
+
+        self.assertEqual(last_seen.flush(), 1)
+        self.assertEqual(Profile.objects.get(user=self.user).last_seen, seen_at)
+        self.assertFalse(redis_client.get_sync_redis().exists(last_seen.LOCK_KEY))
+        self.assertEqual(last_seen.flush(), 0)
+
+    def test_late_flush_keeps_the_lock_taken_over_by_another_worker(self):
+        client = redis_client.get_sync_redis()
+        last_seen.touch(self.user.id)
+
+        def lock_expired_meanwhile(pending):
+            client.set(last_seen.LOCK_KEY, 'outro-worker')
+        with mock.patch.object(last_seen, '_write', side_effect=lock_expired_meanwhile):
+            last_seen.flush()
+        self.assertEqual(client.get(last_seen.LOCK_KEY), 'outro-worker')
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DirectConversationTests(TestCase):
+    def setUp(self):
+        self.ana, self.bia, self.caio = (User.objects.create(username=name) for name in ('ana', 'bia', 'caio'))
+
+    def test_outsider_does_not_create_the_conversation(self):
+        self.assertIsNone(direct.resolve('dm-ana-bia', self.caio))
+        self.assertEqual(direct.conversations_by_slug({'dm-ana-bia': {self.caio.id}}), {})
+        self.assertFalse(DirectConversation.objects.exists())
+
+    def test_participant_creates_it_once(self):
+        conversation = direct.resolve('dm-ana-bia', self.bia)
+        self.assertEqual((conversation.user_a, conversation.user_b), (self.ana, self.bia))
+        self.assertEqual(direct.resolve('dm-ana-bia', self.ana), conversation)
+        self.assertEqual(direct.conversations_by_slug({'dm-ana-bia': {self.caio.id}}), {'dm-ana-bia': conversation})
+        self.assertEqual(DirectConversation.objects.count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RoomStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='ana')
+        self.room = ChatRoom.objects.create(name='Sala', creator=self.user)
+        self.messages = [
+            ChatMessage.objects.create(author=self.user, room=self.room, room_name=self.room.slug, content=str(i))
+            for i in range(4)
+        ]
+
+    def visible_ids(self):
+        messages = room_state.apply(ChatMessage.objects.filter(room=self.room), self.user, room=self.room)
+        return list(messages.order_by('id').values_list('id', flat=True))
+
+    def test_hide_and_clear(self):
+        first, second, third, fourth = self.messages
+        room_state.hide(self.user, second)
+        self.assertEqual(self.visible_ids(), [first.id, third.id, fourth.id])
+
+        fourth.delete()
+        room_state.clear(self.user, room=self.room)
+        state = UserRoomState.objects.get(user=self.user, room=self.room)
+        # O watermark absorve as ocultas anteriores a ele.
+        self.assertEqual((state.cleared_up_to, state.hidden_ids), (third.id, []))
+        newer = ChatMessage.objects.create(author=self.user, room=self.room, room_name=self.room.slug, content='nova')
+        self.assertEqual(self.visible_ids(), [newer.id])
+
+    def test_visible_matches_apply_for_archived_messages(self):
+        room_state.hide(self.user, self.messages[3])
+        is_visible = room_state.visible(room_state.get_state(self.user, room=self.room))
+        self.assertEqual(
+            [message.id for message in self.messages if is_visible(message.id)], self.visible_ids(),
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES, ARCHIVE_SEGMENT_SIZE=10, ARCHIVE_BLOCK_SIZE=2)
+class ArchivedHistoryTests(TestCase):
+    def setUp(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root, ignore_errors=True)
+        archive_settings = self.settings(ARCHIVE_ROOT=archive_root)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.user = User.objects.create(username='ana')
+        self.room = ChatRoom.objects.create(name='Sala', creator=self.user, retention_days=7)
+        messages = [
+            ChatMessage.objects.create(author=self.user, room=self.room, room_name=self.room.slug, content=str(i))
+            for i in range(7)
+        ]
+        self.ids = [message.id for message in messages]
+        ChatMessage.objects.filter(id__in=self.ids[:4]).update(timestamp=timezone.now() - timedelta(days=30))
+        # Ocultada antes de ir para o arquivo: continua fora do histórico.
+        room_state.hide(self.user, messages[1])
+        self.assertEqual(archive.compact_room(self.room), 4)
+
+    def page(self, **kwargs):
+        page, has_more = history.fetch_page(self.user, room=self.room, **kwargs)
+        return [message.id for message in page], has_more
+
+    def test_latest_page_continues_into_the_archive(self):
+        self.assertEqual(list(ChatMessage.objects.filter(room=self.room).values_list('id', flat=True)), self.ids[4:])
+        self.assertEqual(self.page(limit=5), (self.ids[2:], True))
+
+    def test_archived_cursor_reads_older_and_newer_pages(self):
+        self.assertEqual(self.page(before=self.ids[2], limit=5), ([self.ids[0]], False))
+        # Depois do fim do arquivo a página segue pelo começo do banco.
+        self.assertEqual(self.page(after=self.ids[0], limit=3), (self.ids[2:5], True))
+        self.assertEqual(self.page(after=self.ids[3], limit=5), (self.ids[4:], False))
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SearchTests(TestCase):
+    def setUp(self):
+        self.ana, self.bia = User.objects.create(username='ana'), User.objects.create(username='bia')
+        self.room = ChatRoom.objects.create(name='Sala', creator=self.ana)
+        self.other_room = ChatRoom.objects.create(name='Outra', creator=self.bia)
+        self.conversation = direct.get_or_create_conversation(self.ana, self.bia)
+        self.in_room = [self.post(self.ana, f'banana {i}', room=self.room) for i in range(5)]
+        self.in_dm = [self.post(self.bia, 'bananada', conversation=self.conversation)]
+        self.post(self.bia, 'banana alheia', room=self.other_room)
+        self.post(self.ana, 'laranja', room=self.room)
+
+    def post(self, author, content, room=None, conversation=None):
+        message = ChatMessage.objects.create(
+            author=author, room=room, conversation=conversation,
+            room_name=room.slug if room else conversation.slug, content=content,
+        )
+        search.index_messages([message])
+        return message
+
+    def ids(self, messages):
+        return [message.id for message in messages]
+
+    def test_pages_cover_visible_matches_once(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = search.search(self.ana, 'banan', cursor=cursor, limit=2)
+            self.assertLessEqual(len(page), 2)
+            seen.extend(self.ids(page))
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted(self.ids(self.in_room + self.in_dm)))
+
+    def test_room_and_dm_scope(self):
+        results, _ = search.search(self.ana, 'banana', room=self.room)
+        self.assertEqual(sorted(self.ids(results)), self.ids(self.in_room))
+        results, _ = search.search(self.ana, 'banan', conversation=self.conversation)
+        self.assertEqual(self.ids(results), self.ids(self.in_dm))
+        # Sala de que ela não é membro: nada, mesmo pedindo direto.
+        self.assertEqual(search.search(self.ana, 'banana', room=self.other_room), ([], None))
+
+    def test_cleared_and_hidden_messages_are_left_out(self):
+        room_state.hide(self.ana, self.in_room[4])
+        ChatMessage.objects.filter(id=self.in_room[0].id).update(is_deleted_for_everyone=True)
+        results, _ = search.search(self.ana, 'banana', room=self.room)
+        self.assertEqual(sorted(self.ids(results)), self.ids(self.in_room[1:4]))
+
+class DeletedByMigrationTests(TransactionTestCase):
+    before = [('chat', '0022_backfill_chatmessage_room')]
+    after = [('chat', '0023_userroomstate')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_deleted_by_becomes_watermark_and_hidden_ids(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('auth', 'User')
+        ChatRoom = apps.get_model('chat', 'ChatRoom')
+        ChatMessage = apps.get_model('chat', 'ChatMessage')
+        ana, bia = User.objects.create(username='ana'), User.objects.create(username='bia')
+        room = ChatRoom.objects.create(name='Sala', slug='sala', creator=ana)
+        messages = [
+            ChatMessage.objects.create(author=ana, room=room, room_name='sala', content=str(i)) for i in range(4)
+        ]
+        for message in (messages[0], messages[1], messages[3]):
+            message.deleted_by.add(ana)
+        messages[2].deleted_by.add(bia)
+
+        apps = self.migrate(self.after)
+        states = {
+            state.user_id: (state.cleared_up_to, state.hidden_ids)
+            for state in apps.get_model('chat', 'UserRoomState').objects.filter(room_id=room.id)
+        }
+        self.assertEqual(states, {
+            ana.id: (messages[1].id, [messages[3].id]),
+            bia.id: (0, [messages[2].id]),
+        })
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class IngestQueueTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='autor')
+        self.room = ChatRoom.objects.create(name='Sala', creator=self.user)
+
+    def submit_many(self, queue, count):
+        return asyncio.gather(
+            *(queue.submit(self.user, self.room, self.room.slug, f'oi {i}') for i in range(count)),
+            return_exceptions=True,
+        )
+
+    async def test_concurrent_messages_share_one_write(self):
+        queue = ingest.MessageIngestQueue(max_latency_ms=50)
+        with mock.patch.object(ingest, 'write_batch', wraps=ingest.write_batch) as write_batch:
+            messages = await self.submit_many(queue, 3)
+        await asyncio.gather(*(message.recorded for message in messages))
+        queue.task.cancel()
+
+        self.assertEqual(write_batch.call_count, 1)
+        self.assertEqual([message.content for message in messages], ['oi 0', 'oi 1', 'oi 2'])
+        self.assertEqual(len({message.id for message in messages} - {None}), 3)
+        self.assertEqual(await ChatMessage.objects.filter(room=self.room).acount(), 3)
+
+    async def test_failed_write_rejects_the_whole_batch(self):
+        queue = ingest.MessageIngestQueue(max_latency_ms=50)
+        with mock.patch.object(ingest, 'write_batch', side_effect=DatabaseError('banco fora')), \
+                self.assertLogs('chat.ingest', 'ERROR'):
+            results = await self.submit_many(queue, 2)
+        self.assertTrue(all(isinstance(result, DatabaseError) for result in results))
+
+        # A fila continua atendendo depois da falha.
+        message = await queue.submit(self.user, self.room, self.room.slug, 'de novo')
+        await message.recorded
+        queue.task.cancel()
+        self.assertIsNotNone(message.id)
+
+
+class RateLimitTests(FakeRedisMixin, SimpleTestCase):
+    def consumer(self):
+        consumer = ChatConsumer()
+        consumer.limiter = ratelimit.ConnectionLimiter(user_id=1)
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    def sent_frame(self, consumer):
+        return json.loads(consumer.send.call_args.kwargs['text_data'])
+
+    async def test_connection_bucket_rejects_with_error_frame(self):
+        consumer = self.consumer()
+        consumer.limiter.buckets['message'].tokens = 0
+        await consumer.receive(text_data=json.dumps({'message': 'oi'}))
+
+        frame = self.sent_frame(consumer)
+        self.assertEqual((frame['type'], frame['code'], frame['action']), ('error', 'rate_limited', 'message'))
+        self.assertGreater(frame['retry_after'], 0)
+
+    @override_settings(WS_RATE_LIMITS_CONNECTION={}, WS_RATE_LIMITS_USER={'message': '2/60'})
+    async def test_user_bucket_is_shared_between_connections(self):
+        first, second = ratelimit.ConnectionLimiter(user_id=1), ratelimit.ConnectionLimiter(user_id=1)
+        self.assertEqual(await first.check('message'), 0)
+        self.assertEqual(await second.check('message'), 0)
+        self.assertGreater(await first.check('message'), 0)
+        self.assertEqual(await ratelimit.ConnectionLimiter(user_id=2).check('message'), 0)
+
+    @override_settings(WS_MAX_FRAME_BYTES=10)
+    async def test_oversized_frame_is_measured_in_bytes(self):
+        consumer = self.consumer()
+        # 4 caracteres, 12 bytes em UTF-8.
+        await consumer.receive(text_data='€€€€')
+
+        frame = self.sent_frame(consumer)
+        self.assertEqual((frame['code'], frame['max_bytes']), ('frame_too_large', 10))
+
+
+# Cliente que nunca termina de receber: o primeiro frame fica preso no send.
+class SlowClient:
+    def __init__(self):
+        self.sent = []
+        self.close = mock.AsyncMock()
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.sent.append(text_data)
+        await asyncio.Event().wait()
+
+
+class OutboundQueueTests(FakeRedisMixin, SimpleTestCase):
+    async def stuck_queue(self, max_size=2, max_lag=60):
+        client = SlowClient()
+        queue = outbound.OutboundQueue(client, max_size=max_size, max_lag=max_lag)
+        await queue.put('chat_message', 'preso')
+        while not client.sent:
+            await asyncio.sleep(0)
+        return client, queue
+
+    async def test_full_queue_drops_ephemeral_before_evicting(self):
+        client, queue = await self.stuck_queue()
+        await queue.put('presence_delta', 'p')
+        await queue.put('chat_message', 'a')
+        await queue.put('chat_message', 'b')
+        self.assertFalse(queue.evicted)
+        self.assertEqual([item[2] for item in queue.lanes[outbound.CHAT]], ['a', 'b'])
+        self.assertFalse(queue.lanes[outbound.EPHEMERAL])
+
+        await queue.put('chat_message', 'c')
+        self.assertTrue(queue.evicted)
+        client.close.assert_awaited_once_with(code=outbound.RESYNC_CLOSE_CODE)
+
+    async def test_lagging_client_is_evicted(self):
+        client, queue = await self.stuck_queue(max_size=10, max_lag=0.05)
+        await queue.put('chat_message', 'a')
+        await asyncio.sleep(0.1)
+        await queue.put('chat_message', 'b')
+        self.assertTrue(queue.evicted)
+        client.close.assert_awaited_once_with(code=outbound.RESYNC_CLOSE_CODE)
+
+    async def test_typing_updates_are_coalesced(self):
+        client, queue = await self.stuck_queue(max_size=10)
+        await queue.put('typing_update', 'u1')
+        await queue.put('typing_update', 'u2')
+        self.assertEqual([item[2] for item in queue.lanes[outbound.EPHEMERAL]], ['u2'])
+        queue.stop()
+
+
+    async def test_failed_send_evicts_the_connection(self):
+        client = SlowClient()
+        client.send = mock.AsyncMock(side_effect=RuntimeError('socket fechado'))
+        queue = outbound.OutboundQueue(client)
+        with self.assertLogs('chat.outbound', 'ERROR'):
+            await queue.put('chat_message', 'a')
+            await asyncio.wait_for(queue.task, 1)
+        self.assertTrue(queue.evicted)
+        client.close.assert_awaited_once_with(code=outbound.RESYNC_CLOSE_CODE)
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_LAYERS,
+    HOT_ROOM_BATCH_RATE=3, HOT_ROOM_SLOW_MODE_RATE=5, HOT_ROOM_BATCH_MS=20, SLOW_MODE_POSTS=1,
+)
+class HotRoomTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        # Relógio parado no meio de um segundo: a janela de taxa não vira no teste.
+        patcher = mock.patch.object(hot_rooms, 'time', SimpleNamespace(time=lambda: 1000.5))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def send_messages(self, count):
+        changes = []
+        for i in range(count):
+            changes.append(await hot_rooms.broadcast('sala', 'chat_message', {'id': i}))
+        return changes
+
+    # O ticker solta a trava no primeiro intervalo sem eventos.
+    async def wait_for_ticker(self):
+        while await redis_client.get_redis().exists(hot_rooms._key('sala', 'tick')):
+            await asyncio.sleep(0.01)
+
+    async def test_fast_room_switches_to_batches(self):
+        with mock.patch.object(fanout, 'group_send') as group_send:
+            await self.send_messages(4)
+            self.assertEqual([call.args[1]['type'] for call in group_send.call_args_list], ['chat_message'] * 2)
+            await self.wait_for_ticker()
+
+        batch = group_send.call_args_list[2].args[1]
+        self.assertEqual(batch['type'], 'batch')
+        self.assertEqual([event['id'] for event in json.loads(batch['frame'])['events']], [2, 3])
+        self.assertEqual(group_send.call_count, 3)
+
+    async def test_unbatched_event_waits_for_the_pending_batch(self):
+        with mock.patch.object(fanout, 'group_send') as group_send:
+            await self.send_messages(4)
+            await hot_rooms.broadcast('sala', 'slow_mode_update', {'mode': 'on'})
+            await self.wait_for_ticker()
+
+        sent = [call.args[1]['type'] for call in group_send.call_args_list]
+        self.assertEqual(sent, ['chat_message', 'chat_message', 'batch', 'slow_mode_update'])
+
+    async def test_slow_mode_turns_on_past_threshold(self):
+        with mock.patch.object(fanout, 'group_send'):
+            changes = await self.send_messages(6)
+            await self.wait_for_ticker()
+        self.assertEqual(changes, [0, 0, 0, 0, 1, 0])
+        self.assertTrue((await hot_rooms.slow_mode_state('sala'))['active'])
+
+        self.assertEqual(await hot_rooms.allow_post('sala', user_id=1), (True, True, 0))
+        allowed, active, retry_after = await hot_rooms.allow_post('sala', user_id=1)
+        self.assertEqual((allowed, active), (False, True))
+        self.assertGreater(retry_after, 0)
+        self.assertTrue((await hot_rooms.allow_post('sala', user_id=1, exempt=True))[0])
+        self.assertTrue((await hot_rooms.allow_post('sala', user_id=2))[0])
+
+
+# Conexão local do worker: só o handler do evento de chat.
+class LocalConnection:
+    def __init__(self, side_effect=None):
+        self.chat_message = mock.AsyncMock(side_effect=side_effect)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, LARGE_ROOM_THRESHOLD=2)
+class FanoutTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        fanout._modes.clear()
+        self.addCleanup(fanout._modes.clear)
+
+    async def wait_for_calls(self, handler, count):
+        while handler.await_count < count:
+            await asyncio.sleep(0.01)
+
+    async def test_large_room_delivers_once_per_worker(self):
+        first, second = LocalConnection(), LocalConnection()
+        await fanout.register('sala', first)
+        await fanout.register('sala', second)
+        await fanout.update_mode('sala', 2)
+        self.assertTrue(await fanout.is_large('sala'))
+
+        event = {'type': 'chat_message', 'frame': '{}'}
+        channel_layer = fanout.get_channel_layer()
+        with mock.patch.object(channel_layer, 'group_send', wraps=channel_layer.group_send) as group_send:
+            await fanout.group_send('sala', event)
+        # Um envio só, para o grupo dos workers, não um por conexão.
+        group_send.assert_awaited_once_with(
+            fanout.workers_group('sala'), {'type': fanout.DELIVER, 'slug': 'sala', 'event': event},
+        )
+
+        await asyncio.wait_for(self.wait_for_calls(second.chat_message, 1), 1)
+        first.chat_message.assert_awaited_once_with(event)
+        second.chat_message.assert_awaited_once_with(event)
+        fanout._worker().task.cancel()
+
+    async def test_failing_handler_does_not_stop_delivery(self):
+        broken, healthy = LocalConnection(side_effect=RuntimeError), LocalConnection()
+        await fanout.register('sala', broken)
+        await fanout.register('sala', healthy)
+        await fanout.update_mode('sala', 2)
+
+        with self.assertLogs('chat.fanout', 'ERROR'):
+            for i in range(2):
+                await fanout.group_send('sala', {'type': 'chat_message', 'frame': str(i)})
+            await asyncio.wait_for(self.wait_for_calls(healthy.chat_message, 2), 1)
+        self.assertEqual(broken.chat_message.await_count, 2)
+        fanout._worker().task.cancel()
+
+
+# Eventos de sala enviados fora dos consumers também passam pelo fanout.
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class RoomEventsOutsideConsumersTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='ana')
+        self.room = ChatRoom.objects.create(name='Sala', creator=self.user)
+
+    def test_leave_room_notice(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(fanout, 'group_send') as group_send:
+            self.client.get(reverse('chat:leave_room', args=[self.room.slug]))
+        slug, event = group_send.call_args.args
+        self.assertEqual((slug, event['type']), (self.room.slug, 'system_message'))
+
+    def test_room_deleted_notice_goes_out_before_forgetting_the_mode(self):
+        redis_client.get_sync_redis().set(fanout._mode_key('sala'), '1')
+        sent_while_large = []
+
+        async def group_send(slug, event):
+            sent_while_large.append((event['type'], await fanout.is_large(slug)))
+        with mock.patch.object(fanout, 'group_send', group_send), mock.patch.object(purge, '_run_in_thread'):
+            purge._after_delete('sala', job_id=1)
+        self.assertEqual(sent_while_large, [('room_deleted', True)])
+        self.assertFalse(redis_client.get_sync_redis().exists(fanout._mode_key('sala')))
+
+@override_settings(PRESENCE_LEASE_TTL=90)
+class PresenceRegistryTests(FakeRedisMixin, SimpleTestCase):
+    async def test_admit_counts_users_not_connections(self):
+        self.assertEqual(await presence.admit('sala', 'ana', 'c1'), (True, 1, True))
+        self.assertEqual(await presence.admit('sala', 'ana', 'c2'), (True, 1, False))
+        self.assertEqual(await presence.admit('sala', 'bia', 'c3'), (True, 2, True))
+
+        self.assertEqual(await presence.release('sala', 'c1'), (False, 2))
+        self.assertEqual(await presence.release('sala', 'c2'), (True, 1))
+        self.assertEqual(await presence.online_usernames('sala'), ['bia'])
+
+    async def test_user_limit_rejects_only_new_users(self):
+        await presence.admit('sala', 'ana', 'c1', user_limit=1)
+        self.assertEqual(await presence.admit('sala', 'bia', 'c2', user_limit=1), (False, 1, False))
+        # Outra aba de quem já está na sala não conta como usuário novo.
+        self.assertEqual(await presence.admit('sala', 'ana', 'c3', user_limit=1), (True, 1, False))
+
+    async def test_expired_lease_is_purged_and_reported(self):
+        now = presence._now_ms()
+        await presence.admit('sala', 'ana', 'c1')
+        await presence.admit('sala', 'bia', 'c2')
+        with mock.patch.object(presence, '_now_ms', return_value=now + 60_000):
+            self.assertEqual(await presence.renew('sala', 'c2'), (True, []))
+        with mock.patch.object(presence, '_now_ms', return_value=now + 120_000):
+            self.assertEqual(await presence.renew('sala', 'c2'), (True, ['ana']))
+            self.assertEqual(await presence.renew('sala', 'c1'), (False, []))
+            self.assertEqual(await presence.online_usernames('sala'), ['bia'])
+
+@override_settings(PRESENCE_DELTA_COALESCE_MS=2000)
+class RosterVersionTests(FakeRedisMixin, SimpleTestCase):
+    async def test_identical_deltas_are_coalesced(self):
+        self.assertEqual(await presence.next_roster_version('sala', 'online', 'ana'), 1)
+        self.assertIsNone(await presence.next_roster_version('sala', 'online', 'ana'))
+        self.assertEqual(await presence.next_roster_version('sala', 'online', 'bia'), 2)
+        self.assertEqual(await presence.roster_version('sala'), 2)
+
+    async def test_opposite_delta_reopens_the_window(self):
+        self.assertEqual(await presence.next_roster_version('sala', 'online', 'ana'), 1)
+        self.assertEqual(await presence.next_roster_version('sala', 'offline', 'ana'), 2)
+        self.assertEqual(await presence.next_roster_version('sala', 'online', 'ana'), 3)
+
+    async def test_renew_keeps_the_version_alive(self):
+        await presence.admit('sala', 'ana', 'c1')
+        await presence.next_roster_version('sala', 'online', 'ana')
+        client = redis_client.get_redis()
+        await client.expire('presence:sala:version', 5)
+
+        await presence.renew('sala', 'c1')
+        self.assertEqual(await client.ttl('presence:sala:version'), presence.ROSTER_VERSION_TTL)
+        self.assertEqual(await presence.roster_version('sala'), 1)
+
+class UnreadCursorTests(FakeRedisMixin, SimpleTestCase):
+    def messages(self, slug, *author_ids, first_id=1):
+        room = SimpleNamespace(slug=slug)
+        return [
+            SimpleNamespace(id=first_id + i, room_id=1, room=room, author_id=author_id, conversation=None)
+            for i, author_id in enumerate(author_ids)
+        ]
+
+    async def test_batch_numbers_messages_and_moves_the_authors_cursor(self):
+        first = self.messages('sala', 1, 2, 1)
+        self.assertEqual(await unread.record_batch(first), ['sala'])
+        self.assertEqual([message.seq for message in first], [1, 2, 3])
+        second = self.messages('sala', 2, first_id=4)
+        await unread.record_batch(second)
+        self.assertEqual(second[0].seq, 4)
+
+        # Autor leu até a própria mensagem; quem não escreveu não leu nada.
+        self.assertEqual(unread.unread_counts(1, ['sala']), {'sala': 1})
+        self.assertEqual(unread.unread_counts(2, ['sala']), {'sala': 0})
+        self.assertEqual(unread.unread_counts(3, ['sala', 'vazia']), {'sala': 4, 'vazia': 0})
+
+    async def test_mark_read_only_moves_forward_and_caps_at_the_sequence(self):
+        await unread.record_batch(self.messages('sala', 1, 1, 1, 1, 1))
+        self.assertEqual(await unread.mark_read(3, 'sala', seq=2), (2, 5))
+        self.assertEqual(await unread.mark_read(3, 'sala', seq=1), (2, 5))
+        self.assertEqual(await unread.mark_read(3, 'sala', seq=99), (5, 5))
+        self.assertEqual(unread.unread_counts(3, ['sala']), {'sala': 0})
+
+    async def test_mark_read_without_seq_reads_everything(self):
+        await unread.record_batch(self.messages('sala', 1, 1))
+        self.assertEqual(await unread.mark_read(3, 'sala'), (2, 2))
+
+class PresenceRenewTests(FakeRedisMixin, SimpleTestCase):
+    def consumer(self, user_limit):
+        consumer = ChatConsumer()
+        consumer.room_slug, consumer.channel_name = 'sala', 'canal-ana'
+        consumer.user = SimpleNamespace(username='ana')
+        consumer.room = SimpleNamespace(user_limit=user_limit)
+        for name in ('broadcast_presence_delta', 'broadcast_user_count', 'close'):
+            setattr(consumer, name, mock.AsyncMock())
+        return consumer
+
+    async def test_expired_lease_is_readmitted_with_online_delta(self):
+        consumer = self.consumer(user_limit=2)
+        await presence.admit('sala', 'bia', 'canal-bia')
+        await consumer.renew_presence()
+
+        consumer.broadcast_presence_delta.assert_awaited_once_with('online', 'ana', with_profile=True)
+        consumer.broadcast_user_count.assert_awaited_once_with(2)
+        self.assertEqual(sorted(await presence.online_usernames('sala')), ['ana', 'bia'])
+
+    async def test_expired_lease_respects_the_user_limit(self):
+        consumer = self.consumer(user_limit=1)
+        await presence.admit('sala', 'bia', 'canal-bia')
+        with self.assertLogs('chat.consumers', 'WARNING'):
+            await consumer.renew_presence()
+
+        consumer.close.assert_awaited_once_with(code=4003)
+        consumer.broadcast_presence_delta.assert_not_awaited()
+        self.assertEqual(await presence.online_usernames('sala'), ['bia'])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class MultiplexConsumerTests(FakeRedisMixin, SimpleTestCase):
+    def consumer(self, use_msgpack=False):
+        consumer = MultiplexConsumer()
+        consumer.user = SimpleNamespace(id=1, username='ana', is_authenticated=True)
+        consumer.use_msgpack = use_msgpack
+        consumer.streams = {'room:sala': _Subscription(None)}
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    async def test_payload_that_is_not_json_is_rejected_for_the_stream(self):
+        consumer = self.consumer(use_msgpack=True)
+        frame = msgpack.packb({'stream': 'room:sala', 'payload': {'message': b'\x00'}}, use_bin_type=True)
+        with self.assertLogs('chat.consumers', 'WARNING'):
+            await consumer.receive(bytes_data=frame)
+
+        error = frames.unpack(consumer.send.call_args.kwargs['bytes_data'])
+        self.assertEqual((error['type'], error['code'], error['stream']), ('error', 'invalid_payload', 'room:sala'))
+        self.assertTrue(consumer.streams['room:sala'].queue.empty())
+
+    async def test_payload_is_forwarded_to_the_stream(self):
+        consumer = self.consumer()
+        await consumer.receive(text_data=json.dumps({'stream': 'room:sala', 'payload': {'message': 'oi'}}))
+        message = consumer.streams['room:sala'].queue.get_nowait()
+        self.assertEqual(message, {'type': 'websocket.receive', 'text': json.dumps({'message': 'oi'})})
+
+
+    async def test_heartbeat_renews_only_admitted_rooms(self):
+        consumer = self.consumer()
+        consumer.limiter = ratelimit.ConnectionLimiter(user_id=1)
+        consumer.update_last_seen = mock.AsyncMock()
+        admitted = SimpleNamespace(admitted=True, renew_presence=mock.AsyncMock())
+        rejected = SimpleNamespace(admitted=False, renew_presence=mock.AsyncMock())
+        consumer.streams = {'room:a': _Subscription(admitted), 'room:b': _Subscription(rejected)}
+        await consumer.receive(text_data=json.dumps({'type': 'heartbeat'}))
+
+        admitted.renew_presence.assert_awaited_once()
+        rejected.renew_presence.assert_not_awaited()
+        consumer.update_last_seen.assert_awaited_once()
+        self.assertEqual(json.loads(consumer.send.call_args.kwargs['text_data']), {'type': 'heartbeat', 'status': 'pong'})
+
+    async def test_subscribe_routes_frames_by_stream_until_unsubscribe(self):
+        communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/multiplex/')
+        communicator.scope['user'] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_json_to({'type': 'subscribe', 'stream': 'lobby'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'subscribed', 'stream': 'lobby'})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual((snapshot['stream'], snapshot['payload']['type']), ('lobby', 'room_counts'))
+
+        # Visitante não abre sala; stream desconhecido vira erro, não fecha o socket.
+        await communicator.send_json_to({'type': 'subscribe', 'stream': 'room:sala'})
+        self.assertEqual((await communicator.receive_json_from())['code'], 'login_required')
+        await communicator.send_json_to({'type': 'subscribe', 'stream': 'sala'})
+        self.assertEqual((await communicator.receive_json_from())['code'], 'unknown_stream')
+
+        await communicator.send_json_to({'type': 'unsubscribe', 'stream': 'lobby'})
+        await communicator.send_json_to({'stream': 'lobby', 'payload': {'type': 'ping'}})
+        error = await communicator.receive_json_from()
+        self.assertEqual((error['code'], error['stream']), ('unknown_stream', 'lobby'))
+        await communicator.disconnect()
\ No newline at end of file
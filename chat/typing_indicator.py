@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from . import background, frames, hot_rooms
+from .redis_client import LuaScript
+
+logger = logging.getLogger(__name__)
+
+# Agregador de "quem está digitando" por sala, compartilhado entre workers:
+#   typing:<slug>       ZSET  username -> expiração do sinal (ms)
+#   typing:<slug>:tick  STRING trava do ticker da sala (um worker por vez)
+#   typing:<slug>:sent  STRING último conjunto transmitido
+# Cada is_typing só atualiza o ZSET. O worker que pega a trava roda o ticker,
+# que a cada TYPING_BROADCAST_INTERVAL_MS remove os sinais expirados e, se o
+# conjunto mudou, faz um único typing_update para a sala. Sem ninguém
+# digitando, o ticker solta a trava e para.
+
+_UPDATE = LuaScript("""
+local typists, lock = KEYS[1], KEYS[2]
+local username, is_typing = ARGV[1], ARGV[2] == '1'
+local now, ttl_ms, lock_ms = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+if is_typing then
+    redis.call('ZADD', typists, now + ttl_ms, username)
+    redis.call('PEXPIRE', typists, ttl_ms * 2)
+else
+    redis.call('ZREM', typists, username)
+end
+if redis.call('SET', lock, '1', 'NX', 'PX', lock_ms) then
+    return 1
+end
+return 0
+""")
+
+_TICK = LuaScript("""
+local typists, lock, sent = KEYS[1], KEYS[2], KEYS[3]
+local now, lock_ms = tonumber(ARGV[1]), tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', typists, '-inf', now)
+local users = redis.call('ZRANGE', typists, 0, -1)
+table.sort(users)
+local current = table.concat(users, '\\n')
+local changed = current ~= (redis.call('GET', sent) or '')
+if #users == 0 then
+    redis.call('DEL', lock, sent)
+else
+    redis.call('PEXPIRE', lock, lock_ms)
+    if changed then
+        redis.call('SET', sent, current, 'PX', lock_ms)
+    end
+end
+return {changed and 1 or 0, users}
+""")
+
+
+def _keys(slug):
+    base = f'typing:{slug}'
+    return base, f'{base}:tick', f'{base}:sent'
+
+
+def _lock_ms():
+    # Folga para o caso de o worker do ticker cair: outra atualização assume.
+    return max(settings.TYPING_BROADCAST_INTERVAL_MS * 4, 2000)
+
+
+async def update(slug, username, is_typing):
+    typists, lock, _ = _keys(slug)
+    now = int(time.time() * 1000)
+    try:
+        started = await _UPDATE(
+            keys=(typists, lock),
+            args=(username, 1 if is_typing else 0, now, settings.TYPING_TTL * 1000, _lock_ms()),
+        )
+    except RedisError as e:
+        logger.error(f"Erro ao atualizar digitação de {username} na sala {slug}: {e}")
+        return
+    if started:
+        background.spawn(_run_ticker(slug), name=f'typing:{slug}', lock=lock)
+
+
+async def _run_ticker(slug):
+    interval = settings.TYPING_BROADCAST_INTERVAL_MS / 1000
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            changed, users = await _TICK(keys=_keys(slug), args=(int(time.time() * 1000), _lock_ms()))
+        except RedisError as e:
+            logger.error(f"Erro no ticker de digitação da sala {slug}: {e}")
+            return
+        if changed:
+            await hot_rooms.send(
+                slug,
+                frames.group_event('typing_update', {'users': users}, typing_users=users),
+            )
+        if not users:
+            return
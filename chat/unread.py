@@ -0,0 +1,129 @@
+import logging
+from collections import defaultdict
+
+from channels.layers import get_channel_layer
+from redis.exceptions import RedisError
+
+from . import frames
+from .redis_client import get_sync_redis, LuaScript
+
+logger = logging.getLogger(__name__)
+
+# Não lidas por sala, sem COUNT(*):
+#   unread:seq           HASH slug -> total de mensagens da sala (sequência)
+#   unread:read:<user>   HASH slug -> sequência até onde o usuário leu
+# A ingestão incrementa a sequência uma vez por lote e leva o cursor de quem
+# escreveu junto; o cliente avança o próprio cursor com mark_read. Não lidas
+# = sequência - cursor. DMs continuam com os contadores de DirectConversation.
+# Mudanças de um usuário chegam ao lobby dele pelo grupo user_<id>.
+
+SEQ_KEY = 'unread:seq'
+
+
+def read_key(user_id):
+    return f'unread:read:{user_id}'
+
+
+# Autores leram a sala até a própria mensagem.
+_RECORD = LuaScript("""
+local seq_key, slug, count = KEYS[1], ARGV[1], tonumber(ARGV[2])
+local seq = redis.call('HINCRBY', seq_key, slug, count)
+for i = 2, #KEYS do
+    redis.call('HSET', KEYS[i], slug, seq)
+end
+return seq
+""")
+
+# Só avança: um mark_read atrasado não desfaz um mais novo.
+_MARK_READ = LuaScript("""
+local seq_key, read_key, slug = KEYS[1], KEYS[2], ARGV[1]
+local seq = tonumber(redis.call('HGET', seq_key, slug) or '0')
+local target = seq
+if ARGV[2] ~= '' then
+    target = math.min(tonumber(ARGV[2]), seq)
+end
+local current = tonumber(redis.call('HGET', read_key, slug) or '0')
+if target > current then
+    redis.call('HSET', read_key, slug, target)
+    current = target
+end
+return {current, seq}
+""")
+
+
+# Chamado depois que o lote foi gravado; define message.seq de cada mensagem
+# de sala. Devolve os slugs que receberam mensagens.
+async def record_batch(messages):
+    by_room = defaultdict(list)
+    for message in messages:
+        if message.room_id is not None:
+            by_room[message.room.slug].append(message)
+
+    for slug, room_messages in by_room.items():
+        author_ids = sorted({m.author_id for m in room_messages})
+        try:
+            seq = await _RECORD(
+                keys=[SEQ_KEY] + [read_key(author_id) for author_id in author_ids],
+                args=(slug, len(room_messages)),
+            )
+        except RedisError as e:
+            logger.error(f"Erro ao atualizar não lidas da sala {slug}: {e}")
+            continue
+        for offset, message in enumerate(sorted(room_messages, key=lambda m: m.id)):
+            message.seq = seq - len(room_messages) + 1 + offset
+    return list(by_room)
+
+
+async def mark_read(user_id, slug, seq=None):
+    try:
+        read, total = await _MARK_READ(keys=(SEQ_KEY, read_key(user_id)), args=(slug, '' if seq is None else int(seq)))
+    except RedisError as e:
+        logger.error(f"Erro ao marcar a sala {slug} como lida: {e}")
+        return None
+    return int(read), int(total)
+
+
+# Uma ida ao Redis para todas as salas: {slug: (sequência, lida)}.
+def cursors(user_id, slugs):
+    slugs = list(slugs)
+    if not slugs:
+        return {}
+    try:
+        pipe = get_sync_redis().pipeline(transaction=False)
+        pipe.hmget(SEQ_KEY, slugs)
+        pipe.hmget(read_key(user_id), slugs)
+        seqs, reads = pipe.execute()
+    except RedisError as e:
+        logger.error(f"Erro ao ler não lidas do usuário {user_id}: {e}")
+        return {}
+    return {slug: (int(seq or 0), int(read or 0)) for slug, seq, read in zip(slugs, seqs, reads)}
+
+
+def unread_counts(user_id, slugs):
+    return {slug: max(seq - read, 0) for slug, (seq, read) in cursors(user_id, slugs).items()}
+
+
+def forget_room(slug):
+    try:
+        get_sync_redis().hdel(SEQ_KEY, slug)
+    except RedisError as e:
+        logger.error(f"Erro ao remover a sequência da sala {slug}: {e}")
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+# Avisa o destinatário de cada DM (no lobby) quantas mensagens chegaram.
+async def notify_direct(messages):
+    added = defaultdict(int)
+    for message in messages:
+        conversation = message.conversation
+        if conversation is None:
+            continue
+        recipient_id = conversation.user_b_id if message.author_id == conversation.user_a_id else conversation.user_a_id
+        added[(recipient_id, conversation.slug)] += 1
+
+    channel_layer = get_channel_layer()
+    for (recipient_id, slug), count in added.items():
+        await channel_layer.group_send(user_group(recipient_id), frames.group_event('unread_update', {'slug': slug, 'added': count}))
@@ -5,13 +5,10 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib import messages
-from django.core.cache import cache
-from django.db.models import Q
-from .models import ChatMessage, Profile, User, ChatRoom
+from .models import Profile, User, ChatRoom, ChatRoomBan
+from . import membership, last_seen, frames, lobby, direct, history, room_state, purge, search, unread, fanout
 from .forms import UserUpdateForm, ProfileUpdateForm, RoomCreationForm, RoomPasswordForm, UsernameSignUpForm, EmailSignUpForm
 from django.http import JsonResponse
-from django.utils import timezone
-from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.utils.text import slugify
 
@@ -29,40 +26,54 @@ def index_view(request):
             messages.success(request, f"Sala '{room.name}' criada com sucesso!")
             return redirect('chat:chat_room', room_slug=room.slug)
 
-    public_rooms = ChatRoom.objects.all().order_by('-created_at')
-    for room in public_rooms:
-        room.user_count = cache.get(f'chat_{room.slug}', 0)
+    sort, page = lobby.list_rooms(request.GET.get('sort'), request.GET.get('page'))
+
+    # Não lidas só nas salas de que o usuário participa: um pipeline no Redis.
+    unread_counts = {}
+    if request.user.is_authenticated:
+        unread_counts = unread.unread_counts(request.user.id, membership.room_slugs(request.user, page.object_list))
+    for room in page.object_list:
+        room.unread = unread_counts.get(room.slug)
         
     private_chats = []
     if request.user.is_authenticated:
-        dm_room_names = ChatMessage.objects.filter(
-            room_name__startswith='dm-'
-        ).filter(
-            Q(author=request.user) | Q(room_name__contains=f"-{request.user.username}") | Q(room_name__endswith=f"-{request.user.username}")
-        ).values_list('room_name', flat=True).distinct()
-
-        other_usernames = set()
-        for name in dm_room_names:
-            participant_string = name[3:]
-            parts = participant_string.split('-')
-            
-            if len(parts) == 2:
-                if parts[0] == request.user.username:
-                    other_usernames.add(parts[1])
-                else:
-                    other_usernames.add(parts[0])
-
-        if other_usernames:
-            private_chats = Profile.objects.filter(user__username__in=other_usernames)
+        for conversation in direct.conversations_for(request.user):
+            private_chats.append({
+                'slug': conversation.slug,
+                'profile': conversation.other_user(request.user).profile,
+                'unread': conversation.unread_for(request.user),
+            })
 
     context = {
-        'public_rooms': public_rooms,
+        'public_rooms': page.object_list,
+        'page_obj': page,
+        'sort': sort,
         'private_chats': private_chats,
         'form': form,
         'joined_rooms': request.session.get('joined_rooms', [])
     }
     return render(request, 'index.html', context)
 
+def rooms_api_view(request):
+    sort, page = lobby.list_rooms(request.GET.get('sort'), request.GET.get('page'))
+    return JsonResponse({
+        'sort': sort,
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'has_next': page.has_next(),
+        'rooms': [
+            {
+                'slug': room.slug,
+                'name': room.name,
+                'user_count': room.user_count,
+                'user_limit': room.user_limit,
+                'has_password': bool(room.password),
+                'created_at': room.created_at.isoformat(),
+            }
+            for room in page.object_list
+        ],
+    })
+
 @login_required
 def join_room(request, room_slug):
     try:
@@ -76,6 +87,7 @@ def join_room(request, room_slug):
         joined_rooms.append(room.slug)
         request.session['joined_rooms'] = joined_rooms
     request.session['just_joined_room'] = room.slug
+    membership.record_join(room, request.user)
     return redirect('chat:chat_room', room_slug=room.slug)
 
 @login_required
@@ -91,15 +103,10 @@ def leave_room(request, room_slug):
         joined_rooms.remove(room.slug)
         request.session['joined_rooms'] = joined_rooms
 
-    channel_layer = get_channel_layer()
-    room_group_name = f'chat_{room.slug}'
-
-    async_to_sync(channel_layer.group_send)(
-        room_group_name,
-        {
-            'type': 'system_message',
-            'message': f'{request.user.username} saiu da sala.'
-        }
+    # Pelo fanout, como os consumers: em sala grande o evento vai aos workers.
+    async_to_sync(fanout.group_send)(
+        room.slug,
+        frames.group_event('system_message', {'message': f'{request.user.username} saiu da sala.'})
     )
 
     return redirect('index')
@@ -112,21 +119,22 @@ def chat_room_view(request, room_slug):
     access_token = None
 
     if is_dm:
-        participant_string = room_slug[3:]
-        participants = participant_string.split('-')
-        
-        if request.user.username not in participants:
+        conversation = direct.resolve(room_slug, request.user)
+        if conversation is None:
+            messages.error(request, "Conversa não encontrada.")
+            return redirect('index')
+
+        if request.user.id not in (conversation.user_a_id, conversation.user_b_id):
             messages.error(request, "Você não tem permissão para entrar nesta conversa.")
             return redirect('index')
-        
-        other_username = participants[0] if participants[1] == request.user.username else participants[1]
-        
+
+        other_user = conversation.other_user(request.user)
         try:
-            other_user = User.objects.get(username=other_username)
-            other_user_profile = Profile.objects.get(user=other_user)
-        except (User.DoesNotExist, Profile.DoesNotExist):
-            messages.error(request, f"Usuário da conversa '{other_username}' não encontrado.")
+            other_user_profile = other_user.profile
+        except Profile.DoesNotExist:
+            messages.error(request, f"Usuário da conversa '{other_user.username}' não encontrado.")
             return redirect('index')
+        direct.mark_read(conversation, request.user)
     else:
         try:
             room = ChatRoom.objects.get(slug=room_slug)
@@ -161,25 +169,20 @@ def chat_room_view(request, room_slug):
             room_tokens[room.slug] = access_token
             request.session['room_tokens'] = room_tokens
         
-    chat_messages_qs = ChatMessage.objects.filter(room_name=room.name if room else room_slug).select_related('author__profile', 'parent__author').exclude(deleted_by=request.user).order_by('timestamp')[:50]
-    
-    messages_list = []
-    for message in chat_messages_qs:
-        parent_info = None
-        if message.parent:
-            parent_info = {
-                'author': message.parent.author.username,
-                'content': message.parent.content,
-            }
+    # Só a página mais recente; as anteriores vêm sob demanda (fetch_history).
+    page, has_more_history = history.fetch_page(request.user, room=room, conversation=None if room else conversation)
 
+    messages_list = []
+    for message in page:
+        entry = history.serialize(message)
         messages_list.append({
-            'id': message.id,
-            'author_username': message.author.username,
-            'content': message.content,
-            'timestamp': timezone.localtime(message.timestamp).strftime('%H:%M'),
-            'avatar_url': message.author.profile.avatar.url,
-            'is_sent_by_user': message.author == request.user,
-            'parent': parent_info,
+            'id': entry['id'],
+            'author_username': entry['username'],
+            'content': entry['message'],
+            'timestamp': entry['timestamp'],
+            'avatar_url': entry['avatar_url'],
+            'is_sent_by_user': message.author_id == request.user.id,
+            'parent': entry['parent'],
         })
     
     display_name = other_user_profile.user.username if is_dm else room.name
@@ -189,6 +192,7 @@ def chat_room_view(request, room_slug):
         'room_slug': room_slug,
         'display_name': display_name,
         'chat_messages': messages_list,
+        'has_more_history': has_more_history,
         'is_dm': is_dm,
         'other_user_profile': other_user_profile,
         'room': room,
@@ -198,6 +202,55 @@ def chat_room_view(request, room_slug):
     return render(request, 'chat_room.html', context)
 
 
+@login_required
+def history_view(request, room_slug):
+    room = conversation = None
+    if room_slug.startswith('dm-'):
+        conversation = direct.resolve(room_slug, request.user)
+        if conversation is None or request.user.id not in (conversation.user_a_id, conversation.user_b_id):
+            return JsonResponse({'status': 'error', 'message': 'Conversa não encontrada.'}, status=404)
+    else:
+        room = ChatRoom.objects.filter(slug=room_slug).first()
+        if room is None:
+            return JsonResponse({'status': 'error', 'message': 'Sala não encontrada.'}, status=404)
+        if room.password and room.slug not in request.session.get('authorized_rooms', []):
+            return JsonResponse({'status': 'error', 'message': 'Acesso negado.'}, status=403)
+        if ChatRoomBan.objects.filter(room=room, banned_user=request.user).exists():
+            return JsonResponse({'status': 'error', 'message': 'Você foi banido desta sala.'}, status=403)
+
+    page, has_more = history.fetch_page(
+        request.user, room=room, conversation=conversation,
+        before=request.GET.get('before'), after=request.GET.get('after'), limit=request.GET.get('limit'),
+    )
+    return JsonResponse({
+        'status': 'ok',
+        'messages': [history.serialize(message) for message in page],
+        'has_more': has_more,
+    })
+
+# Busca em todas as salas e DMs visíveis, ou só em uma (?room=<slug>).
+@login_required
+def search_view(request):
+    room = conversation = None
+    room_slug = request.GET.get('room')
+    if room_slug:
+        if room_slug.startswith('dm-'):
+            conversation = direct.resolve(room_slug, request.user)
+        else:
+            room = ChatRoom.objects.filter(slug=room_slug).first()
+        if room is None and conversation is None:
+            return JsonResponse({'status': 'error', 'message': 'Sala não encontrada.'}, status=404)
+
+    results, next_cursor = search.search(
+        request.user, request.GET.get('q', ''),
+        cursor=request.GET.get('cursor'), limit=request.GET.get('limit'), room=room, conversation=conversation,
+    )
+    return JsonResponse({
+        'status': 'ok',
+        'results': [search.serialize(message, request.user) for message in results],
+        'next_cursor': next_cursor,
+    })
+
 @login_required
 def start_dm_view(request, username):
     try:
@@ -210,11 +263,8 @@ def start_dm_view(request, username):
         messages.warning(request, "Você não pode iniciar uma conversa consigo mesmo.")
         return redirect('index')
 
-    usernames = sorted([request.user.username, other_user.username])
-    # CORREÇÃO CRÍTICA AQUI: Adicionado o hífen no join
-    room_slug = f"dm-{'-'.join(usernames)}"
-    
-    return redirect('chat:chat_room', room_slug=room_slug)
+    conversation = direct.get_or_create_conversation(request.user, other_user)
+    return redirect('chat:chat_room', room_slug=conversation.slug)
 
 # ... O restante do seu arquivo views.py permanece o mesmo
 def register_view(request):
@@ -254,8 +304,11 @@ def profile_view(request):
         u_form = UserUpdateForm(request.POST, instance=request.user)
         p_form = ProfileUpdateForm(request.POST, request.FILES, instance=request.user.profile)
         if u_form.is_valid() and p_form.is_valid():
-            u_form.save()
-            p_form.save()
+            # Só grava o que mudou: cada gravação invalida os rosters do usuário.
+            if u_form.has_changed():
+                u_form.save()
+            if p_form.has_changed():
+                p_form.save()
             messages.success(request, 'Seu perfil foi atualizado com sucesso!')
             return redirect('profile')
     else:
@@ -272,18 +325,18 @@ def credits_view(request):
 
 @login_required
 def clear_chat(request, room_slug):
-    room_name = room_slug
-    if not room_slug.startswith('dm-'):
+    if room_slug.startswith('dm-'):
+        conversation = direct.resolve(room_slug, request.user)
+        if conversation is None or request.user.id not in (conversation.user_a_id, conversation.user_b_id):
+            return JsonResponse({'status': 'error', 'message': 'Conversa não encontrada.'}, status=404)
+        room_state.clear(request.user, conversation=conversation)
+    else:
         try:
             room = ChatRoom.objects.get(slug=room_slug)
-            room_name = room.name
         except ChatRoom.DoesNotExist:
             return JsonResponse({'status': 'error', 'message': 'Sala não encontrada.'}, status=404)
+        room_state.clear(request.user, room=room)
 
-    messages_to_clear = ChatMessage.objects.filter(room_name=room_name)
-    for message in messages_to_clear:
-        message.deleted_by.add(request.user)
-    
     return JsonResponse({'status': 'ok', 'message': 'A conversa foi limpa para você.'})
 
 @login_required
@@ -295,8 +348,7 @@ def delete_room_view(request, room_slug):
         return redirect('index')
 
     if request.user == room.creator:
-        ChatMessage.objects.filter(room_name=room.name).delete()
-        room.delete()
+        purge.soft_delete_room(room)
         messages.success(request, f"A sala '{room.name}' foi deletada com sucesso.")
     else:
         messages.error(request, "Você não tem permissão para deletar esta sala.")
@@ -305,11 +357,6 @@ def delete_room_view(request, room_slug):
 @login_required
 def heartbeat_view(request):
     if request.method == 'POST':
-        try:
-            profile = Profile.objects.get(user=request.user)
-            profile.last_seen = timezone.now()
-            profile.save()
-            return JsonResponse({'status': 'ok'})
-        except Profile.DoesNotExist:
-            return JsonResponse({'status': 'Profile not found'}, status=404)
+        last_seen.touch(request.user.id)
+        return JsonResponse({'status': 'ok'})
     return JsonResponse({'status': 'bad request'}, status=400)
\ No newline at end of file
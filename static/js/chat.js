@@ -3,7 +3,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let isWindowActive = true;
     let unreadMessages = 0;
     const originalTitle = document.title;
-    window.onfocus = () => { isWindowActive = true; unreadMessages = 0; document.title = originalTitle; };
+    window.onfocus = () => { isWindowActive = true; unreadMessages = 0; document.title = originalTitle; markRead(); };
     window.onblur = () => { isWindowActive = false; };
 
     // Elementos do DOM
@@ -38,8 +38,10 @@ document.addEventListener('DOMContentLoaded', () => {
     const chatSettingsForm = document.getElementById('chat-settings-form');
     const userManagementList = document.getElementById('user-management-list');
     const muteRoomBtn = document.getElementById('mute-room-btn');
+    const slowModeSelect = document.getElementById('slow-mode-select');
 
     let currentUserList = [];
+    let rosterVersion = null; // null enquanto aguarda um snapshot completo
 
     if (settingsBtn) {
         settingsBtn.addEventListener('click', () => {
@@ -61,12 +63,14 @@ document.addEventListener('DOMContentLoaded', () => {
             e.preventDefault();
             const roomNameValue = document.getElementById('room-name-input').value;
             const userLimit = document.getElementById('user-limit-input').value;
+            const retentionDays = document.getElementById('retention-days-input').value;
 
-            chatSocket.send(JSON.stringify({
+            sendFrame({
                 'type': 'chat_settings',
                 'room_name': roomNameValue,
-                'user_limit': userLimit
-            }));
+                'user_limit': userLimit,
+                'retention_days': retentionDays
+            });
 
             chatSettingsModal.classList.remove('is-visible');
             document.body.classList.remove('modal-open');
@@ -75,38 +79,94 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if (muteRoomBtn) {
         muteRoomBtn.addEventListener('click', () => {
-            chatSocket.send(JSON.stringify({
+            sendFrame({
                 'type': 'admin_action',
                 'action': 'toggle_mute'
-            }));
+            });
+        });
+    }
+
+    if (slowModeSelect) {
+        slowModeSelect.addEventListener('change', () => {
+            sendFrame({
+                'type': 'admin_action',
+                'action': 'slow_mode',
+                'mode': slowModeSelect.value
+            });
         });
     }
 
     // Estado do WebSocket e do Chat
     let typingTimer;
     const TYPING_TIMER_LENGTH = 2000;
+    // O servidor expira o sinal de digitação sozinho; quem digita sem parar renova.
+    const TYPING_REFRESH_LENGTH = 3000;
+    let lastTypingSent = 0;
     let isTyping = false;
     let typingUsers = new Set();
     let isRoomMuted = false;
     let currentUserIsAdmin = false;
     let currentUserIsMuted = false;
+    let slowMode = null; // {mode, active, posts, interval}
     let chatSocket;
 
+    // --- Formato dos frames ---
+    // O socket compartilhado (static/js/socket.js) já entrega os frames
+    // decodificados; no MessagePack, eventos de alto volume chegam com chaves
+    // curtas. Deve ficar igual a COMPACT_EVENTS em chat/frames.py.
+    const COMPACT_EVENTS = {
+        'm': ['chat_message', { 'i': 'id', 'm': 'message', 'u': 'username', 't': 'timestamp', 'a': 'avatar_url', 'p': 'parent', 's': 'seq' }],
+        'y': ['typing_update', { 'u': 'users' }],
+        'd': ['presence_delta', { 'v': 'version', 'o': 'op', 'u': 'username', 'U': 'user', 'l': 'last_seen' }],
+    };
+
+    function decodeFrame(raw) {
+        const data = expandCompact(raw);
+        // Lote de eventos (salas movimentadas): cada um pode vir com chaves curtas.
+        if (data.type === 'batch') data.events = data.events.map(expandCompact);
+        return data;
+    }
+
+    function expandCompact(data) {
+        const compact = data.T !== undefined ? COMPACT_EVENTS[data.T] : null;
+        if (!compact) return data;
+        const [type, keys] = compact;
+        const expanded = { 'type': type };
+        for (const key in data) {
+            if (key !== 'T') expanded[keys[key] || key] = data[key];
+        }
+        return expanded;
+    }
+
+    // Cursor de leitura da sala: avança até a última mensagem vista, no
+    // máximo um mark_read por segundo.
+    let lastSeq = 0;
+    let readSeq = 0;
+    let markReadTimer = null;
+    function markRead() {
+        if (markReadTimer || lastSeq <= readSeq) return;
+        markReadTimer = setTimeout(() => {
+            markReadTimer = null;
+            if (lastSeq > readSeq && chatSocket.readyState === WebSocket.OPEN) {
+                readSeq = lastSeq;
+                sendFrame({ 'type': 'mark_read', 'seq': readSeq });
+            }
+        }, 1000);
+    }
+
+    function sendFrame(obj) {
+        chatSocket.send(obj);
+    }
+
     // --- Conexão WebSocket ---
+    // A sala é um stream do socket da página; o heartbeat é do socket.
     try {
-        const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        chatSocket = new WebSocket(`${protocol}://${window.location.host}/ws/chat/${roomSlug}/`);
+        chatSocket = window.multiplexSocket.subscribe(`room:${roomSlug}`);
     } catch (error) {
         addSystemMessage('Erro ao conectar ao chat.');
         return;
     }
 
-    const heartbeatInterval = setInterval(() => {
-        if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-            chatSocket.send(JSON.stringify({ 'heartbeat': true }));
-        }
-    }, 30000);
-
     chatSocket.onopen = () => { if (chatLog) chatLog.scrollTop = chatLog.scrollHeight; };
     chatSocket.onclose = (e) => {
         let message = 'Você foi desconectado.';
@@ -117,8 +177,12 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         if (e.code === 4003) message = 'A sala atingiu o limite de usuários.';
         if (e.code === 4004) message = 'Sala não encontrada ou não existe.';
+        if (e.code === 4008) {
+            // O servidor descartou mensagens para esta conexão lenta: recarrega o estado.
+            message = 'Conexão lenta. Recarregando a sala...';
+            setTimeout(() => window.location.reload(), 2000);
+        }
         addSystemMessage(message);
-        clearInterval(heartbeatInterval);
         if (messageInput) {
             messageInput.disabled = true;
             messageInput.placeholder = 'Conexão perdida.';
@@ -128,14 +192,25 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Manipulador de Mensagens ---
     chatSocket.onmessage = function(e) {
-        const data = JSON.parse(e.data);
+        handleEvent(decodeFrame(e.data));
+    };
+
+    function handleEvent(data) {
         switch (data.type) {
+            case 'batch':
+                data.events.forEach(handleEvent);
+                break;
             case 'room_state_update':
                 isRoomMuted = data.is_muted;
                 currentUserIsAdmin = data.is_admin;
+                if (data.slow_mode) applySlowMode(data.slow_mode);
                 updateInputState();
                 updateHeaderAdminButtons();
                 break;
+            case 'slow_mode_update':
+                applySlowMode(data);
+                updateInputState();
+                break;
             case 'mute_status_update':
                 isRoomMuted = data.is_muted;
                 addSystemMessage(data.message);
@@ -156,19 +231,25 @@ document.addEventListener('DOMContentLoaded', () => {
                 typingUsers.delete(data.username);
                 updateTypingIndicator();
                 addChatMessage(data);
+                if (data.seq) {
+                    lastSeq = Math.max(lastSeq, data.seq);
+                    if (isWindowActive) markRead();
+                }
                 break;
-            case 'typing_signal':
-                handleTypingSignal(data);
+            case 'history':
+                if (data.before) prependHistory(data);
+                break;
+            case 'typing_update':
+                typingUsers = new Set(data.users);
+                updateTypingIndicator();
                 break;
             case 'user_list_update':
+                rosterVersion = data.version;
                 currentUserList = data.users;
-                const currentUser = currentUserList.find(u => u.username === userName);
-                if (currentUser) {
-                    currentUserIsMuted = currentUser.is_muted;
-                }
-                updateUserList(data.users);
-                updateUserManagementList(data.users);
-                updateInputState();
+                renderRoster();
+                break;
+            case 'presence_delta':
+                applyPresenceDelta(data);
                 break;
             case 'user_status_update':
                 updateUserStatus(data);
@@ -196,12 +277,78 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
                 }
                 break;
+            case 'error':
+                addSystemMessage(data.message);
+                break;
             case 'heartbeat':
                 break; // Apenas para manter a conexão viva
             default:
                 console.warn('Tipo de mensagem desconhecido:', data.type);
         }
-    };
+    }
+
+    function applySlowMode(state) {
+        slowMode = state;
+        if (slowModeSelect) slowModeSelect.value = state.mode;
+    }
+
+    function renderRoster() {
+        const currentUser = currentUserList.find(u => u.username === userName);
+        if (currentUser) {
+            currentUserIsMuted = currentUser.is_muted;
+        }
+        updateUserList(currentUserList);
+        updateUserManagementList(currentUserList);
+        updateInputState();
+    }
+
+    function requestRosterSync() {
+        rosterVersion = null;
+        if (chatSocket.readyState === WebSocket.OPEN) {
+            sendFrame({ 'type': 'roster_sync' });
+        }
+    }
+
+    function applyPresenceDelta(data) {
+        if (rosterVersion === null || data.version <= rosterVersion) return;
+        if (data.version !== rosterVersion + 1) {
+            // Perdemos algum delta: pede o roster completo de novo.
+            requestRosterSync();
+            return;
+        }
+        rosterVersion = data.version;
+
+        const user = currentUserList.find(u => u.username === data.username);
+        switch (data.op) {
+            case 'joined':
+            case 'online':
+                if (!data.user) break;
+                if (user) {
+                    Object.assign(user, data.user);
+                } else {
+                    currentUserList.push(data.user);
+                }
+                break;
+            case 'offline':
+                if (user) {
+                    user.is_online = false;
+                    user.last_seen = data.last_seen;
+                }
+                break;
+            case 'left':
+                currentUserList = currentUserList.filter(u => u.username !== data.username);
+                break;
+            case 'promoted':
+            case 'demoted':
+                if (user) user.is_admin = data.op === 'promoted';
+                break;
+            case 'muted':
+            case 'unmuted':
+                if (user) user.is_muted = data.op === 'muted';
+                break;
+        }
+        renderRoster();
+    }
 
     function updateUserStatus(data) {
         const isDM = document.querySelector('.dm-container') !== null;
@@ -261,13 +408,13 @@ document.addEventListener('DOMContentLoaded', () => {
 
             document.getElementById('mute-room-btn').addEventListener('click', (e) => {
                 e.preventDefault();
-                chatSocket.send(JSON.stringify({ 'admin_action': 'mute' }));
+                sendFrame({ 'admin_action': 'mute' });
                 dropdown.classList.remove('visible');
             });
 
             document.getElementById('unmute-room-btn').addEventListener('click', (e) => {
                 e.preventDefault();
-                chatSocket.send(JSON.stringify({ 'admin_action': 'unmute' }));
+                sendFrame({ 'admin_action': 'unmute' });
                 dropdown.classList.remove('visible');
             });
         }
@@ -404,7 +551,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const { action, target } = actionBtn.dataset;
                 const actionText = actionBtn.textContent;
                 showConfirmationModal(`Tem certeza que deseja "${actionText}" o usuário "${target}"?`, () => {
-                    chatSocket.send(JSON.stringify({ 'type': 'admin_action', 'action': action, 'target': target }));
+                    sendFrame({ 'type': 'admin_action', 'action': action, 'target': target });
                 });
             }
         });
@@ -425,7 +572,9 @@ document.addEventListener('DOMContentLoaded', () => {
             messageInput.placeholder = 'Sala silenciada.';
         } else {
             messageInput.disabled = false;
-            messageInput.placeholder = 'Digite sua mensagem...';
+            messageInput.placeholder = slowMode && slowMode.active && !isAdmin
+                ? `Modo lento: ${slowMode.posts} mensagem(ns) a cada ${slowMode.interval}s`
+                : 'Digite sua mensagem...';
         }
     }
 
@@ -434,6 +583,14 @@ document.addEventListener('DOMContentLoaded', () => {
             addSystemMessage(data.message);
             return;
         }
+        const messageContainer = buildMessageElement(data);
+        if (chatLog) {
+            chatLog.appendChild(messageContainer);
+            chatLog.scrollTop = chatLog.scrollHeight;
+        }
+    }
+
+    function buildMessageElement(data) {
         const messageContainer = document.createElement('div');
         messageContainer.classList.add('chat-message', data.username === userName ? 'sent' : 'received');
         messageContainer.dataset.messageId = data.id; // Adiciona o ID da mensagem
@@ -476,11 +633,44 @@ document.addEventListener('DOMContentLoaded', () => {
                 <div class="message-timestamp">${data.timestamp}</div>
             </div>
             ${optionsHtml}`;
-        
-        if (chatLog) {
-            chatLog.appendChild(messageContainer);
-            chatLog.scrollTop = chatLog.scrollHeight;
-        }
+        return messageContainer;
+    }
+
+    // --- Histórico sob demanda ---
+    // A página traz só as mensagens mais recentes; ao rolar até o topo pedimos
+    // a página anterior à mensagem mais antiga exibida.
+    const historyHasMoreElement = document.getElementById('history-has-more');
+    let historyHasMore = historyHasMoreElement ? JSON.parse(historyHasMoreElement.textContent) : false;
+    let historyLoading = false;
+
+    function oldestMessageId() {
+        const first = chatLog ? chatLog.querySelector('.chat-message[data-message-id]') : null;
+        return first ? first.dataset.messageId : null;
+    }
+
+    function requestOlderHistory() {
+        const before = oldestMessageId();
+        if (!historyHasMore || historyLoading || !before || chatSocket.readyState !== WebSocket.OPEN) return;
+        historyLoading = true;
+        sendFrame({ 'type': 'fetch_history', 'before': before });
+    }
+
+    function prependHistory(data) {
+        historyLoading = false;
+        historyHasMore = data.has_more;
+        if (!chatLog || !data.messages.length) return;
+        const previousHeight = chatLog.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        data.messages.forEach(message => fragment.appendChild(buildMessageElement(message)));
+        chatLog.insertBefore(fragment, chatLog.firstChild);
+        // Mantém na tela a mesma mensagem que o usuário estava lendo.
+        chatLog.scrollTop += chatLog.scrollHeight - previousHeight;
+    }
+
+    if (chatLog) {
+        chatLog.addEventListener('scroll', () => {
+            if (chatLog.scrollTop < 80) requestOlderHistory();
+        });
     }
 
     function addSystemMessage(message) {
@@ -498,12 +688,6 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function handleTypingSignal(data) {
-        if (data.username === userName) return;
-        data.is_typing ? typingUsers.add(data.username) : typingUsers.delete(data.username);
-        updateTypingIndicator();
-    }
-
     function updateTypingIndicator() {
         if (!typingIndicator) return;
         const users = Array.from(typingUsers);
@@ -545,14 +729,15 @@ document.addEventListener('DOMContentLoaded', () => {
         messageInput.focus();
         messageInput.onkeyup = (e) => { if (e.key === 'Enter' && !messageInput.disabled) messageSubmit.click(); };
         messageInput.addEventListener('input', () => {
-            if (!isTyping) {
+            if (!isTyping || Date.now() - lastTypingSent > TYPING_REFRESH_LENGTH) {
                 isTyping = true;
-                if (chatSocket.readyState === WebSocket.OPEN) chatSocket.send(JSON.stringify({ 'is_typing': true }));
+                lastTypingSent = Date.now();
+                if (chatSocket.readyState === WebSocket.OPEN) sendFrame({ 'is_typing': true });
             }
             clearTimeout(typingTimer);
             typingTimer = setTimeout(() => {
                 isTyping = false;
-                if (chatSocket.readyState === WebSocket.OPEN) chatSocket.send(JSON.stringify({ 'is_typing': false }));
+                if (chatSocket.readyState === WebSocket.OPEN) sendFrame({ 'is_typing': false });
             }, TYPING_TIMER_LENGTH);
         });
     }
@@ -571,7 +756,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     if (replyingToId) {
                         data.reply_to = replyingToId;
                     }
-                    chatSocket.send(JSON.stringify(data));
+                    sendFrame(data);
                     if (messageInput) messageInput.value = '';
                     
                     // Reset reply state
@@ -610,7 +795,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const { action, target } = actionBtn.dataset;
                 const actionText = actionBtn.textContent;
                 showConfirmationModal(`Tem certeza que deseja "${actionText}" o usuário "${target}"?`, () => {
-                    chatSocket.send(JSON.stringify({ 'type': 'admin_action', 'action': action, 'target': target }));
+                    sendFrame({ 'type': 'admin_action', 'action': action, 'target': target });
                 });
                 return;
             }
@@ -666,11 +851,11 @@ document.addEventListener('DOMContentLoaded', () => {
             const messageElement = adminDeleteBtn.closest('.chat-message');
             const messageId = messageElement.dataset.messageId;
             showConfirmationModal(`Tem certeza que deseja apagar esta mensagem como administrador?`, () => {
-                chatSocket.send(JSON.stringify({
+                sendFrame({
                     'action': 'delete_message',
                     'message_id': messageId,
                     'scope': 'admin_delete'
-                }));
+                });
             });
             adminDeleteBtn.closest('.options-menu').style.display = 'none';
         }
@@ -711,22 +896,22 @@ document.addEventListener('DOMContentLoaded', () => {
 
         deleteForMeBtn.onclick = () => {
             if (messageToDeleteId) {
-                chatSocket.send(JSON.stringify({
+                sendFrame({
                     'action': 'delete_message',
                     'message_id': messageToDeleteId,
                     'scope': 'for_me'
-                }));
+                });
                 modal.classList.remove('is-visible');
             }
         };
 
         deleteForEveryoneBtn.onclick = () => {
             if (messageToDeleteId) {
-                chatSocket.send(JSON.stringify({
+                sendFrame({
                     'action': 'delete_message',
                     'message_id': messageToDeleteId,
                     'scope': 'for_everyone'
-                }));
+                });
                 modal.classList.remove('is-visible');
             }
         };
@@ -758,12 +943,6 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    window.addEventListener('beforeunload', () => {
-        if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-            chatSocket.send(JSON.stringify({ 'heartbeat': true }));
-        }
-    });
-
     const clearChatBtn = document.getElementById('clear-chat-btn');
     if (clearChatBtn) {
         clearChatBtn.addEventListener('click', () => {
@@ -0,0 +1,117 @@
+// Um WebSocket por página para o lobby e as salas (/ws/multiplex/). Cada
+// parte da página assina um stream ('lobby' ou 'room:<slug>') e recebe um
+// objeto com a mesma cara de um WebSocket: readyState, send(obj), onopen,
+// onmessage (e.data já decodificado), onclose (e.code do servidor) e close().
+// O heartbeat vai uma vez por socket. Com data-keepalive (usuário logado) o
+// socket abre em toda página, mantendo o last_seen mesmo sem sala aberta.
+(function() {
+    const MSGPACK_PROTOCOL = 'msgpack';
+    const HEARTBEAT_INTERVAL = 30000;
+    const keepAlive = document.currentScript && document.currentScript.hasAttribute('data-keepalive');
+
+    let socket = null;
+    let heartbeatInterval = null;
+    const streams = new Map();
+
+    function usingMsgpack() {
+        return socket && socket.protocol === MSGPACK_PROTOCOL;
+    }
+
+    function sendRaw(obj) {
+        if (!socket || socket.readyState !== WebSocket.OPEN) return;
+        socket.send(usingMsgpack() ? window.MessagePack.encode(obj) : JSON.stringify(obj));
+    }
+
+    function decode(raw) {
+        if (typeof raw === 'string') return JSON.parse(raw);
+        const data = window.MessagePack.decode(new Uint8Array(raw));
+        if (data.payload !== undefined) data.payload = window.MessagePack.decode(data.payload);
+        return data;
+    }
+
+    function connect() {
+        if (socket) return;
+        const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const url = `${protocol}://${window.location.host}/ws/multiplex/`;
+        // Com a biblioteca MessagePack carregada, pedimos frames binários.
+        socket = typeof window.MessagePack !== 'undefined' ? new WebSocket(url, [MSGPACK_PROTOCOL]) : new WebSocket(url);
+        socket.binaryType = 'arraybuffer';
+
+        socket.onopen = () => {
+            streams.forEach(stream => sendRaw({ 'type': 'subscribe', 'stream': stream.name, 'token': stream.token }));
+        };
+
+        socket.onmessage = (e) => {
+            const data = decode(e.data);
+            if (data.stream !== undefined && data.payload !== undefined) {
+                const stream = streams.get(data.stream);
+                if (stream && stream.onmessage) stream.onmessage({ data: data.payload });
+                return;
+            }
+            const stream = data.stream !== undefined ? streams.get(data.stream) : null;
+            switch (data.type) {
+                case 'subscribed':
+                    if (stream) {
+                        stream.readyState = WebSocket.OPEN;
+                        if (stream.onopen) stream.onopen();
+                    }
+                    break;
+                case 'unsubscribed':
+                    if (stream) closeStream(stream, data.code);
+                    break;
+                case 'error':
+                    console.warn('Erro no socket:', data.code, data.message);
+                    if (stream && data.code === 'unknown_stream') closeStream(stream, 1008);
+                    break;
+                case 'heartbeat':
+                    break;
+            }
+        };
+
+        socket.onclose = (e) => {
+            clearInterval(heartbeatInterval);
+            streams.forEach(stream => closeStream(stream, e.code));
+        };
+
+        socket.onerror = () => {
+            streams.forEach(stream => { if (stream.onerror) stream.onerror(); });
+        };
+
+        heartbeatInterval = setInterval(() => sendRaw({ 'type': 'heartbeat' }), HEARTBEAT_INTERVAL);
+    }
+
+    function closeStream(stream, code) {
+        if (stream.readyState === WebSocket.CLOSED) return;
+        stream.readyState = WebSocket.CLOSED;
+        streams.delete(stream.name);
+        if (stream.onclose) stream.onclose({ code: code });
+    }
+
+    function subscribe(name, options = {}) {
+        connect();
+        const stream = {
+            name: name,
+            token: options.token || null,
+            readyState: WebSocket.CONNECTING,
+            onopen: null,
+            onmessage: null,
+            onclose: null,
+            onerror: null,
+            send(obj) {
+                if (stream.readyState === WebSocket.OPEN) sendRaw({ 'stream': name, 'payload': obj });
+            },
+            close() {
+                if (stream.readyState === WebSocket.CLOSED) return;
+                sendRaw({ 'type': 'unsubscribe', 'stream': name });
+                closeStream(stream, 1000);
+            },
+        };
+        streams.set(name, stream);
+        sendRaw({ 'type': 'subscribe', 'stream': name, 'token': stream.token });
+        return stream;
+    }
+
+    window.multiplexSocket = { subscribe: subscribe };
+
+    if (keepAlive) document.addEventListener('DOMContentLoaded', connect);
+})();